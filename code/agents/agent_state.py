@@ -1,7 +1,12 @@
 from langchain_community.chat_message_histories import ChatMessageHistory
-from typing import TypedDict, Any, List
+from typing import TypedDict, Any, List, Dict, Annotated
 from langchain_core.runnables import Runnable
 
+def unisci_dizionari(a: dict | None, b: dict | None) -> dict:
+    """Reducer di `risposte`: i rami paralleli scrivono nello stesso passo, ognuno con la sua chiave."""
+    return {**(a or {}), **(b or {})}
+
+
 # Definizione stato tipizzato per il grafo 
 class AgentState(TypedDict, total=False):
     input: str
@@ -11,4 +16,6 @@ class AgentState(TypedDict, total=False):
     session_id: str       # Identificatore sessione per caricare/salvare memoria
     rag_chain: Runnable   # c'è solo se si carica aun file e si userà agente tecnico
                           # Meglio Runnable di Any...+ splicito: stai dicendo che lì ci deve stare una catena/costrutto LangChain compatibile con .invoke, .stream, ecc.
-    image_paths: List[str]     
\ No newline at end of file
+    image_paths: List[str]
+    tipi: List[str]       # Agenti scelti dal router (più di uno → rami paralleli)
+    risposte: Annotated[Dict[str, str], unisci_dizionari]   # Risposte dei rami paralleli, per agente     
\ No newline at end of file
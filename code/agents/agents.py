@@ -3,86 +3,110 @@
 from ..agents.agent_state import AgentState
 from ..utils.tools import cerca_contenuti, vlm_qna
 from ..memory.chat_memory import get_memory
-import re
+from langchain_community.chat_message_histories import ChatMessageHistory
+from ..utils.metrics import span, imposta_tipo, ROUTER_DECISIONS
+from ..config import TECNICO_SPECULATIVO
+from .speculazione import avvia_speculazione
+import re, time
 
 # === ROUTER PRINCIPALE ===
-#Funzione per creare un router che seleziona l'agente corretto in base alla query
-def router(state: AgentState, llm_router, logger=None) -> AgentState:
+# --- Parole chiave per Vision (radici) ---
+PAROLE_VISION = [
+    r"vedi",
+    r"img",    
+    r"immagin",    # immagine, immagini, immaginare
+    r"foto",       # foto, fotografare, fotografia
+    r"raffigur",   # raffigura, raffigurazione
+    r"disegn",     # disegno, disegnare
+]
+
+# --- Parole chiave rag (radici) ---
+PAROLE_RAG = [
+    r"pdf", r"csv", r"txt", r"docx", r"documento", r"manuale", r"contenuto",
+    r"riassum", r"analizz", r"esamin",
+    r"cerc", r"trova", r"ricerc", r"informazioni",
+    r"spieg", r"riassunto", r"file", r"parla", r"tratta"
+]
+
+# --- Pattern domande sul contenuto ---
+PATTERN_DOMANDE_CONTENUTO = [
+    "che cosa contiene",
+    "qual è il contenuto",
+    "fammi un riassunto",
+    "spiega il documento",
+]
+
+
+def routing_pattern(testo: str, has_image: bool, rag_disponibile: bool) -> list[str] | None:
     """
-    Router intelligente con approccio ibrido:
-    - Pattern first (veloce e gratuito)
-    - Fallback su LLM se il pattern non è chiaro
+    Decisione veloce basata su parole chiave (testo già normalizzato).
+    Ritorna la lista degli agenti ("vision", "tecnico", "generale"): più di uno se la domanda riguarda
+    sia le immagini sia i documenti (es. "confronta la foto con il manuale"). None se serve il fallback LLM.
     """
-
-    if "tipo" in state:   # serve a non far ricalcolare il routing se è già stato deciso in precedenza
-        return state
-
-    # Normalizzazione testo: minuscole + rimozione punteggiatura
-    testo = state["input"].lower()
-    testo = re.sub(r"[^\w\s]", "", testo)
-    
-    rag_disponibile = state.get("rag_chain") is not None
-    has_image = bool(state.get("image_paths"))
-
-    # -------------------
-    # 1) PATTERN FIRST
-    # -------------------
+    tipi = []
 
     # IMMAGINE + PATTERN TESTUALE --> VISION
     if has_image:
-
-    # --- Parole chiave per Vision (radici) ---
-        parole_vision = [
-            r"vedi",
-            r"img",    
-            r"immagin",    # immagine, immagini, immaginare
-            r"foto",       # foto, fotografare, fotografia
-            r"raffigur",   # raffigura, raffigurazione
-            r"disegn",     # disegno, disegnare
-        ]
         # Regex OR: intercetta radici (non solo la parola intera)
-        pattern_vision = r"(" + "|".join(parole_vision) + r")"
+        pattern_vision = r"(" + "|".join(PAROLE_VISION) + r")"
         
         # Se c'è un'imagine e almeno una parola relativa nel testo → agente vision
         if re.search(pattern_vision, testo):
-            state["tipo"] = "vision"
-            logger.info("🕵️ E' stato scelto l'agente vision")
-            return state
+            tipi.append("vision")
 
     # DOCUMENTO + PATTENR TESTUALE --> TECNICO
     if rag_disponibile:
-
-        # --- Parole chiave rag (radici) ---
-        parole_per_rag = [
-            r"pdf", r"csv", r"txt", r"docx", r"documento", r"manuale", r"contenuto",
-            r"riassum", r"analizz", r"esamin",
-            r"cerc", r"trova", r"ricerc", r"informazioni",
-            r"spieg", r"riassunto", r"file", r"parla", r"tratta"
-        ]
         # Regex OR: intercetta radici (non solo la parola intera)
-        pattern_tecniche = r"(" + "|".join(parole_per_rag) + r")" 
-
-        # --- Pattern domande sul contenuto ---
-        pattern_domande_contenuto = [
-            "che cosa contiene",
-            "qual è il contenuto",
-            "fammi un riassunto",
-            "spiega il documento",
-        ]
+        pattern_tecniche = r"(" + "|".join(PAROLE_RAG) + r")" 
 
         match_tecniche = re.search(pattern_tecniche, testo)               
-        match_domande = any(p in testo for p in pattern_domande_contenuto)
+        match_domande = any(p in testo for p in PATTERN_DOMANDE_CONTENUTO)
 
         # Se c'è una rag_chain e almeno una keyword tecnica nel testo → tecnico
         if match_tecniche or match_domande:
-            state["tipo"] = "tecnico"
-            logger.info("🕵️ E' stato scelto l'agente tecnico")
-            return state
+            tipi.append("tecnico")
+
+    if tipi:
+        return tipi
     
     # Generale → se nessuna immagine e documento caricati 
     if not has_image and not rag_disponibile:
-        state["tipo"] = "generale"
-        logger.info("🕵️ E' stato scelto l'agente generale")
+        return ["generale"]
+
+    return None
+
+
+#Funzione per creare un router che seleziona l'agente corretto in base alla query
+def router(state: AgentState, llm_router, logger=None) -> AgentState:
+    """
+    Router intelligente con approccio ibrido:
+    - Pattern first (veloce e gratuito)
+    - Fallback su LLM se il pattern non è chiaro
+    """
+
+    if "tipo" in state:   # serve a non far ricalcolare il routing se è già stato deciso in precedenza
+        return state
+
+    imposta_tipo("router")   # le chiamate LLM del fallback vengono etichettate come router
+
+    # Normalizzazione testo: minuscole + rimozione punteggiatura
+    testo = state["input"].lower()
+    testo = re.sub(r"[^\w\s]", "", testo)
+    
+    rag_disponibile = state.get("rag_chain") is not None
+    has_image = bool(state.get("image_paths"))
+
+    # -------------------
+    # 1) PATTERN FIRST
+    # -------------------
+    with span("routing_pattern") as s:
+        tipi = routing_pattern(testo, has_image, rag_disponibile)
+        s["tipo"] = "+".join(tipi) if tipi else "n/d"
+
+    if tipi:
+        imposta_tipi(state, tipi)
+        ROUTER_DECISIONS.labels(metodo="pattern", tipo=state["tipo"]).inc()
+        logger.info(f"🕵️ E' stato scelto l'agente {state['tipo']}")
         return state
 
 
@@ -95,8 +119,9 @@ def router(state: AgentState, llm_router, logger=None) -> AgentState:
         - Se la domanda riguarda un'immagine caricata (descriverla, analizzarla, capire cosa contiene) → "vision"
         - Se riguarda un documento caricato (contenuti di PDF, CSV, ecc.) → "tecnico"
         - Se è una domanda generale, senza legame con immagini o documenti → "generale"
+        - Se la domanda riguarda sia un'immagine sia un documento (es. confrontarli) → "vision, tecnico"
 
-        Rispondi SOLO con una delle tre parole: vision, tecnico, generale.
+        Rispondi SOLO con una o più delle tre parole, separate da virgola: vision, tecnico, generale.
 
         Contesto sessione:
         - Immagini caricate: {bool(state.get("image_paths"))}
@@ -104,33 +129,52 @@ def router(state: AgentState, llm_router, logger=None) -> AgentState:
 
         Messaggio utente: "{state['input']}"
         """
-        try:
-            decision = llm_router.invoke(router_prompt).strip().lower()
-            if decision in ["vision", "tecnico", "generale"]:
-                logger.info(f"🕵️ Il router intelligente ha scelto l'agente {decision}")
-                state["tipo"] = decision
-            else:
-                logger.info("🕵️ Il router intelligente non è riuscito a scegliere l'agente da usare: uso agente generale")
-                state["tipo"] = "generale"  # fallback sicuro
-        except Exception as e:
-            if logger:
-                logger.warning(f"⚠️ Router LLM failed, fallback a Generale: {e}")
-            state["tipo"] = "generale"
+        with span("routing_llm") as s:
+            try:
+                decision = llm_router.invoke(router_prompt).strip().lower()
+                parole = [p for p in re.split(r"\W+", decision) if p]
+                tipi = list(dict.fromkeys(parole)) if parole and all(p in AGENTI for p in parole) else []
+                if tipi:
+                    imposta_tipi(state, tipi)
+                    logger.info(f"🕵️ Il router intelligente ha scelto l'agente {state['tipo']}")
+                else:
+                    logger.info("🕵️ Il router intelligente non è riuscito a scegliere l'agente da usare: uso agente generale")
+                    imposta_tipi(state, ["generale"])  # fallback sicuro
+            except Exception as e:
+                if logger:
+                    logger.warning(f"⚠️ Router LLM failed, fallback a Generale: {e}")
+                imposta_tipi(state, ["generale"])
+            s["tipo"] = state["tipo"]
+        ROUTER_DECISIONS.labels(metodo="llm", tipo=state["tipo"]).inc()
     else:
         # Se non hai passato un llm_router → fallback standard
-        state["tipo"] = "generale"
+        imposta_tipi(state, ["generale"])
+        ROUTER_DECISIONS.labels(metodo="default", tipo="generale").inc()
 
     return state
 
     
 
 
+AGENTI = ("vision", "tecnico", "generale")
+
+
+def imposta_tipi(state: AgentState, tipi: list[str]):
+    """Agenti scelti dal router: `tipo` è la loro combinazione (es. "vision+tecnico"), usata come etichetta."""
+    state["tipi"] = tipi
+    state["tipo"] = "+".join(tipi)
+
+
 # Funzione per decidere il nodo successivo in base al tipo
-def agente_switch(state: AgentState) -> str:
+def agente_switch(state: AgentState) -> str | list[str]:
     """
     Switch routing per passare al nodo corretto.
+    Con più agenti scelti ritorna la lista dei nodi: LangGraph li esegue in parallelo (rami dello stesso passo).
     """
-    tipo = state.get("tipo")
+    tipi = [t for t in state.get("tipi") or [state.get("tipo")] if t in AGENTI]
+    if len(tipi) > 1:
+        return tipi
+    tipo = tipi[0] if tipi else None
     if tipo == "tecnico":
         return "tecnico"
     elif tipo == "vision":
@@ -138,6 +182,41 @@ def agente_switch(state: AgentState) -> str:
     return "generale"
 
 
+# Intestazioni delle risposte parziali nella risposta unita
+TITOLI_RISPOSTE = {"vision": "🖼️ Immagini", "tecnico": "📄 Documenti", "generale": "💬 Risposta generale"}
+
+
+def esegui_ramo(state: AgentState, tipo: str, agente) -> dict:
+    """
+    Esegue un agente come nodo del grafo. Con un solo agente scelto è il nodo di sempre (aggiorna tutto lo stato);
+    come ramo parallelo lavora su una copia dello stato e della memoria, e scrive solo la sua risposta
+    in `risposte`: i rami dello stesso passo non possono aggiornare le stesse chiavi dello stato.
+    """
+    if len(state.get("tipi") or []) <= 1:
+        return agente(state)
+    memoria = state.get("chat_memory") or get_memory(state["session_id"])
+    copia = {**state, "chat_memory": ChatMessageHistory(messages=list(memoria.messages))}
+    return {"risposte": {tipo: agente(copia)["output"]}}
+
+
+def unisci_risposte(state: AgentState, logger=None) -> AgentState:
+    """
+    Nodo di unione dei rami paralleli: compone le risposte degli agenti (nell'ordine scelto dal router)
+    in un'unica risposta e la salva in memoria una sola volta. Con un solo agente non fa nulla.
+    """
+    risposte = state.get("risposte") or {}
+    if len(state.get("tipi") or []) <= 1 or not risposte:
+        return {}
+    with span("unione_risposte", tipo=state["tipo"]):
+        result = "\n\n".join(f"**{TITOLI_RISPOSTE[t]}**\n{risposte[t]}" for t in state["tipi"] if t in risposte)
+        chat_memory = state.get("chat_memory") or get_memory(state["session_id"])
+        chat_memory.add_user_message(state["input"])
+        chat_memory.add_ai_message(result)
+    if logger:
+        logger.info(f"🔀 Unite le risposte degli agenti {', '.join(risposte)}")
+    return {"output": result, "chat_memory": chat_memory}
+
+
 # === AGENTE GENERALE ===
 def run_generale(state: AgentState, llm=None, logger=None) -> AgentState:
     """
@@ -145,6 +224,7 @@ def run_generale(state: AgentState, llm=None, logger=None) -> AgentState:
     Risponde a domande generiche, esegue calcoli e definizioni.
     Memorizza cronologia in file specifico  per sessione.
     """
+    imposta_tipo("generale")
     input_text = state["input"]
     session_id = state["session_id"]
 
@@ -171,6 +251,7 @@ def run_tecnico(state: AgentState, llm=None, logger=None) -> AgentState:
     Può anche eseguire calcoli o definizioni.
     Memorizza cronologia in file specifico per sessione.
     """
+    imposta_tipo("tecnico")
     input_text = state["input"]
     session_id = state["session_id"]
     rag_chain = state.get("rag_chain")  # preso dallo state
@@ -182,6 +263,9 @@ def run_tecnico(state: AgentState, llm=None, logger=None) -> AgentState:
 
     #RAG:
     if rag_chain is not None:
+        # Opzionale: la risposta LLM di fallback parte subito, in parallelo alla RAG (priorità speculativa)
+        speculazione = avvia_speculazione(llm, input_text, logger) if TECNICO_SPECULATIVO else None
+        inizio_rag = time.perf_counter()
         try:
             chat_memory.add_user_message(input_text) 
             logger.info("🛠️ E' stato scelto il tool 'cerca_contenuti'")
@@ -190,13 +274,14 @@ def run_tecnico(state: AgentState, llm=None, logger=None) -> AgentState:
             if not result.strip() or result.strip().lower() == "non lo so":
                 # fallback to LLM (se RAG non trova nulla uso gemini)
                 logger.info("📄 RAG non ha trovato risultati, uso LLM come fallback")
-                result = llm.invoke(input_text)
-                
+                result = speculazione.usa(time.perf_counter() - inizio_rag) if speculazione else llm.invoke(input_text)
+            elif speculazione:
+                speculazione.annulla()
 
         except Exception as e:
             if logger:
                 logger.warning(f"❌ Errore su RAG {str(e)}")
-            result = llm.invoke(input_text)
+            result = speculazione.usa(time.perf_counter() - inizio_rag) if speculazione else llm.invoke(input_text)
 
     #No tools, no RAG: fallback to LLM
     else:
@@ -225,6 +310,7 @@ def run_vision(state: AgentState, vision_model=None, logger=None) -> AgentState:
     """
     Agente Vision: usa il tool vlm_qna per rispondere a domande sulle immagini.
     """
+    imposta_tipo("vision")
 
     logger.info("🛠️ E' stato scelto il tool 'vlm_qna'")
     input_text = state.get("input", "")
@@ -1,35 +1,45 @@
 from typing import TypedDict
 from ..agents.agent_state import AgentState
 from langgraph.graph import StateGraph, END
-from ..agents.agents import router, agente_switch, run_tecnico, run_generale, run_vision
+from ..agents.agents import router, agente_switch, run_tecnico, run_generale, run_vision, esegui_ramo, unisci_risposte
 from langchain.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
 
 # === ORCHESTRAZIONE E ROUTING ===
 
 
-def build_graph(llm=None, vision_model=None, logger=None) -> StateGraph:
-    """Crea e restituisce il grafo dello stato con gli agenti"""
+def build_graph(llm=None, vision_model=None, logger=None, llm_router=None, llm_generale=None) -> StateGraph:
+    """
+    Crea e restituisce il grafo dello stato con gli agenti.
+    llm_router e llm_generale permettono un modello diverso (es. locale) per router e agente generale; default: llm.
+    """
+    llm_router = llm_router or llm
+    llm_generale = llm_generale or llm
 
     builder = StateGraph(AgentState)
     
     #Aggiungo i nodi al grafo + router come punto di ingresso
-    builder.add_node("router", lambda state: router(state, llm, logger=logger))
-    builder.add_node("tecnico", lambda state: run_tecnico(state, llm, logger=logger))
-    builder.add_node("generale", lambda state: run_generale(state, llm, logger=logger))
-    builder.add_node("vision", lambda state: run_vision(state, vision_model, logger=logger))
+    builder.add_node("router", lambda state: router(state, llm_router, logger=logger))
+    builder.add_node("tecnico", lambda state: esegui_ramo(
+        state, "tecnico", lambda s: run_tecnico(s, llm, logger=logger)))
+    builder.add_node("generale", lambda state: esegui_ramo(
+        state, "generale", lambda s: run_generale(s, llm_generale, logger=logger)))
+    builder.add_node("vision", lambda state: esegui_ramo(
+        state, "vision", lambda s: run_vision(s, vision_model, logger=logger)))
+    builder.add_node("unisci", lambda state: unisci_risposte(state, logger=logger))
     builder.set_entry_point("router")
 
-    # Condizioni per uscire dal router verso agente tecnico o generale
+    # Condizioni per uscire dal router verso uno o più agenti (più agenti → rami paralleli)
     builder.add_conditional_edges("router", agente_switch, {
         "tecnico": "tecnico",
         "generale": "generale",
         "vision": "vision"
     })
 
-    # Entrambi gli agenti portano all'END (fine flusso)
-    builder.add_edge("tecnico", END)
-    builder.add_edge("generale", END)
-    builder.add_edge("vision", END)
+    # Gli agenti portano al nodo di unione (eseguito una volta, dopo l'ultimo ramo) e poi all'END
+    builder.add_edge("tecnico", "unisci")
+    builder.add_edge("generale", "unisci")
+    builder.add_edge("vision", "unisci")
+    builder.add_edge("unisci", END)
 
     # Compilazione definitiva del grafo
     grafo = builder.compile()
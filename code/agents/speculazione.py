@@ -0,0 +1,91 @@
+#Esecuzione speculativa dell'agente tecnico: la risposta LLM semplice, usata quando la RAG risponde
+#"Non lo so" o fallisce, parte insieme alla pipeline RAG invece che dopo. Se la RAG risponde, la chiamata
+#speculativa viene annullata (se è ancora in coda nello scheduler Gemini) oppure il suo risultato scartato.
+
+import contextvars, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from ..config import TECNICO_SPECULAZIONI_AL_MINUTO
+from ..loader.gemini_scheduler import speculativa, RichiestaAnnullata
+from ..utils.metrics import imposta_tipo, TECNICO_SPECULATION, TECNICO_SPECULATION_SECONDS_SAVED
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="tecnico-speculativo")
+
+
+class _Budget:
+    """Tetto di costo: al massimo `limite` speculazioni negli ultimi 60 secondi."""
+    def __init__(self, limite: int):
+        self.limite = limite
+        self.avvii = deque()
+        self.lock = threading.Lock()
+
+    def consuma(self) -> bool:
+        with self.lock:
+            ora = time.monotonic()
+            while self.avvii and ora - self.avvii[0] > 60:
+                self.avvii.popleft()
+            if len(self.avvii) >= self.limite:
+                return False
+            self.avvii.append(ora)
+            return True
+
+
+_budget = _Budget(TECNICO_SPECULAZIONI_AL_MINUTO)
+
+
+class RispostaSpeculativa:
+    """Chiamata `llm.invoke(input_text)` avviata in background con priorità speculativa."""
+    def __init__(self, llm, input_text: str, logger=None):
+        self.llm = llm
+        self.input_text = input_text
+        self.logger = logger
+        self.annullamento = threading.Event()
+        self.inizio = time.perf_counter()
+        self.durata = None
+        # copy_context: la traccia della richiesta segue la chiamata nel thread
+        self.future = _executor.submit(contextvars.copy_context().run, self._esegui)
+
+    def _esegui(self) -> str:
+        imposta_tipo("speculativo")   # le fasi della chiamata speculativa non si mescolano a quelle del tecnico
+        with speculativa(self.annullamento):
+            risultato = self.llm.invoke(self.input_text)
+        self.durata = time.perf_counter() - self.inizio
+        return risultato
+
+    def usa(self, durata_rag: float) -> str:
+        """La RAG non ha risposto: ritorna la risposta speculativa (se è fallita ripete la chiamata in modo normale)."""
+        try:
+            risultato = self.future.result()
+        except Exception as e:
+            if self.logger:
+                self.logger.warning(f"⚠️ Risposta speculativa fallita, ripeto la chiamata LLM: {e}")
+            TECNICO_SPECULATION.labels(esito="fallita").inc()
+            return self.llm.invoke(self.input_text)
+
+        # Sequenziale: RAG + LLM; speculativo: il più lento dei due (misurato dall'avvio comune)
+        risparmio = max(0.0, durata_rag + self.durata - (time.perf_counter() - self.inizio))
+        TECNICO_SPECULATION.labels(esito="utile").inc()
+        TECNICO_SPECULATION_SECONDS_SAVED.inc(risparmio)
+        if self.logger:
+            self.logger.info(f"⚡ Risposta speculativa usata (risparmiati {risparmio:.2f}s)")
+        return risultato
+
+    def annulla(self):
+        """La RAG ha risposto: annulla la chiamata se non è ancora partita, altrimenti ne scarta il risultato."""
+        self.annullamento.set()
+        if self.future.cancel():
+            TECNICO_SPECULATION.labels(esito="annullata").inc()
+            return
+
+        def esito(f):
+            annullata = isinstance(f.exception(), RichiestaAnnullata)
+            TECNICO_SPECULATION.labels(esito="annullata" if annullata else "sprecata").inc()
+        self.future.add_done_callback(esito)
+
+
+def avvia_speculazione(llm, input_text: str, logger=None) -> RispostaSpeculativa | None:
+    """Avvia la risposta speculativa se il tetto di TECNICO_SPECULAZIONI_AL_MINUTO lo consente."""
+    if not _budget.consuma():
+        TECNICO_SPECULATION.labels(esito="saltata").inc()
+        return None
+    return RispostaSpeculativa(llm, input_text, logger)
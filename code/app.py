@@ -1,43 +1,69 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Response, Request
+from fastapi.responses import StreamingResponse
 from typing import Optional
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
 import uvicorn
 import asyncio
-import os, time
+import contextvars, hashlib, importlib, os, threading, time, json
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
 from .logger_utils import setup_logger
-from .config import LOG_DIR, VECTORSTORE_DIR, UPLOAD_DIR, MAX_FILE_SIZE_BYTE, LOG_LEVEL, LLM_MODEL_NAME, VLM_MODEL_NAME
+from .config import LOG_DIR, VECTORSTORE_DIR, UPLOAD_DIR, MEM_DIR, MAX_FILE_SIZE_BYTE, LOG_LEVEL, LLM_MODEL_NAME, VLM_MODEL_NAME, VLM_MAX_IMAGES, S3_SYNC_ENABLED
+from .config import LLM_BACKEND, LLM_LOCAL_MODEL_PATH, VECTORSTORE_MODALITA, CORPUS_DIR, CORPUS_SENZA_VOLUME, JANITOR_INTERVALLO_S
+from .config import INGESTIONE_BLOCCO_CHUNK, INGESTIONE_WORKERS, INGESTIONE_PARSING_WORKERS, AVVIO_RISCALDAMENTO
 from .utils.session import nuova_sessione_id
 from .utils.hashing import hash_file
 from .rag.loader_doc import load_documents
 from .rag.vectorstore import get_vectorstore_multidoc
-from .rag.rag_chain import build_rag_chain
-from .memory.chat_memory import get_memory, save_memory
-from .loader.llm_loader import get_llm_API, get_vlm_API
-from .agents.build_graph import build_graph
-from .storage.s3_utils import sync_folder_to_s3, sync_s3_to_folder
+from .rag.corpus import get_corpus, VistaCorpus
+from .rag.ingestione import RegistroJob
+from .rag.contesto_completo import build_contesto_completo_chain
+from .memory.chat_memory import get_memory, save_memory, messaggi_da_memoria, memoria_da_messaggi
+from .loader.llm_loader import get_llm_API, get_vlm_API, get_llm_locale
+from .loader.llama_pool import imposta_destinatario_token
+from .loader.cache_contesto import get_cache_contesto
+from .storage.s3_utils import sync_folder_to_s3, sync_s3_to_folder, download_file_from_s3, upload_file_to_s3
+from .storage.session_store import get_session_store, nuovo_record
+from .storage.janitor import esegui_pulizia
+from .utils.metrics import span, nuova_traccia, osserva_chat, metriche_prometheus
 
 # Lifespan: sync iniziale/finale con S3
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger = setup_logger(session="startup", level=LOG_LEVEL)
+    # Modelli, grafo e indice si preparano in un thread mentre parte la sync: il server accetta richieste
+    # appena la sync è finita, e le prime richieste attendono solo ciò che non è ancora pronto
+    sync_iniziale = threading.Event()
+    if AVVIO_RISCALDAMENTO:
+        threading.Thread(target=riscalda, args=(logger, sync_iniziale), name="riscaldamento", daemon=True).start()
+    if CORPUS_SENZA_VOLUME:
+        logger.warning("⚠️ Corpus condiviso disattivato: con S3 serve CORPUS_VOLUME_CONDIVISO=1 "
+                       "(repliche sullo stesso volume). Ogni sessione usa un indice proprio")
     logger.info("⬇️ Sync iniziale da S3...")
     try:
         sync_s3_to_folder("logs", LOG_DIR, logger)
-        sync_s3_to_folder("models_e_docs", UPLOAD_DIR, logger)
+        sync_s3_to_folder("models_e_docs", UPLOAD_DIR, logger, escludi=(CORPUS_DIR,))
         logger.info("✅ Sync iniziale completata")
     except Exception:
         logger.warning("⚠️ Sync iniziale da S3 saltato.")
+    finally:
+        sync_iniziale.set()
+
+    pulizia = asyncio.create_task(pulizia_periodica(logger)) if JANITOR_INTERVALLO_S else None
 
     yield
 
+    if pulizia is not None:
+        pulizia.cancel()
+
     logger.info("⬆️ Sync finale su S3 prima dello shutdown...")
     try:
         sync_folder_to_s3(LOG_DIR, "logs", logger)
-        sync_folder_to_s3(UPLOAD_DIR, "models_e_docs", logger)
+        sync_folder_to_s3(UPLOAD_DIR, "models_e_docs", logger, escludi=(CORPUS_DIR,))
         logger.info("✅ Sync finale completata")
     except Exception:
         logger.warning("⚠️ Sync finale su S3 saltato.")
@@ -52,62 +78,392 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Cache in RAM
-memory_cache = {}
-hash_cache = {}
+# Cache in RAM (locali al worker): la fonte di verità è lo store delle sessioni,
+# così qualunque worker/replica può servire qualunque sessione ricostruendo da lì.
+memory_cache = {}      # session_id → (versione_memoria del record, ChatMessageHistory)
 loggers_cache = {}
 grafi_cache = {}
+store = get_session_store()
+registro_job = RegistroJob(store)
+
+# Job di ingestion in un pool dedicato (non occupano il threadpool di asyncio usato dalla chat),
+# serializzati per sessione: due upload nella stessa sessione non si contendono il suo vectorstore
+_executor_ingestione = ThreadPoolExecutor(max_workers=INGESTIONE_WORKERS, thread_name_prefix="ingestione")
+_lock_ingestione = defaultdict(threading.Lock)
 
 # Inizializzazione globale
 log_level = LOG_LEVEL
 logger = setup_logger(session="Inizializzazione", level=log_level)
 logger.info("🚀 Inizializzazione backend...")
-llm = get_llm_API(model_name=LLM_MODEL_NAME, logger=logger)
-vlm = get_vlm_API(model_name=VLM_MODEL_NAME, logger=logger)
-grafo_default = build_graph(llm=llm, vision_model=vlm, logger=logger)
-grafi_cache["default"] = {"grafo": grafo_default, "rag_chain": None, "image_paths": []}
+
+# Client dei modelli e grafo di default: creati al primo uso (o dal riscaldamento in background),
+# così l'import di app.py non aspetta SDK Gemini, LangGraph e modelli locali
+_modelli = None
+_grafo_default = None
+_modelli_lock = threading.Lock()
+
+
+def get_modelli() -> dict:
+    """LLM e VLM Gemini, più router e agente generale (in locale con LLM_BACKEND="locale"), creati una volta sola."""
+    global _modelli
+    with _modelli_lock:
+        if _modelli is None:
+            llm = get_llm_API(model_name=LLM_MODEL_NAME, logger=logger)
+            vlm = get_vlm_API(model_name=VLM_MODEL_NAME, logger=logger)
+            if LLM_BACKEND == "locale":
+                # Router e agente generale in locale (llama.cpp); RAG e vision restano su Gemini
+                llm_router = get_llm_locale(LLM_LOCAL_MODEL_PATH, logger=logger)
+                llm_generale = get_llm_locale(LLM_LOCAL_MODEL_PATH, logger=logger, streaming=True)
+            else:
+                llm_router = llm_generale = llm
+            _modelli = {"llm": llm, "vlm": vlm, "llm_router": llm_router, "llm_generale": llm_generale}
+        return _modelli
+
+
+def crea_grafo(logger):
+    from .agents.build_graph import build_graph
+    m = get_modelli()
+    return build_graph(llm=m["llm"], vision_model=m["vlm"], logger=logger,
+                       llm_router=m["llm_router"], llm_generale=m["llm_generale"])
+
+
+def crea_rag_chain(vectorstore, logger, contesto_completo: bool = True):
+    """
+    Strategia RAG scelta sulla dimensione dei documenti della sessione: contesto completo (in cache)
+    se stanno entro RAG_CONTESTO_COMPLETO_TOKEN, altrimenti retrieval su FAISS.
+    contesto_completo=False forza il retrieval (documenti ancora in indicizzazione: il testo sarebbe parziale).
+    """
+    llm = get_modelli()["llm"]
+    if contesto_completo:
+        catena = build_contesto_completo_chain(
+            vectorstore, get_cache_contesto(llm, LLM_MODEL_NAME), logger=logger)
+        if catena is not None:
+            return catena
+    from .rag.rag_chain import build_rag_chain
+    return build_rag_chain(llm, vectorstore)
+
+
+def get_grafo_default():
+    """Grafo delle sessioni senza immagini né documenti, condiviso da tutte."""
+    global _grafo_default
+    if _grafo_default is None:
+        grafo = crea_grafo(logger)
+        with _modelli_lock:
+            if _grafo_default is None:
+                _grafo_default = grafo
+                grafi_cache["default"] = {"grafo": grafo, "rag_chain": None, "image_paths": []}
+    return _grafo_default
+
+
+# Moduli importati dal riscaldamento: loader dei documenti, catena RAG, indice FAISS
+MODULI_DA_RISCALDARE = [".rag.rag_chain", "langchain_community.document_loaders", "docx", "pandas"]
+
+
+def riscalda(logger, sync_iniziale: threading.Event | None = None):
+    """
+    Riscaldamento in background all'avvio: client dei modelli, grafo di default, embedder, corpus condiviso
+    e import pesanti, così la prima richiesta non ne paga il costo. Il corpus si carica solo a sync iniziale
+    finita (`sync_iniziale`): i file su disco sono quelli definitivi. Gli errori sono solo registrati:
+    ogni risorsa viene comunque creata al primo uso.
+    """
+    inizio = time.perf_counter()
+    try:
+        with span("riscaldamento", tipo="avvio"):
+            get_grafo_default()
+            for modulo in MODULI_DA_RISCALDARE:
+                importlib.import_module(modulo, __package__)
+            from .rag.embeddings import get_embeddings
+            get_embeddings()
+            if VECTORSTORE_MODALITA == "corpus":
+                if sync_iniziale is not None:
+                    sync_iniziale.wait()
+                get_corpus(logger)
+        logger.info(f"🔥 Riscaldamento completato in {time.perf_counter() - inizio:.2f}s")
+    except Exception as e:          # es. chiave API mancante: il server resta su, l'errore si ripresenta al primo uso
+        logger.error(f"❌ Riscaldamento non riuscito: {e!r}")
 
 class ChatRequest(BaseModel):
     session_id: str | None = None
     message: str
 
+
+def get_logger(session_id: str):
+    if session_id not in loggers_cache:
+        loggers_cache[session_id] = setup_logger(session=session_id, level=log_level)
+    return loggers_cache[session_id]
+
+
+def _percorso_s3(local_path) -> str:
+    """Chiave S3 di un file sotto UPLOAD_DIR (stesso schema di sync_folder_to_s3)."""
+    return f"models_e_docs/{os.path.relpath(local_path, UPLOAD_DIR).replace(os.sep, '/')}"
+
+
+def carica_vista_corpus(documenti: list[dict], logger):
+    """
+    Vectorstore della sessione come vista filtrata sul corpus condiviso.
+    Se il corpus del worker non contiene ancora tutti i documenti posseduti (indicizzati da un altro
+    worker o da un'altra replica sullo stesso volume) viene ricaricato da disco. Il corpus non passa da S3.
+    """
+    corpus = get_corpus(logger)
+    if any(d["hash"] not in corpus.ids_per_hash for d in documenti):
+        corpus.aggiorna_da_disco(logger)
+    elif any(corpus.in_indicizzazione(d["hash"]) for d in documenti):
+        corpus.aggiorna_da_disco(logger)    # blocchi indicizzati da un job in corso su un altro worker
+    if corpus.vectorstore is None:
+        logger.warning("⚠️ Corpus condiviso non disponibile: la sessione resta senza documenti")
+        return None
+    vista = corpus.vista(documenti)
+    if vista.hash_mancanti:
+        logger.warning(f"⚠️ {len(vista.hash_mancanti)} documenti della sessione non sono nel corpus condiviso")
+    return vista
+
+
+def carica_sessione(session_id: str, logger) -> dict:
+    """
+    Ritorna l'entry locale (grafo, rag_chain, vectorstore, image_paths) della sessione.
+    Se manca o è più vecchia della versione nello store viene ricostruita: immagini e vectorstore
+    vengono ricaricati da disco (o scaricati da S3 se la sessione è stata servita da un'altra replica).
+    """
+    record = store.get(session_id)
+    if record is None:
+        record = store.aggiorna(session_id, lambda r: None)
+
+    entry = grafi_cache.get(session_id)
+    if entry is not None and entry.get("versione") == record["versione"]:
+        vista = entry["vectorstore"]
+        if isinstance(vista, VistaCorpus) and any(not vista.corpus.contiene(h) for h in vista.nomi):
+            vista.corpus.aggiorna_da_disco(logger)   # ingestion in corso altrove: i nuovi blocchi sono subito cercabili
+        return entry
+
+    for p in record["image_paths"]:
+        if not os.path.exists(p):
+            download_file_from_s3(_percorso_s3(p), p, logger)
+    image_paths = [p for p in record["image_paths"] if os.path.exists(p)]
+
+    vectorstore, rag_chain = None, None
+    vectorstore_path = record["vectorstore_path"]
+    if vectorstore_path:
+        # Copia locale assente, oppure superata da un upload servito da un altro worker/replica → riscarico da S3
+        if not os.path.exists(vectorstore_path) or (S3_SYNC_ENABLED and entry is not None):
+            sync_s3_to_folder(_percorso_s3(vectorstore_path) + "/", vectorstore_path, logger)
+        vectorstore = get_vectorstore_multidoc(None, vectorstore_path, logger)
+        rag_chain = crea_rag_chain(vectorstore, logger)
+    elif record["documenti"]:
+        # Sessione sul corpus condiviso: nello store c'è solo la lista degli hash posseduti
+        vectorstore = carica_vista_corpus(record["documenti"], logger)
+        rag_chain = crea_rag_chain(vectorstore, logger) if vectorstore is not None else None
+
+    grafo = crea_grafo(logger) if (image_paths or rag_chain) else get_grafo_default()
+    entry = {"grafo": grafo, "rag_chain": rag_chain, "vectorstore": vectorstore,
+             "image_paths": image_paths, "versione": record["versione"]}
+    grafi_cache[session_id] = entry
+    logger.info(f"🔄 Sessione {session_id} caricata dallo store (versione {record['versione']})")
+    return entry
+
+
+def pubblica_documenti(session_id: str, modifica, vectorstore, logger, contesto_completo: bool = True):
+    """
+    Applica `modifica` al record della sessione (versione +1) e rende subito cercabile in chat `vectorstore`
+    (un oggetto, oppure una funzione del record aggiornato che lo costruisce).
+    """
+    def aggiorna(r):
+        modifica(r)
+        r["versione"] += 1
+    record = store.aggiorna(session_id, aggiorna)
+    if callable(vectorstore):
+        vectorstore = vectorstore(record)
+    grafi_cache[session_id] = {
+        "grafo": crea_grafo(logger), "rag_chain": crea_rag_chain(vectorstore, logger, contesto_completo),
+        "vectorstore": vectorstore,
+        "image_paths": [p for p in record["image_paths"] if os.path.exists(p)], "versione": record["versione"]}
+
+
+def conferma_documenti(session_id: str):
+    """
+    Versione +1 a fine job: gli altri worker ricaricano la sessione con i documenti completi. In questo worker
+    grafo e catena pubblicati restano validi (stesso vectorstore o vista, che vede già tutti i blocchi).
+    """
+    record = store.aggiorna(session_id, lambda r: r.update(versione=r["versione"] + 1))
+    entry = grafi_cache.get(session_id)
+    if entry is not None:
+        entry["versione"] = record["versione"]
+
+
+def _parsing(FILE_DIR: str, hash_documento: str, logger):
+    """load_documents di un file del job: un file senza contenuto o illeggibile non blocca gli altri."""
+    try:
+        docs = load_documents(logger=logger, FILE_DIR=FILE_DIR, hash_documento=hash_documento)
+        return docs if docs else ValueError(f"Nessun contenuto valido in {os.path.basename(FILE_DIR)}")
+    except Exception as e:
+        return e
+
+
+def esegui_ingestione(job, files: list[str], logger):
+    """
+    Job di ingestion in background di uno o più file: parsing in parallelo, indicizzazione a blocchi
+    di INGESTIONE_BLOCCO_CHUNK chunk (i chunk di file diversi condividono i batch di embedding e le scritture
+    dell'indice) e una sola sync su S3. I documenti entrano nella sessione al primo blocco indicizzato:
+    la chat cerca già nella parte indicizzata mentre il resto viene elaborato. Fase e avanzamento sono in `registro_job`.
+    """
+    session_id = job.session_id
+    nomi = ", ".join(os.path.basename(f) for f in files)
+    with _lock_ingestione[session_id]:
+        try:
+            registro_job.aggiorna(job, fase="parsing")
+            record = store.get(session_id) or nuovo_record()
+            hash_per_file = {f: _hash_upload(f) for f in files}
+
+            # Le sessioni create prima del corpus condiviso (vectorstore_path impostato) restano sul loro indice.
+            # vectorstore_sessione costruisce dal record aggiornato il vectorstore da pubblicare in chat
+            if VECTORSTORE_MODALITA == "corpus" and not record["vectorstore_path"]:
+                vectorstore_path = None
+                corpus = get_corpus(logger)
+                vectorstore_sessione = lambda r: corpus.vista(r["documenti"])
+            else:
+                vectorstore_path = f"{VECTORSTORE_DIR}/vectorstore_faiss_{session_id}"
+                corpus = None
+                vectorstore_sessione = lambda r: carica_sessione(session_id, logger)["vectorstore"]
+
+            # Adozione prima del controllo: la pulizia periodica non toglie dal corpus un documento che questa
+            # sessione sta per possedere (il record lo elenca solo dopo il primo blocco indicizzato)
+            nel_corpus = corpus.adotta(set(hash_per_file.values()), logger) if corpus is not None else set()
+            da_leggere = []
+            for f in files:
+                if hash_per_file[f] in nel_corpus:
+                    logger.info(f"♻️ '{os.path.basename(f)}' è già nel corpus condiviso: nessun parsing né embedding")
+                else:
+                    da_leggere.append(f)
+            # Un contesto copiato per file (copiato qui, non nel thread): gli span di parsing restano nella traccia del job
+            contesti = {f: contextvars.copy_context() for f in da_leggere}
+            with ThreadPoolExecutor(max_workers=max(1, min(INGESTIONE_PARSING_WORKERS, len(da_leggere)))) as pool:
+                letti = dict(zip(da_leggere, pool.map(
+                    lambda f: contesti[f].run(_parsing, f, hash_per_file[f], logger), da_leggere)))
+
+            scartati = [{"file": os.path.basename(f), "errore": str(r)} for f, r in letti.items() if isinstance(r, Exception)]
+            for s in scartati:
+                logger.warning(f"⚠️ '{s['file']}' scartato: {s['errore']}")
+            validi = [f for f in files if not isinstance(letti.get(f), Exception)]
+            if not validi:
+                raise ValueError(f"Nessun contenuto valido in {nomi}")
+            docs_per_hash = {}
+            for f in validi:
+                if f in letti:
+                    docs_per_hash.setdefault(hash_per_file[f], letti[f])    # stesso contenuto con due nomi: una volta sola
+
+            documenti = [{"file": f, "hash": hash_per_file[f]} for f in validi]
+
+            def aggiungi_documenti(r):
+                r["documenti"].extend(documenti)
+                r["hash"] = documenti[-1]["hash"]
+                r["vectorstore_path"] = vectorstore_path
+
+            totali = sum(len(docs) for docs in docs_per_hash.values())
+            if totali:
+                registro_job.aggiorna(job, fase="indicizzazione", chunk_totali=totali, scartati=scartati)
+                with span("indicizzazione", tipo="ingestion", chunk=totali, file=len(docs_per_hash)):
+                    if corpus is not None:
+                        def progresso(indicizzati, _):
+                            if not job.chunk_indicizzati:
+                                pubblica_documenti(session_id, aggiungi_documenti, vectorstore_sessione, logger)
+                            registro_job.aggiorna(job, chunk_indicizzati=indicizzati)
+                        corpus.aggiungi_documenti(docs_per_hash, logger, blocco=INGESTIONE_BLOCCO_CHUNK, progresso=progresso)
+                    else:
+                        tutti = [d for docs in docs_per_hash.values() for d in docs]
+                        vectorstore = carica_sessione(session_id, logger)["vectorstore"]
+                        for i in range(0, totali, INGESTIONE_BLOCCO_CHUNK):
+                            vectorstore = get_vectorstore_multidoc(
+                                tutti[i:i + INGESTIONE_BLOCCO_CHUNK], vectorstore_path, logger, vectorstore)
+                            if i == 0:   # i blocchi successivi si aggiungono allo stesso oggetto, già in chat
+                                pubblica_documenti(session_id, aggiungi_documenti, vectorstore, logger,
+                                                   contesto_completo=totali <= INGESTIONE_BLOCCO_CHUNK)
+                            registro_job.aggiorna(job, chunk_indicizzati=min(totali, i + INGESTIONE_BLOCCO_CHUNK))
+            elif scartati:
+                registro_job.aggiorna(job, scartati=scartati)
+
+            if not job.chunk_indicizzati:
+                # Documenti già nel corpus (o indicizzati da un job concorrente): entrano nella sessione così come sono
+                pubblica_documenti(session_id, aggiungi_documenti, vectorstore_sessione, logger)
+
+            registro_job.aggiorna(job, fase="sincronizzazione")
+            sync_folder_to_s3(UPLOAD_DIR, "models_e_docs", logger, escludi=(CORPUS_DIR,))
+            sync_folder_to_s3(LOG_DIR, "logs", logger)
+            logger.info("✅ Cartelle sincronizzate su S3")
+
+            # Nuova versione a fine job: gli altri worker ricostruiscono la sessione con i documenti completi
+            conferma_documenti(session_id)
+            registro_job.aggiorna(job, fase="completato")
+            logger.info(f"✅ Ingestion di {nomi} completata (job {job.id})")
+
+        except Exception as e:
+            logger.error(f"❌ Errore ingestion di {nomi} (job {job.id}): {e}", exc_info=True)
+            registro_job.aggiorna(job, fase="errore", errore=str(e))
+
+
+def dimentica_sessione(session_id: str):
+    """Toglie dalle cache del worker una sessione eliminata dalla pulizia periodica e chiude il suo file di log."""
+    memory_cache.pop(session_id, None)
+    grafi_cache.pop(session_id, None)
+    loggers_cache.pop((session_id, "initialized"), None)
+    logger_sessione = loggers_cache.pop(session_id, None)
+    if logger_sessione is not None:
+        for handler in list(logger_sessione.handlers):
+            handler.close()
+            logger_sessione.removeHandler(handler)
+
+
+async def pulizia_periodica(logger):
+    """Ogni JANITOR_INTERVALLO_S: sessioni scadute, artefatti non più referenziati e quota disco (storage/janitor.py)."""
+    while True:
+        await asyncio.sleep(JANITOR_INTERVALLO_S)
+        try:
+            await asyncio.to_thread(esegui_pulizia, store, logger, dimentica=dimentica_sessione)
+        except Exception as e:
+            logger.warning(f"⚠️ Pulizia periodica non riuscita: {e}")
+
+
+def carica_memoria(session_id: str):
+    """
+    Cronologia della sessione: cache locale se alla stessa versione_memoria dello store (il contatore
+    non torna mai indietro, neanche al reset), altrimenti dallo store (o dal file JSON).
+    """
+    record = store.get(session_id)
+    versione = record.get("versione_memoria", 0) if record else None
+    cache = memory_cache.get(session_id)
+    if cache is not None and (record is None or cache[0] == versione):
+        return cache[1]
+    messaggi = record.get("messaggi") if record else None
+    memory = memoria_da_messaggi(messaggi) if messaggi else get_memory(session_id)
+    memory_cache[session_id] = (versione or 0, memory)
+    return memory
+
+
+# Endpoint: Metriche Prometheus (durate per fase, richieste per agente, decisioni del router)
+@app.get("/metrics")
+def metrics():
+    payload, content_type = metriche_prometheus()
+    return Response(content=payload, media_type=content_type)
+
 # Endpoint: Init session
 @app.post("/init_session")
 def init_session():
     session_id = nuova_sessione_id()
     loggers_cache[session_id] = setup_logger(session=session_id, level=log_level)
-    memory_cache[session_id] = get_memory(session_id)
-    grafi_cache[session_id] = {"grafo": grafo_default, "rag_chain": None, "vectorstore": None, "image_paths": []}
-    hash_cache[session_id] = None
+    store.put(session_id, nuovo_record())
+    memory_cache[session_id] = (0, get_memory(session_id))
+    grafi_cache[session_id] = {"grafo": get_grafo_default(), "rag_chain": None, "vectorstore": None, "image_paths": [], "versione": 0}
     return {"session_id": session_id}
 
 # Endpoint: Chat
-@app.post("/chat")
-async def chat_endpoint(data: ChatRequest):
-    session_id = data.session_id
-    if not session_id:
-        raise HTTPException(status_code=400, detail="session_id obbligatorio")
+STREAM_CONTENT_TYPE = "application/x-ndjson"
 
-    if session_id not in loggers_cache:
-        loggers_cache[session_id] = setup_logger(session=session_id, level=log_level)
-    logger = loggers_cache[session_id]
-
-    memory = memory_cache.get(session_id) or get_memory(session_id)
-    memory_cache[session_id] = memory
-
-    if (session_id, "initialized") not in loggers_cache:
-        if not memory.messages:
-            logger.info(f"🟢 Avvio sessione: '{session_id}'")
-        else:
-            logger.info(f"📚 Memoria iniziale: {len(memory.messages)} messaggi")
-        loggers_cache[(session_id, "initialized")] = True
 
-    message = data.message.strip()
-    logger.info(f"👤 Domanda: {message}")
+async def esegui_chat(session_id: str, message: str, memory, logger) -> dict:
+    """Esegue il grafo per un messaggio e salva la memoria. Ritorna il payload di risposta (anche in caso di errore)."""
+    nuova_traccia(session_id)
     start = time.perf_counter()
 
     try:
-        grafo_entry = grafi_cache.get(session_id, grafi_cache["default"])
+        grafo_entry = await asyncio.to_thread(carica_sessione, session_id, logger)
         grafo = grafo_entry["grafo"]
         rag_chain = grafo_entry["rag_chain"]
         image_paths = grafo_entry.get("image_paths", [])
@@ -120,7 +476,7 @@ async def chat_endpoint(data: ChatRequest):
                     "session_id": session_id,
                     "chat_memory": memory,
                     "rag_chain": rag_chain,
-                    "image_paths": image_paths[-1:],
+                    "image_paths": image_paths[-VLM_MAX_IMAGES:],
                 },
             ),
             timeout=30,
@@ -130,8 +486,16 @@ async def chat_endpoint(data: ChatRequest):
         logger.info(f"🤖 Risposta: {risposta['output']}")
         logger.info(f"⏳ Tempo di risposta: {elapsed:.3f}s")
 
-        memory_cache[session_id] = risposta["chat_memory"]
-        save_memory(session_id, risposta["chat_memory"])
+        with span("salvataggio_memoria", tipo=risposta["tipo"]):
+            messaggi = messaggi_da_memoria(risposta["chat_memory"])
+
+            def salva_messaggi(r):
+                r["messaggi"] = messaggi
+                r["versione_memoria"] = r.get("versione_memoria", 0) + 1
+            record = store.aggiorna(session_id, salva_messaggi)
+            memory_cache[session_id] = (record["versione_memoria"], risposta["chat_memory"])
+            save_memory(session_id, risposta["chat_memory"])
+        osserva_chat(risposta["tipo"], elapsed)
 
         return {
             "session_id": session_id,
@@ -142,26 +506,74 @@ async def chat_endpoint(data: ChatRequest):
 
     except asyncio.TimeoutError:
         msg = "⚠️ Timeout: il modello non ha risposto in tempo."
+        osserva_chat("errore", time.perf_counter() - start, esito="timeout")
     except Exception as e:
         logger.error(f"❌ Errore durante chat: {e}", exc_info=True)
         msg = f"⚠️ Errore: {str(e)}"
+        osserva_chat("errore", time.perf_counter() - start, esito="errore")
 
     return {"session_id": session_id, "agente": "errore", "risposta": msg, "elapsed_time": 0.0}
 
+
+async def esegui_chat_streaming(session_id: str, message: str, memory, logger):
+    """
+    Come esegui_chat ma in NDJSON: una riga {"evento": "token", "testo": ...} per ogni token generato
+    dagli LLM in streaming (backend locale) e una riga finale {"evento": "fine", ...} con il payload completo.
+    """
+    coda = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+    # Il destinatario viaggia nel contesto: create_task e to_thread lo propagano fino all'LLM nel thread del grafo
+    imposta_destinatario_token(lambda testo: loop.call_soon_threadsafe(coda.put_nowait, testo))
+    compito = asyncio.create_task(esegui_chat(session_id, message, memory, logger))
+
+    while True:
+        prossimo = asyncio.create_task(coda.get())
+        fatti, _ = await asyncio.wait({prossimo, compito}, return_when=asyncio.FIRST_COMPLETED)
+        if prossimo not in fatti:
+            prossimo.cancel()
+            break
+        yield json.dumps({"evento": "token", "testo": prossimo.result()}, ensure_ascii=False) + "\n"
+
+    while not coda.empty():
+        yield json.dumps({"evento": "token", "testo": coda.get_nowait()}, ensure_ascii=False) + "\n"
+    yield json.dumps({"evento": "fine", **compito.result()}, ensure_ascii=False) + "\n"
+
+
+@app.post("/chat")
+async def chat_endpoint(data: ChatRequest, request: Request):
+    session_id = data.session_id
+    if not session_id:
+        raise HTTPException(status_code=400, detail="session_id obbligatorio")
+
+    logger = get_logger(session_id)
+    memory = await asyncio.to_thread(carica_memoria, session_id)
+
+    if (session_id, "initialized") not in loggers_cache:
+        if not memory.messages:
+            logger.info(f"🟢 Avvio sessione: '{session_id}'")
+        else:
+            logger.info(f"📚 Memoria iniziale: {len(memory.messages)} messaggi")
+        loggers_cache[(session_id, "initialized")] = True
+
+    message = data.message.strip()
+    logger.info(f"👤 Domanda: {message}")
+
+    # Il frontend chiede lo streaming con "Accept: application/x-ndjson"; gli altri client ricevono il JSON di sempre
+    if STREAM_CONTENT_TYPE in request.headers.get("accept", ""):
+        return StreamingResponse(esegui_chat_streaming(session_id, message, memory, logger),
+                                 media_type=STREAM_CONTENT_TYPE)
+    return await esegui_chat(session_id, message, memory, logger)
+
 # Endpoint: Reset session
 @app.post("/reset")
 async def reset_session(session_id: str):
-    if session_id not in loggers_cache:
-        loggers_cache[session_id] = setup_logger(session=session_id, level=log_level)
-    logger = loggers_cache[session_id]
+    logger = get_logger(session_id)
 
     loggers_cache.pop((session_id, "initialized"), None)
     memory_cache.pop(session_id, None)
     grafi_cache.pop(session_id, None)
-    hash_cache.pop(session_id, None)
 
-    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-    path = os.path.join(BASE_DIR, "memorie_utenti", f"{session_id}.json")
+    path = os.path.join(MEM_DIR, f"{session_id}.json")
     
     if os.path.exists(path):
         os.remove(path)
@@ -169,80 +581,170 @@ async def reset_session(session_id: str):
     else:
         logger.info(f"RESET: Nessun file memoria per {session_id}")
 
+    def azzera(r):
+        # Record nuovo ma contatori monotoni: una cache di un altro worker alla versione pre-reset
+        # non può tornare "allineata" quando la sessione azzerata raggiunge lo stesso numero di versione
+        versione, versione_memoria = r["versione"], r.get("versione_memoria", 0)
+        r.clear()
+        r.update(nuovo_record(), versione=versione + 1, versione_memoria=versione_memoria + 1)
+    record = store.aggiorna(session_id, azzera)
+
     loggers_cache[session_id] = setup_logger(session=session_id, level=log_level)
-    memory_cache[session_id] = get_memory(session_id)
-    grafi_cache[session_id] = {"grafo": grafo_default, "rag_chain": None, "vectorstore": None, "image_paths": []}
+    memory_cache[session_id] = (record["versione_memoria"], get_memory(session_id))
+    grafi_cache[session_id] = {"grafo": get_grafo_default(), "rag_chain": None, "vectorstore": None, "image_paths": [],
+                               "versione": record["versione"]}
 
     return {"status": "reset", "message": f"Sessione {session_id} cancellata"}
 
 # Endpoint: Upload file
+FORMATI_IMMAGINE = ["png", "jpg", "jpeg", "bmp", "webp"]
+FORMATI_DOCUMENTO = ["pdf", "txt", "docx", "csv"]
+
+
+def _estensione(filename: str) -> str:
+    return filename.lower().split('.')[-1]
+
+
+async def salva_upload(file: UploadFile, session_id: str, logger) -> str:
+    """
+    Salva il file in UPLOAD_DIR/<sha256 del contenuto>/<nome> (413 se supera MAX_FILE_SIZE_BYTE). Ritorna il percorso.
+    Upload con lo stesso nome da sessioni diverse non si sovrascrivono; lo stesso file è salvato una volta sola.
+    """
+    contents = await file.read()
+    if len(contents) > MAX_FILE_SIZE_BYTE:
+        msg = f"❌ File troppo grande (max {MAX_FILE_SIZE_BYTE / 1024 / 1024} MB)"
+        logger.warning(msg)
+        raise HTTPException(status_code=413, detail=msg)
+
+    hash_documento = await asyncio.to_thread(lambda: hashlib.sha256(contents).hexdigest())
+    FILE_DIR = os.path.join(UPLOAD_DIR, hash_documento, os.path.basename(file.filename))
+    os.makedirs(os.path.dirname(FILE_DIR), exist_ok=True)
+    temporaneo = f"{FILE_DIR}.{os.getpid()}.tmp"     # rinominato: un job concorrente sullo stesso file lo legge intero
+    with open(temporaneo, "wb") as buffer:
+        buffer.write(contents)
+    os.replace(temporaneo, FILE_DIR)
+    logger.info(f"📂 File '{file.filename}' ({len(contents)} byte) caricato in sessione {session_id}")
+    return FILE_DIR
+
+
+def _hash_upload(path: str) -> str:
+    """SHA-256 di un file salvato da salva_upload: è il nome della sua cartella, calcolato al salvataggio."""
+    cartella = os.path.basename(os.path.dirname(path))
+    return cartella if len(cartella) == 64 else hash_file(path)     # file salvati altrove: si calcola qui
+
+
+def aggiungi_immagini(session_id: str, paths: list[str], logger):
+    """Aggiunge le immagini alla sessione: una sola nuova versione e un solo grafo per tutte."""
+    entry = carica_sessione(session_id, logger)
+    # Prima su S3, poi la nuova versione: una replica che ricarica la sessione trova già le immagini
+    if S3_SYNC_ENABLED:
+        for p in paths:
+            try:
+                upload_file_to_s3(p, _percorso_s3(p))
+            except Exception:
+                logger.warning("⚠️ Upload immagine su S3 non riuscito")
+
+    def aggiungi(r):
+        r["image_paths"].extend(paths)
+        r["versione"] += 1
+    record = store.aggiorna(session_id, aggiungi)
+    grafi_cache[session_id] = {**entry, "grafo": crea_grafo(logger), "image_paths": entry["image_paths"] + paths,
+                               "versione": record["versione"]}
+
+
+def avvia_ingestione(session_id: str, files: list[str], logger):
+    """Registra il job di ingestion dei documenti e lo accoda nel pool dedicato."""
+    job = registro_job.crea(session_id, files)
+    _executor_ingestione.submit(contextvars.copy_context().run, esegui_ingestione, job, files, logger)
+    logger.info(f"📥 Ingestion di {', '.join(os.path.basename(f) for f in files)} avviata (job {job.id})")
+    return job
+
+
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...), session_id: Optional[str] = Form(None)):
+async def upload_file(response: Response, file: UploadFile = File(...), session_id: Optional[str] = Form(None)):
+    """
+    Salva il file. Le immagini sono subito disponibili; per i documenti parte un job di ingestion
+    in background e la risposta (202) contiene il suo `job_id`, da seguire con GET /upload/{job_id}.
+    """
     if not session_id:
         raise HTTPException(status_code=400, detail="session_id mancante")
 
-    if session_id not in loggers_cache:
-        loggers_cache[session_id] = setup_logger(session=session_id, level="INFO")
-    logger = loggers_cache[session_id]
-
-    if session_id not in memory_cache:
-        memory_cache[session_id] = get_memory(session_id)
-
-    if session_id not in grafi_cache:
-        grafi_cache[session_id] = {"grafo": grafi_cache["default"]["grafo"], "rag_chain": None, "vectorstore": None, "image_paths": []}
+    logger = get_logger(session_id)
 
     try:
         filename = file.filename
-        FILE_DIR = os.path.join(UPLOAD_DIR, filename)
-        ext = filename.lower().split('.')[-1]
-
-        contents = await file.read()
-        if len(contents) > MAX_FILE_SIZE_BYTE:
-            msg = f"❌ File troppo grande (max {MAX_FILE_SIZE_BYTE / 1024 / 1024} MB)"
-            logger.warning(msg)
-            raise HTTPException(status_code=413, detail=msg)
-
-        with open(FILE_DIR, "wb") as buffer:
-            buffer.write(contents)
+        ext = _estensione(filename)
+        FILE_DIR = await salva_upload(file, session_id, logger)
         file_size = os.path.getsize(FILE_DIR)
-        logger.info(f"📂 File '{filename}' ({file_size} byte) caricato in sessione {session_id}")
 
         # Immagini
-        if ext in ["png", "jpg", "jpeg", "bmp", "webp"]:
-            grafi_cache[session_id].setdefault("image_paths", []).append(FILE_DIR)
-            grafo = build_graph(llm=llm, vision_model=vlm, logger=logger)
-            grafi_cache[session_id]["grafo"] = grafo
-            hash_cache[session_id] = None
+        if ext in FORMATI_IMMAGINE:
+            await asyncio.to_thread(aggiungi_immagini, session_id, [FILE_DIR], logger)
             return {"message": f"✅ Immagine '{filename}' caricata", "size": file_size, "session_id": session_id, "type": "image"}
 
         # Documenti
-        if ext not in ["pdf", "txt", "docx", "csv"]:
+        if ext not in FORMATI_DOCUMENTO:
             raise HTTPException(status_code=415, detail=f"Formato non supportato: .{ext}")
 
-        pdf_hash = hash_file(FILE_DIR)
-        vectorstore_path = f"{VECTORSTORE_DIR}/vectorstore_faiss_{session_id}"
-        docs = load_documents(logger=logger, FILE_DIR=FILE_DIR)
-        if not docs:
-            raise HTTPException(status_code=400, detail=f"⚠️ Nessun contenuto valido in {filename}")
+        job = await asyncio.to_thread(avvia_ingestione, session_id, [FILE_DIR], logger)
+        response.status_code = 202
+        return {"message": f"⏳ File '{filename}' ricevuto: indicizzazione in corso", "size": file_size,
+                "session_id": session_id, "type": "document", "job_id": job.id, "status_url": f"/upload/{job.id}"}
 
-        if session_id in grafi_cache and "vectorstore" in grafi_cache[session_id]:
-            vectorstore = get_vectorstore_multidoc(docs, vectorstore_path, logger, grafi_cache[session_id]["vectorstore"])
-            logger.info("🔁 Vectorstore aggiornato.")
-        else:
-            vectorstore = get_vectorstore_multidoc(docs, vectorstore_path, logger)
-            logger.info("🆕 Vectorstore creato.")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Errore upload: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Errore durante upload.")
 
-        rag_chain = build_rag_chain(llm, vectorstore)
-        grafo = build_graph(llm=llm, vision_model=vlm, logger=logger)
-        grafi_cache[session_id] = {"grafo": grafo, "rag_chain": rag_chain, "vectorstore": vectorstore}
-        hash_cache[session_id] = pdf_hash
 
-        sync_folder_to_s3(UPLOAD_DIR, "models_e_docs", logger)
-        sync_folder_to_s3(LOG_DIR, "logs", logger)
-        logger.info("✅ Cartelle sincronizzate su S3")
+# Endpoint: Upload di più file in una richiesta
+@app.post("/upload_multiplo")
+async def upload_multiplo(response: Response, files: list[UploadFile] = File(...), session_id: Optional[str] = Form(None)):
+    """
+    Come /upload per più file: le immagini sono aggiunte insieme, i documenti formano un unico job
+    (parsing in parallelo, chunk di tutti i file negli stessi batch di embedding, una scrittura dell'indice
+    per blocco, una ricostruzione della catena e una sync S3 per l'intero upload).
+    """
+    if not session_id:
+        raise HTTPException(status_code=400, detail="session_id mancante")
 
-        return {"message": f"✅ File '{filename}' caricato", "size": file_size, "session_id": session_id, "type": "document"}
+    logger = get_logger(session_id)
 
+    non_supportati = [f.filename for f in files if _estensione(f.filename) not in FORMATI_IMMAGINE + FORMATI_DOCUMENTO]
+    if non_supportati:
+        raise HTTPException(status_code=415, detail=f"Formato non supportato: {', '.join(non_supportati)}")
+
+    try:
+        paths = [await salva_upload(f, session_id, logger) for f in files]
+        immagini = [p for p in paths if _estensione(p) in FORMATI_IMMAGINE]
+        documenti = [p for p in paths if _estensione(p) in FORMATI_DOCUMENTO]
+
+        risposta = {"session_id": session_id, "files": [os.path.basename(p) for p in paths],
+                    "size": sum(os.path.getsize(p) for p in paths)}
+        if immagini:
+            await asyncio.to_thread(aggiungi_immagini, session_id, immagini, logger)
+        if not documenti:
+            return {**risposta, "message": f"✅ {len(immagini)} immagini caricate", "type": "image"}
+
+        job = await asyncio.to_thread(avvia_ingestione, session_id, documenti, logger)
+        response.status_code = 202
+        return {**risposta, "message": f"⏳ {len(documenti)} documenti ricevuti: indicizzazione in corso"
+                + (f", {len(immagini)} immagini caricate" if immagini else ""),
+                "type": "document", "job_id": job.id, "status_url": f"/upload/{job.id}"}
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Errore upload: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Errore durante upload.")
+
+
+# Endpoint: Stato di un job di ingestion
+@app.get("/upload/{job_id}")
+def stato_upload(job_id: str, session_id: str):
+    """Fase (in_coda, parsing, indicizzazione, sincronizzazione, completato, errore), chunk indicizzati ed ETA."""
+    stato = registro_job.stato(session_id, job_id)
+    if stato is None:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    return stato
@@ -1,9 +1,10 @@
 import chainlit as cl
+import asyncio
 import httpx
+import json
 import os
+from contextlib import ExitStack
 from dotenv import load_dotenv
-from utils.session import nuova_sessione_id
-import requests
 
 #Carico variabili da file .env
 load_dotenv()
@@ -14,20 +15,52 @@ BACKEND_BASE = os.getenv("BACKEND_BASE", f"http://localhost:{BACKEND_PORT}")
 BACKEND_URL = f"{BACKEND_BASE}/chat"
 RESET_URL = f"{BACKEND_BASE}/reset"
 UPLOAD_URL = f"{BACKEND_BASE}/upload"
+UPLOAD_MULTIPLO_URL = f"{BACKEND_BASE}/upload_multiplo"
 INIT_URL = f"{BACKEND_BASE}/init_session"
 
+# Avanzamento dell'indicizzazione dei documenti (job in background sul backend)
+INTERVALLO_STATO_UPLOAD_S = 1.0
+
+# Il backend può rispondere alla /chat in streaming (NDJSON) o con un unico JSON
+STREAM_CONTENT_TYPE = "application/x-ndjson"
+
+# ---------------------------
+# Client HTTP condiviso
+# ---------------------------
+# Un solo AsyncClient per processo: pool di connessioni keep-alive riusate da tutti gli utenti,
+# invece di una nuova connessione TCP per ogni messaggio, reset o upload.
+_client: httpx.AsyncClient | None = None
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(80.0, connect=10.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60.0),
+        )
+    return _client
+
+@cl.on_app_shutdown
+async def on_app_shutdown():
+    if _client is not None:
+        await _client.aclose()
+
+async def nuova_sessione_backend() -> str | None:
+    res = await get_client().post(INIT_URL)
+    res.raise_for_status()
+    return res.json().get("session_id")
+
 # ---------------------------
 # Inizio chat
 # ---------------------------
 @cl.on_chat_start
 async def on_chat_start():
-    global session_id
     try:
-        res = requests.post(INIT_URL)
-        session_id = res.json()["session_id"]
+        session_id = await nuova_sessione_backend()
         if not session_id:
             await cl.Message(content="Errore: risposta senza session_id").send()
             return
+        cl.user_session.set("session_id", session_id)
         welcome_msg = await cl.Message(content=f"👋 **Ciao!** Sono pronto ad aiutarti.").send()
     except Exception as e:
         await cl.Message(content=f"Errore inizializzazione sessione: {e}").send()
@@ -45,61 +78,131 @@ async def on_chat_start():
 # ---------------------------
 @cl.action_callback("reset_chat")
 async def on_reset(action):
-    global session_id
     try:
+        session_id = cl.user_session.get("session_id")
         if session_id is not None:
-            async with httpx.AsyncClient() as client:
-                await client.post(RESET_URL, params={"session_id": session_id})
-        async with httpx.AsyncClient() as client:
-            res = await client.post(INIT_URL)
-            session_id = res.json().get("session_id")
+            await get_client().post(RESET_URL, params={"session_id": session_id})
+        cl.user_session.set("session_id", await nuova_sessione_backend())
         await cl.Message(content=f"🔄 **Chat resettata!**").send()
     except Exception as e:
         await cl.Message(content=f"Errore durante reset/init: {e}").send()
 
+# ---------------------------
+# Upload file (streaming da disco)
+# ---------------------------
+async def upload_file(elements: list, session_id: str) -> tuple[str, str, str | None]:
+    """
+    Invia i file al backend leggendoli a blocchi dal disco (niente copia completa in RAM): più file
+    vanno in un'unica richiesta a /upload_multiplo, indicizzati insieme in un solo job.
+    Il backend risponde appena i file sono salvati: per i documenti l'indicizzazione prosegue in un job.
+    Ritorna (messaggio, session_id, job_id o None).
+    """
+    try:
+        with ExitStack() as stack:
+            allegati = [(e.name, stack.enter_context(open(e.path, "rb")), "application/octet-stream") for e in elements]
+            if len(allegati) == 1:
+                res = await get_client().post(UPLOAD_URL, files={"file": allegati[0]}, data={"session_id": session_id})
+            else:
+                res = await get_client().post(UPLOAD_MULTIPLO_URL, files=[("files", a) for a in allegati],
+                                              data={"session_id": session_id})
+        try:
+            res.raise_for_status()
+            json_data = res.json()
+            return (json_data.get("message", f"✅ File ricevuto ({res.status_code})"),
+                    json_data.get("session_id", session_id), json_data.get("job_id"))
+        except httpx.HTTPStatusError as exc:
+            try:
+                err_json = exc.response.json()
+                return err_json.get("detail", f"⚠️ Errore dal backend ({exc.response.status_code})"), session_id, None
+            except Exception:
+                return f"⚠️ Errore sconosciuto dal backend: {exc.response.text[:300]}", session_id, None
+    except Exception as e:
+        return f"⚠️ Errore durante l’upload: {type(e).__name__}", session_id, None
+
+
+async def segui_ingestione(msg: cl.Message, nome: str, job_id: str, session_id: str):
+    """Aggiorna il messaggio dell'upload con fase, chunk indicizzati ed ETA finché il job non termina."""
+    while True:
+        await asyncio.sleep(INTERVALLO_STATO_UPLOAD_S)
+        try:
+            res = await get_client().get(f"{UPLOAD_URL}/{job_id}", params={"session_id": session_id})
+            res.raise_for_status()
+            stato = res.json()
+        except Exception:
+            continue
+        fase = stato.get("fase")
+        if fase == "completato":
+            msg.content = f"✅ '{nome}' indicizzato: puoi fare domande su tutto il documento"
+            if stato.get("scartati"):
+                msg.content += "\n⚠️ Scartati: " + ", ".join(s["file"] for s in stato["scartati"])
+        elif fase == "errore":
+            msg.content = f"⚠️ Indicizzazione di '{nome}' non riuscita: {stato.get('errore')}"
+        elif fase == "indicizzazione" and stato.get("chunk_totali"):
+            eta = f", circa {stato['eta_s']:.0f}s" if stato.get("eta_s") is not None else ""
+            msg.content = (f"⏳ Indicizzazione di '{nome}': {stato['chunk_indicizzati']}/{stato['chunk_totali']} chunk{eta}"
+                           " (puoi già fare domande sulla parte indicizzata)")
+        else:
+            msg.content = f"⏳ '{nome}': {fase}"
+        await msg.update()
+        if fase in ("completato", "errore"):
+            return
+
+# ---------------------------
+# Chat (JSON o streaming NDJSON)
+# ---------------------------
+async def invia_messaggio(session_id: str, user_text: str) -> tuple[str, str]:
+    """
+    Invia la domanda e mostra la risposta. Se il backend risponde in streaming (NDJSON: righe
+    {"evento": "token", "testo": ...} e una finale {"evento": "fine", ...}) i token vengono mostrati man mano.
+    Ritorna (risposta, session_id).
+    """
+    payload = {"session_id": session_id, "message": user_text}
+    headers = {"Accept": f"{STREAM_CONTENT_TYPE}, application/json;q=0.9"}
+    risposta_msg = cl.Message(content="", author="🤖 AI")
+
+    async with get_client().stream("POST", BACKEND_URL, json=payload, headers=headers) as res:
+        if res.headers.get("content-type", "").startswith(STREAM_CONTENT_TYPE):
+            data = {}
+            async for riga in res.aiter_lines():
+                if not riga.strip():
+                    continue
+                evento = json.loads(riga)
+                if evento.get("evento") == "token":
+                    await risposta_msg.stream_token(evento.get("testo", ""))
+                elif evento.get("evento") == "fine":
+                    data = evento
+            if not risposta_msg.content:
+                risposta_msg.content = data.get("risposta", "⚠️ Errore nella risposta.")
+            await risposta_msg.send()
+            return risposta_msg.content, data.get("session_id", session_id)
+
+        data = json.loads(await res.aread())
+        risposta_msg.content = data.get("risposta", "⚠️ Errore nella risposta.")
+        await risposta_msg.send()
+        return risposta_msg.content, data.get("session_id", session_id)
+
 # -------------------------------------------
 # Gestione messaggio + file upload
 # -------------------------------------------
 @cl.on_message
 async def on_message(message: cl.Message):
-    global session_id
-
-    # File caricati
-    if message.elements:
-        for element in message.elements:
-            if element.type in ["file", "image"]:
-                try:
-                    with open(element.path, "rb") as f:
-                        file_bytes = f.read()
-                    files = {"file": (element.name, file_bytes, "application/octet-stream")}
-                    data = {"session_id": session_id}
-                    async with httpx.AsyncClient() as client:
-                        res = await client.post(UPLOAD_URL, files=files, data=data, timeout=120.0)
-                    try:
-                        res.raise_for_status()
-                        json_data = res.json()
-                        session_id = json_data.get("session_id", session_id)
-                        msg = json_data.get("message", f"✅ File ricevuto ({res.status_code})")
-                    except httpx.HTTPStatusError as exc:
-                        try:
-                            err_json = exc.response.json()
-                            msg = err_json.get("detail", f"⚠️ Errore dal backend ({exc.response.status_code})")
-                        except Exception:
-                            msg = f"⚠️ Errore sconosciuto dal backend: {exc.response.text[:300]}"
-                except Exception as e:
-                    msg = f"⚠️ Errore durante l’upload: {type(e).__name__}"
-                await cl.Message(content=msg).send()
+    session_id = cl.user_session.get("session_id")
+
+    # File caricati (tutti in una richiesta)
+    allegati = [e for e in message.elements or [] if e.type in ["file", "image"]]
+    if allegati:
+        msg, session_id, job_id = await upload_file(allegati, session_id)
+        messaggio = await cl.Message(content=msg).send()
+        if job_id:
+            nome = ", ".join(e.name for e in allegati)
+            asyncio.create_task(segui_ingestione(messaggio, nome, job_id, session_id))
+        cl.user_session.set("session_id", session_id)
 
     # Messaggio testo
     user_text = message.content
     await cl.Message(content="⏳ **Sto pensando...**").send()
     try:
-        async with httpx.AsyncClient(timeout=80.0) as client:
-            payload = {"session_id": session_id, "message": user_text}
-            res = await client.post(BACKEND_URL, json=payload)
-            data = res.json()
-            session_id = data.get("session_id")
-            risposta = data.get("risposta", "⚠️ Errore nella risposta.")
-        await cl.Message(content=risposta, author="🤖 AI").send()
+        _, session_id = await invia_messaggio(session_id, user_text)
+        cl.user_session.set("session_id", session_id)
     except Exception as e:
-        await cl.Message(content=f"⚠️ Errore di connessione al backend: {str(e)}").send()
\ No newline at end of file
+        await cl.Message(content=f"⚠️ Errore di connessione al backend: {str(e)}").send()
@@ -0,0 +1,108 @@
+"""
+Profilo dei tempi di avvio del backend. In un processo pulito misura:
+- l'import di code.app con `python -X importtime`, riportando i moduli più lenti (tempo cumulativo)
+  e il tempo proprio sommato per pacchetto di primo livello;
+- import dell'app, avvio (lifespan di FastAPI) e prima richiesta /init_session, con e senza riscaldamento.
+
+Dati in una cartella temporanea, S3 disattivato, nessuna chiamata a Gemini.
+
+Uso (dalla root del progetto):
+    python -m code.benchmarks.bench_avvio
+    python -m code.benchmarks.bench_avvio --top 30 --output avvio.json
+"""
+import argparse, json, os, subprocess, sys, tempfile
+from collections import defaultdict
+from pathlib import Path
+
+from .bench_utils import salva_risultati
+
+RADICE = Path(__file__).resolve().parents[2]
+
+# Eseguito in un processo separato: ogni misura parte da un interprete senza moduli già importati
+_SCRIPT_AVVIO = """
+import json, time
+inizio = time.perf_counter()
+from code.app import app
+import_s = time.perf_counter() - inizio
+from fastapi.testclient import TestClient
+with TestClient(app) as client:
+    avvio_s = time.perf_counter() - inizio
+    t = time.perf_counter()
+    client.post("/init_session").raise_for_status()
+    prima_richiesta_s = time.perf_counter() - t
+print(json.dumps({"import_s": import_s, "avvio_s": avvio_s, "prima_richiesta_s": prima_richiesta_s}))
+"""
+
+
+def _ambiente(data_dir: str, riscaldamento: bool) -> dict:
+    return {
+        **os.environ,
+        "DATA_DIR": data_dir,
+        "GEMINI_API_KEY": os.environ.get("GEMINI_API_KEY", "bench"),
+        "AWS_ACCESS_KEY_ID": "",
+        "AWS_SECRET_ACCESS_KEY": "",
+        "AVVIO_RISCALDAMENTO": "1" if riscaldamento else "0",
+    }
+
+
+def profilo_import(data_dir: str) -> list[dict]:
+    """Righe di `-X importtime` per l'import di code.app: [{modulo, proprio_s, cumulativo_s}]."""
+    esito = subprocess.run([sys.executable, "-X", "importtime", "-c", "import code.app"], cwd=RADICE,
+                           env=_ambiente(data_dir, False), capture_output=True, text=True, check=True)
+    righe = []
+    for riga in esito.stderr.splitlines():
+        # "import time:       123 |        456 |   modulo" (microsecondi)
+        if not riga.startswith("import time:") or "self [us]" in riga:
+            continue
+        proprio, cumulativo, modulo = (p.strip() for p in riga[len("import time:"):].split("|"))
+        righe.append({"modulo": modulo, "proprio_s": int(proprio) / 1e6, "cumulativo_s": int(cumulativo) / 1e6})
+    return righe
+
+
+def tempi_avvio(data_dir: str, riscaldamento: bool) -> dict:
+    esito = subprocess.run([sys.executable, "-c", _SCRIPT_AVVIO], cwd=RADICE,
+                           env=_ambiente(data_dir, riscaldamento), capture_output=True, text=True, check=True)
+    return json.loads(esito.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profilo degli import e tempi di avvio del backend")
+    parser.add_argument("--top", type=int, default=20, help="Moduli più lenti da mostrare")
+    parser.add_argument("--output", help="Salva i risultati in un file JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        righe = profilo_import(data_dir)
+        avvio = {"con_riscaldamento": tempi_avvio(data_dir, True),
+                 "senza_riscaldamento": tempi_avvio(data_dir, False)}
+
+    totale_s = sum(r["proprio_s"] for r in righe)
+    per_pacchetto = defaultdict(float)
+    for r in righe:
+        per_pacchetto[r["modulo"].split(".")[0]] += r["proprio_s"]
+    pacchetti = sorted(per_pacchetto.items(), key=lambda p: p[1], reverse=True)[:args.top]
+    moduli = sorted(righe, key=lambda r: r["cumulativo_s"], reverse=True)[:args.top]
+
+    print(f"Import di code.app: {totale_s:.3f} s ({len(righe)} moduli)\n")
+    print(f"{'modulo':<60}{'cumulativo s':>14}{'proprio s':>12}")
+    for r in moduli:
+        print(f"{r['modulo']:<60}{r['cumulativo_s']:>14.3f}{r['proprio_s']:>12.3f}")
+    print(f"\n{'pacchetto':<40}{'proprio s':>12}{'quota':>8}")
+    for nome, s in pacchetti:
+        print(f"{nome:<40}{s:>12.3f}{s / totale_s:>8.0%}")
+    print(f"\n{'avvio':<22}{'import s':>10}{'avvio s':>10}{'1ª richiesta s':>16}")
+    for nome, t in avvio.items():
+        print(f"{nome:<22}{t['import_s']:>10.3f}{t['avvio_s']:>10.3f}{t['prima_richiesta_s']:>16.3f}")
+
+    if args.output:
+        salva_risultati(args.output, {
+            "import_totale_s": totale_s,
+            "moduli": moduli,
+            "pacchetti": dict(pacchetti),
+            "avvio": avvio,
+        })
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
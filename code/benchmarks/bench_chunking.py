@@ -0,0 +1,146 @@
+"""
+Confronto dei profili di chunking su un documento sintetico strutturato (titoli, paragrafi, elenchi, tabelle)
+con fatti "piantati" in punti noti. Per ogni profilo misura numero di chunk, token medi per chunk,
+tempo di ingestion (load_documents + embedding + indice FAISS) e hit rate@k: frazione delle domande
+per cui almeno uno dei k chunk recuperati contiene la risposta. Nessuna chiamata di rete (embedder finto).
+
+Uso (dalla root del progetto):
+    python -m code.benchmarks.bench_chunking
+    python -m code.benchmarks.bench_chunking --sezioni 80 --token 150 250 400 -k 4 --formato docx
+"""
+import argparse, os, random, sys, tempfile, time
+from contextlib import contextmanager
+
+from ..config import CHUNK_PROFILI_FORMATO
+from ..rag.loader_doc import load_documents
+from ..rag.vectorstore import get_vectorstore_multidoc
+from ..utils.tokens import conta_token
+from .fakes import FakeEmbeddings, logger_silenzioso, testo_casuale, PAROLE
+from .bench_utils import salva_risultati
+
+
+def genera_documento_strutturato(sezioni: int, seed: int = 0) -> tuple[list[tuple[str, list]], list[tuple[str, str]]]:
+    """
+    Sezioni del documento come [(titolo, [("paragrafo", testo) | ("elenco", [voci]) | ("tabella", [righe])])]
+    e domande [(domanda, risposta attesa)] sui fatti piantati negli elenchi e nelle tabelle.
+    """
+    rnd = random.Random(seed)
+    documento, domande = [], []
+    for s in range(sezioni):
+        componente = rnd.choice(PAROLE)
+        parti = [("paragrafo", p) for p in testo_casuale(rnd.randint(80, 220), seed + s).split("\n\n")]
+        voci = []
+        for j in range(3):
+            linea, codice = f"linea{s:03d}{j}", f"PX{rnd.randint(10000, 99999)}"
+            voci.append(f"Pressione massima della {linea}: {rnd.randint(2, 40)} bar, codice {codice}.")
+            domande.append((f"Qual è la pressione massima della {linea}?", codice))
+        parti.insert(rnd.randint(0, len(parti)), ("elenco", voci))
+        righe = ["Impianto | Componente | Codice ricambio"]
+        for j in range(4):
+            impianto, codice = f"impianto{s:03d}{j}", f"RC{rnd.randint(10000, 99999)}"
+            righe.append(f"{impianto} | {rnd.choice(PAROLE)} | {codice}")
+            domande.append((f"Codice ricambio dell'{impianto}", codice))
+        parti.append(("tabella", righe))
+        documento.append((f"{s + 1}. {componente.capitalize()} e manutenzione", parti))
+    return documento, domande
+
+
+def scrivi_documento(documento, cartella: str, formato: str) -> str:
+    """Scrive il documento come TXT (titoli markdown) o DOCX (stili Heading / List Bullet)."""
+    if formato == "docx":
+        from docx import Document as DocxDocument
+        doc = DocxDocument()
+        for titolo, parti in documento:
+            doc.add_heading(titolo, level=2)
+            for tipo, contenuto in parti:
+                if tipo == "paragrafo":
+                    doc.add_paragraph(contenuto)
+                else:
+                    for riga in contenuto:
+                        doc.add_paragraph(riga, style="List Bullet" if tipo == "elenco" else None)
+        path = os.path.join(cartella, "bench_chunking.docx")
+        doc.save(path)
+        return path
+
+    blocchi = []
+    for titolo, parti in documento:
+        blocchi.append(f"## {titolo}")
+        for tipo, contenuto in parti:
+            if tipo == "paragrafo":
+                blocchi.append(contenuto)
+            elif tipo == "elenco":
+                blocchi.append("\n".join(f"- {v}" for v in contenuto))
+            else:
+                blocchi.append("\n".join(f"| {r} |" for r in contenuto))
+    path = os.path.join(cartella, "bench_chunking.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n\n".join(blocchi))
+    return path
+
+
+@contextmanager
+def token_max_temporaneo(token_max: int | None):
+    """Sovrascrive token_max di tutti i profili per formato per la durata del benchmark."""
+    originale = {ext: dict(p) for ext, p in CHUNK_PROFILI_FORMATO.items()}
+    if token_max:
+        for p in CHUNK_PROFILI_FORMATO.values():
+            p["token_max"] = token_max
+    try:
+        yield
+    finally:
+        CHUNK_PROFILI_FORMATO.clear()
+        CHUNK_PROFILI_FORMATO.update(originale)
+
+
+def bench_profilo(path: str, profilo: str, token_max: int | None, domande, k: int, logger) -> dict:
+    embeddings = FakeEmbeddings()
+    with token_max_temporaneo(token_max), tempfile.TemporaryDirectory() as vectors_path:
+        inizio = time.perf_counter()
+        docs = load_documents(logger=logger, FILE_DIR=path, profilo_chunk=profilo, usa_cache=False)   # parsing sempre misurato
+        chunking_s = time.perf_counter() - inizio
+        vectorstore = get_vectorstore_multidoc(docs, vectors_path, logger=logger, embeddings=embeddings)
+        ingestion_s = time.perf_counter() - inizio
+
+    trovate = 0
+    for domanda, risposta in domande:
+        risultati = vectorstore.similarity_search(domanda, k=k)
+        trovate += any(risposta in d.page_content for d in risultati)
+    return {
+        "chunk": len(docs),
+        "token_medi": sum(conta_token(d.page_content) for d in docs) / max(1, len(docs)),
+        "chunking_s": chunking_s,
+        "ingestion_s": ingestion_s,
+        f"hit_rate@{k}": trovate / len(domande),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Numero di chunk, tempo di ingestion e hit rate dei profili di chunking")
+    parser.add_argument("--sezioni", type=int, default=40, help="Sezioni del documento sintetico")
+    parser.add_argument("--token", type=int, nargs="+", default=[150, 250, 400], help="token_max del profilo strutturato")
+    parser.add_argument("-k", type=int, default=4)
+    parser.add_argument("--formato", choices=("txt", "docx"), default="txt")
+    parser.add_argument("--output", help="Salva i risultati in un file JSON")
+    args = parser.parse_args(argv)
+
+    logger = logger_silenzioso()
+    documento, domande = genera_documento_strutturato(args.sezioni)
+    profili = [("caratteri", None)] + [("strutturato", t) for t in args.token]
+
+    risultati = {}
+    print(f"{'profilo':<20}{'chunk':>8}{'token/chunk':>13}{'chunking s':>12}{'ingestion s':>13}{'hit@' + str(args.k):>8}")
+    with tempfile.TemporaryDirectory() as cartella:
+        path = scrivi_documento(documento, cartella, args.formato)
+        for profilo, token_max in profili:
+            nome = profilo if token_max is None else f"{profilo}_{token_max}"
+            r = risultati[nome] = bench_profilo(path, profilo, token_max, domande, args.k, logger)
+            print(f"{nome:<20}{r['chunk']:>8}{r['token_medi']:>13.0f}{r['chunking_s']:>12.3f}"
+                  f"{r['ingestion_s']:>13.3f}{r[f'hit_rate@{args.k}']:>8.2f}")
+
+    if args.output:
+        salva_risultati(args.output, risultati)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""
+Micro-benchmark offline dei componenti "caldi" (nessuna chiamata di rete).
+
+Uso (dalla root del progetto):
+    python -m code.benchmarks.bench_components                    # esegue e confronta con la baseline
+    python -m code.benchmarks.bench_components --salva-baseline   # aggiorna la baseline
+    python -m code.benchmarks.bench_components --soglia 0.3 --output risultati.json
+
+Esce con codice 1 se almeno un benchmark è più lento della baseline oltre la soglia.
+"""
+import argparse, os, sys, tempfile
+
+from ..memory import chat_memory
+from ..memory.chat_memory import get_memory, save_memory
+from ..rag.loader_doc import load_documents, ESTENSIONI_CACHE
+from ..rag.vectorstore import get_vectorstore_multidoc
+from ..agents.agents import router
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain.schema import Document
+from langchain_community.chat_message_histories import ChatMessageHistory
+from .fakes import FakeEmbeddings, FakeLLM, logger_silenzioso, genera_documenti, testo_casuale
+from .bench_utils import BASELINE_DIR, misura, salva_risultati, carica_risultati, confronta, stampa_tabella
+
+BASELINE_DEFAULT = BASELINE_DIR / "components.json"
+
+
+def bench_load_documents(files: dict, logger, ripetizioni: int) -> dict:
+    """Parsing + split di `load_documents` per ogni formato supportato, senza e con la cache del parsing."""
+    risultati = {}
+    for ext, path in files.items():
+        n_chunk = len(load_documents(logger=logger, FILE_DIR=path, usa_cache=False))
+        risultati[f"load_documents.{ext}"] = misura(
+            lambda: load_documents(logger=logger, FILE_DIR=path, usa_cache=False),
+            ripetizioni=ripetizioni, unita=n_chunk, nome_unita="chunk",
+        )
+        if f".{ext}" not in ESTENSIONI_CACHE:
+            continue
+        load_documents(logger=logger, FILE_DIR=path, usa_cache=True)    # popola la cache
+        risultati[f"load_documents.{ext}.cache"] = misura(
+            lambda: load_documents(logger=logger, FILE_DIR=path, usa_cache=True),
+            ripetizioni=ripetizioni, unita=n_chunk, nome_unita="chunk",
+        )
+    return risultati
+
+
+def bench_splitter(ripetizioni: int) -> dict:
+    """Throughput dello splitter usato in load_documents (chunk_size=500, chunk_overlap=50)."""
+    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+    doc = Document(page_content=testo_casuale(50_000), metadata={"source": "bench"})
+    n_byte = len(doc.page_content.encode("utf-8"))
+    risultato = misura(lambda: splitter.split_documents([doc]), ripetizioni=ripetizioni,
+                       unita=n_byte / 1024, nome_unita="KiB")
+    return {"splitter.recursive_500_50": risultato}
+
+
+def bench_embedding(embeddings, chunks: list[Document], ripetizioni: int) -> dict:
+    """Throughput dell'embedding a batch (embedder locale finto)."""
+    risultati = {}
+    for batch in (16, 64, 256):
+        testi = [c.page_content for c in chunks[:batch]]
+        risultati[f"embedding.batch_{batch}"] = misura(
+            lambda: embeddings.embed_documents(testi), ripetizioni=ripetizioni,
+            unita=len(testi), nome_unita="chunk",
+        )
+    return risultati
+
+
+def bench_faiss(embeddings, chunks: list[Document], tmp: str, logger, ripetizioni: int) -> dict:
+    """Creazione, aggiunta, caricamento da disco e ricerca tramite get_vectorstore_multidoc."""
+    risultati = {}
+    meta = len(chunks) // 2
+    contatore = iter(range(10**6))
+
+    def crea():
+        path = os.path.join(tmp, f"faiss_crea_{next(contatore)}")
+        return get_vectorstore_multidoc(chunks[:meta], path, logger, embeddings=embeddings)
+
+    risultati["faiss.crea_e_salva"] = misura(crea, ripetizioni=ripetizioni, unita=meta, nome_unita="chunk")
+
+    def aggiungi():
+        path = os.path.join(tmp, f"faiss_agg_{next(contatore)}")
+        vs = get_vectorstore_multidoc(chunks[:meta], path, logger, embeddings=embeddings)
+        get_vectorstore_multidoc(chunks[meta:], path, logger, vectorstore_esistente=vs, embeddings=embeddings)
+
+    risultati["faiss.crea_aggiungi_salva"] = misura(aggiungi, ripetizioni=ripetizioni, unita=len(chunks), nome_unita="chunk")
+
+    path = os.path.join(tmp, "faiss_disco")
+    vs = get_vectorstore_multidoc(chunks, path, logger, embeddings=embeddings)
+    risultati["faiss.carica_da_disco"] = misura(
+        lambda: get_vectorstore_multidoc(None, path, logger, embeddings=embeddings), ripetizioni=ripetizioni,
+    )
+
+    query = "procedura di manutenzione della pompa e verifica della pressione"
+    risultati["faiss.similarity_k6"] = misura(lambda: vs.similarity_search(query, k=6), ripetizioni=ripetizioni * 4)
+    risultati["faiss.mmr_k6"] = misura(lambda: vs.max_marginal_relevance_search(query, k=6), ripetizioni=ripetizioni * 4)
+    return risultati
+
+
+def bench_memoria(tmp: str, ripetizioni: int) -> dict:
+    """save_memory / get_memory con cronologie di lunghezza crescente."""
+    chat_memory.MEM_DIR = os.path.join(tmp, "memorie")   # niente scritture nella cartella reale
+    risultati = {}
+    for n in (10, 100, 1000):
+        memory = ChatMessageHistory()
+        for i in range(n // 2):
+            memory.add_user_message(testo_casuale(30, seed=i))
+            memory.add_ai_message(testo_casuale(120, seed=i + 1))
+        session_id = f"bench_{n}"
+        risultati[f"memoria.save_{n}"] = misura(lambda: save_memory(session_id, memory), ripetizioni=ripetizioni)
+        risultati[f"memoria.get_{n}"] = misura(lambda: get_memory(session_id), ripetizioni=ripetizioni)
+    return risultati
+
+
+def bench_router(logger, ripetizioni: int) -> dict:
+    """Tempo di decisione del router: percorsi pattern e fallback LLM (LLM finto, latenza zero)."""
+    llm_router = FakeLLM("tecnico")
+    casi = {
+        "router.pattern_vision": {"input": "Cosa vedi nella foto?", "image_paths": ["x.jpg"]},
+        "router.pattern_tecnico": {"input": "Riassumi il documento caricato", "rag_chain": object()},
+        "router.pattern_generale": {"input": "Quanto fa 2+2?"},
+        "router.fallback_llm": {"input": "Dimmi di più", "rag_chain": object(), "image_paths": ["x.jpg"]},
+    }
+    risultati = {}
+    for nome, stato in casi.items():
+        risultati[nome] = misura(lambda: router(dict(stato), llm_router, logger=logger),
+                                 ripetizioni=ripetizioni * 200, unita=1, nome_unita="decisioni")
+    return risultati
+
+
+def esegui(ripetizioni: int = 5) -> dict:
+    logger = logger_silenzioso()
+    embeddings = FakeEmbeddings()
+    risultati = {}
+    with tempfile.TemporaryDirectory(prefix="bench_") as tmp:
+        files = genera_documenti(os.path.join(tmp, "docs"))
+        risultati.update(bench_load_documents(files, logger, ripetizioni))
+        risultati.update(bench_splitter(ripetizioni))
+
+        chunks = load_documents(logger=logger, FILE_DIR=files["txt"])
+        chunks = (chunks * (1 + 1000 // max(len(chunks), 1)))[:1000]
+        risultati.update(bench_embedding(embeddings, chunks, ripetizioni))
+        risultati.update(bench_faiss(embeddings, chunks, tmp, logger, ripetizioni))
+        risultati.update(bench_memoria(tmp, ripetizioni))
+        risultati.update(bench_router(logger, ripetizioni))
+    return risultati
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmark offline dei componenti")
+    parser.add_argument("--baseline", default=str(BASELINE_DEFAULT), help="File JSON della baseline")
+    parser.add_argument("--salva-baseline", action="store_true", help="Sovrascrive la baseline con i risultati")
+    parser.add_argument("--output", help="Salva i risultati di questa esecuzione in un file JSON")
+    parser.add_argument("--soglia", type=float, default=0.20, help="Rallentamento tollerato (0.20 = +20%%)")
+    parser.add_argument("--ripetizioni", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    risultati = esegui(args.ripetizioni)
+    baseline = carica_risultati(args.baseline)
+    stampa_tabella(risultati, baseline)
+
+    if args.output:
+        salva_risultati(args.output, risultati)
+    if args.salva_baseline:
+        salva_risultati(args.baseline, risultati)
+        print(f"💾 Baseline salvata in {args.baseline}")
+        return 0
+
+    if baseline is None:
+        print("ℹ️ Nessuna baseline trovata: eseguire con --salva-baseline per crearla.")
+        return 0
+
+    regressioni = confronta(risultati, baseline, args.soglia)
+    for r in regressioni:
+        print(f"❌ Regressione {r['nome']}: {r['baseline_s'] * 1000:.2f}ms → {r['attuale_s'] * 1000:.2f}ms ({r['delta'] * 100:+.1f}%)")
+    if not regressioni:
+        print("✅ Nessuna regressione oltre la soglia")
+    return 1 if regressioni else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+Throughput del backend di embedding locale su CPU (richiede sentence-transformers; per --formato onnx
+anche optimum[onnxruntime]). Per ogni budget di thread misura i chunk/s dell'ingestion (embed_documents)
+e i chunk/s per core, poi la latenza delle query concorrenti unite dal batching dinamico.
+
+Uso (dalla root del progetto):
+    python -m code.benchmarks.bench_embeddings
+    python -m code.benchmarks.bench_embeddings --thread 1 2 4 --formato int8 --output embedding.json
+"""
+import argparse, os, sys, time
+from concurrent.futures import ThreadPoolExecutor
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from ..rag.embeddings import LocalCPUEmbeddings
+from ..config import EMBEDDING_LOCAL_MODEL
+from .fakes import testo_casuale
+from .bench_utils import misura, salva_risultati
+
+
+def genera_chunk(n: int) -> list[str]:
+    """Chunk realistici: testo casuale diviso con lo stesso splitter di load_documents."""
+    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+    chunk, seed = [], 0
+    while len(chunk) < n:
+        chunk += splitter.split_text(testo_casuale(2000, seed=seed))
+        seed += 1
+    return chunk[:n]
+
+
+def bench_query_concorrenti(embeddings, testi: list[str], concorrenza: int) -> dict:
+    """`concorrenza` query singole in parallelo: il batching dinamico le unisce in pochi batch."""
+    def una(t):
+        start = time.perf_counter()
+        embeddings.embed_query(t)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrenza) as pool:
+        tempi = sorted(pool.map(una, testi))
+    totale = time.perf_counter() - start
+    return {
+        "mediana_s": tempi[len(tempi) // 2],
+        "p95_s": tempi[int(0.95 * (len(tempi) - 1))],
+        "throughput": len(testi) / totale,
+        "unita": "query/s",
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput del backend di embedding locale")
+    parser.add_argument("--modello", default=EMBEDDING_LOCAL_MODEL)
+    parser.add_argument("--formato", default="torch", choices=["torch", "int8", "onnx"])
+    parser.add_argument("--thread", type=int, nargs="+", default=sorted({1, max(1, (os.cpu_count() or 2) // 2)}))
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--chunk", type=int, default=512, help="Chunk per misura di ingestion")
+    parser.add_argument("--concorrenza", type=int, default=16, help="Query parallele per il test di batching")
+    parser.add_argument("--ripetizioni", type=int, default=3)
+    parser.add_argument("--output", help="Salva i risultati in un file JSON")
+    args = parser.parse_args(argv)
+
+    chunk = genera_chunk(args.chunk)
+    risultati = {}
+    print(f"{'configurazione':<34}{'mediana s':>11}{'chunk/s':>10}{'chunk/s/core':>14}")
+    for thread in args.thread:
+        embeddings = LocalCPUEmbeddings(model_name=args.modello, formato=args.formato,
+                                        threads=thread, batch_size=args.batch)
+        nome = f"{args.formato}.thread_{thread}.batch_{args.batch}"
+        r = misura(lambda: embeddings.embed_documents(chunk), ripetizioni=args.ripetizioni,
+                   unita=len(chunk), nome_unita="chunk")
+        r["chunk_s_core"] = r["throughput"] / thread
+        risultati[f"documenti.{nome}"] = r
+        print(f"{nome:<34}{r['mediana_s']:>11.3f}{r['throughput']:>10.1f}{r['chunk_s_core']:>14.1f}")
+
+        q = bench_query_concorrenti(embeddings, chunk[:args.concorrenza * 4], args.concorrenza)
+        risultati[f"query.{nome}"] = q
+        print(f"  query x{args.concorrenza:<25} p50 {q['mediana_s'] * 1000:.1f} ms, "
+              f"p95 {q['p95_s'] * 1000:.1f} ms, {q['throughput']:.1f} query/s")
+
+    if args.output:
+        salva_risultati(args.output, risultati)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Confronto dei tipi di indice FAISS (Flat esatto, HNSW, IVF) su vettori sintetici a cluster.
+Per ogni dimensione della collezione misura tempo di costruzione, latenza di ricerca (p50/p95)
+e recall@k rispetto alla ricerca esatta: serve a tarare FAISS_SOGLIA_VETTORI e FAISS_LATENZA_TARGET_MS.
+Con --quantizzazione confronta anche i formati compressi (fp16, sq8, pq): dimensione di index.faiss,
+riduzione rispetto a float32 e recall con e senza re-ranking esatto.
+
+Uso (dalla root del progetto):
+    python -m code.benchmarks.bench_indici
+    python -m code.benchmarks.bench_indici --vettori 10000 100000 --dim 768 --output indici.json
+    python -m code.benchmarks.bench_indici --vettori 20000 --quantizzazione
+"""
+import argparse, os, sys, tempfile, time
+import numpy as np
+import faiss
+
+from ..rag.vectorstore import costruisci_indice, costruisci_quantizzatore, IndiceQuantizzato, FILE_VETTORI
+from .bench_utils import salva_risultati
+
+TIPI = ("flat", "hnsw", "ivf")
+QUANTIZZAZIONI = ("fp16", "sq8", "pq")
+
+
+def vettori_sintetici(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    """Vettori raggruppati in cluster (più realistici di un rumore uniforme per IVF/HNSW)."""
+    rng = np.random.default_rng(seed)
+    centri = rng.normal(size=(max(1, n // 200), dim)).astype("float32")
+    vettori = centri[rng.integers(0, len(centri), n)] + 0.3 * rng.normal(size=(n, dim)).astype("float32")
+    return vettori.astype("float32")
+
+
+def domande_sintetiche(vettori: np.ndarray, query: int) -> np.ndarray:
+    # Query vicine ai dati (come una domanda vicina a un chunk), non punti casuali nello spazio
+    rng = np.random.default_rng(1)
+    rumore = 0.1 * rng.normal(size=(query, vettori.shape[1])).astype("float32")
+    return vettori[rng.integers(0, len(vettori), query)] + rumore
+
+
+def recall(trovati: np.ndarray, esatti: np.ndarray) -> float:
+    """Frazione dei k vicini esatti ritrovati dall'indice approssimato."""
+    return float(np.mean([len(set(t) & set(e)) / len(e) for t, e in zip(trovati, esatti)]))
+
+
+def cerca_tutte(index, domande: np.ndarray, k: int) -> tuple[list, list]:
+    """Esegue le query una alla volta (come la /chat); ritorna (tempi ordinati, id trovati)."""
+    tempi, trovati = [], []
+    for q in domande:
+        start = time.perf_counter()
+        _, ids = index.search(q.reshape(1, -1), k)
+        tempi.append(time.perf_counter() - start)
+        trovati.append(ids[0])
+    tempi.sort()
+    return tempi, trovati
+
+
+def bench_dimensione(n: int, dim: int, query: int, k: int) -> dict:
+    vettori = vettori_sintetici(n, dim)
+    domande = domande_sintetiche(vettori, query)
+    risultati, esatti = {}, None
+
+    for tipo in TIPI:
+        start = time.perf_counter()
+        index = costruisci_indice(vettori, tipo, faiss.METRIC_L2)
+        costruzione = time.perf_counter() - start
+
+        tempi, trovati = cerca_tutte(index, domande, k)
+        if tipo == "flat":
+            esatti = trovati
+
+        risultati[f"{tipo}.{n}"] = {
+            "mediana_s": tempi[len(tempi) // 2],
+            "p95_s": tempi[int(0.95 * (len(tempi) - 1))],
+            "costruzione_s": costruzione,
+            f"recall@{k}": recall(trovati, esatti),
+        }
+    return risultati
+
+
+def bench_quantizzazione(n: int, dim: int, query: int, k: int) -> dict:
+    """Dimensione di index.faiss e recall@k dei formati compressi, con e senza re-ranking sui vettori float32."""
+    vettori = vettori_sintetici(n, dim)
+    domande = domande_sintetiche(vettori, query)
+    flat = costruisci_indice(vettori, "flat", faiss.METRIC_L2)
+    byte_flat = len(faiss.serialize_index(flat))
+    _, esatti = cerca_tutte(flat, domande, k)
+
+    risultati = {}
+    with tempfile.TemporaryDirectory() as cartella:
+        for tipo in QUANTIZZAZIONI:
+            base = costruisci_quantizzatore(dim, tipo, n, faiss.METRIC_L2)
+            index = IndiceQuantizzato(base, tipo, os.path.join(cartella, f"{tipo}.{FILE_VETTORI}"))
+            index.add(vettori)
+            byte_indice = len(faiss.serialize_index(base))
+
+            for nome, indice_ricerca in ((tipo, base), (f"{tipo}+rerank", index)):
+                tempi, trovati = cerca_tutte(indice_ricerca, domande, k)
+                risultati[f"{nome}.{n}"] = {
+                    "mediana_s": tempi[len(tempi) // 2],
+                    "p95_s": tempi[int(0.95 * (len(tempi) - 1))],
+                    "byte_indice": byte_indice,
+                    "riduzione": byte_flat / byte_indice,
+                    f"recall@{k}": recall(trovati, esatti),
+                }
+    return risultati
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Latenza e recall dei tipi di indice FAISS")
+    parser.add_argument("--vettori", type=int, nargs="+", default=[5_000, 50_000], help="Dimensioni della collezione")
+    parser.add_argument("--dim", type=int, default=768, help="Dimensione degli embedding (768 = text-embedding-004)")
+    parser.add_argument("--query", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--quantizzazione", action="store_true", help="Confronta anche i formati compressi")
+    parser.add_argument("--output", help="Salva i risultati in un file JSON")
+    args = parser.parse_args(argv)
+
+    risultati = {}
+    print(f"{'indice':<16}{'p50 ms':>10}{'p95 ms':>10}{'build s':>10}{'recall@' + str(args.k):>12}")
+    for n in args.vettori:
+        for nome, r in bench_dimensione(n, args.dim, args.query, args.k).items():
+            risultati[nome] = r
+            print(f"{nome:<16}{r['mediana_s'] * 1000:>10.3f}{r['p95_s'] * 1000:>10.3f}"
+                  f"{r['costruzione_s']:>10.2f}{r[f'recall@{args.k}']:>12.3f}")
+
+    if args.quantizzazione:
+        print(f"\n{'formato':<20}{'p50 ms':>10}{'MB indice':>11}{'riduzione':>11}{'recall@' + str(args.k):>12}")
+        for n in args.vettori:
+            for nome, r in bench_quantizzazione(n, args.dim, args.query, args.k).items():
+                risultati[nome] = r
+                print(f"{nome:<20}{r['mediana_s'] * 1000:>10.3f}{r['byte_indice'] / 1e6:>11.1f}"
+                      f"{r['riduzione']:>10.1f}×{r[f'recall@{args.k}']:>12.3f}")
+
+    if args.output:
+        salva_risultati(args.output, risultati)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
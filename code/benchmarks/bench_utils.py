@@ -0,0 +1,88 @@
+#Utility comuni ai benchmark: misura dei tempi, baseline JSON e confronto per individuare regressioni.
+
+import json, os, platform, statistics, time
+from datetime import datetime, timezone
+from pathlib import Path
+
+BASELINE_DIR = Path(__file__).resolve().parent / "baselines"
+
+
+def misura(fn, ripetizioni: int = 5, riscaldamento: int = 1, unita: int | None = None, nome_unita: str = "op") -> dict:
+    """
+    Esegue `fn` più volte e ritorna le statistiche dei tempi (secondi).
+    Se `unita` è indicato (es. numero di chunk elaborati per chiamata) calcola anche il throughput.
+    """
+    for _ in range(riscaldamento):
+        fn()
+
+    tempi = []
+    for _ in range(ripetizioni):
+        start = time.perf_counter()
+        fn()
+        tempi.append(time.perf_counter() - start)
+
+    tempi.sort()
+    mediana = statistics.median(tempi)
+    risultato = {
+        "mediana_s": mediana,
+        "min_s": tempi[0],
+        "p95_s": tempi[min(len(tempi) - 1, int(round(0.95 * (len(tempi) - 1))))],
+        "ripetizioni": ripetizioni,
+    }
+    if unita:
+        risultato["throughput"] = unita / mediana if mediana > 0 else float("inf")
+        risultato["unita"] = f"{nome_unita}/s"
+    return risultato
+
+
+def metadati() -> dict:
+    """Informazioni sull'ambiente, salvate insieme ai risultati per rendere i confronti leggibili."""
+    return {
+        "data": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "piattaforma": platform.platform(),
+        "cpu": os.cpu_count(),
+    }
+
+
+def salva_risultati(path: Path | str, risultati: dict):
+    """Scrive i risultati in formato JSON (machine-readable) insieme ai metadati."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"meta": metadati(), "risultati": risultati}, f, ensure_ascii=False, indent=2)
+
+
+def carica_risultati(path: Path | str) -> dict | None:
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["risultati"]
+
+
+def confronta(risultati: dict, baseline: dict, soglia: float = 0.20) -> list[dict]:
+    """
+    Confronta la mediana di ogni benchmark con la baseline.
+    Ritorna la lista dei benchmark più lenti della baseline oltre `soglia` (0.20 = +20%).
+    """
+    regressioni = []
+    for nome, r in risultati.items():
+        b = baseline.get(nome)
+        if not b or not b.get("mediana_s"):
+            continue
+        delta = r["mediana_s"] / b["mediana_s"] - 1
+        if delta > soglia:
+            regressioni.append({"nome": nome, "baseline_s": b["mediana_s"], "attuale_s": r["mediana_s"], "delta": delta})
+    return regressioni
+
+
+def stampa_tabella(risultati: dict, baseline: dict | None = None):
+    """Stampa i risultati in forma tabellare, con la variazione rispetto alla baseline se disponibile."""
+    print(f"{'benchmark':<45} {'mediana':>10} {'p95':>10} {'throughput':>18} {'vs baseline':>12}")
+    for nome, r in risultati.items():
+        thr = f"{r['throughput']:.1f} {r['unita']}" if "throughput" in r else "-"
+        delta = "-"
+        if baseline and nome in baseline and baseline[nome].get("mediana_s"):
+            delta = f"{(r['mediana_s'] / baseline[nome]['mediana_s'] - 1) * 100:+.1f}%"
+        print(f"{nome:<45} {r['mediana_s'] * 1000:>8.2f}ms {r['p95_s'] * 1000:>8.2f}ms {thr:>18} {delta:>12}")
@@ -0,0 +1,142 @@
+#Componenti finti per i benchmark offline: embedder locale, LLM finto e generatori di documenti sintetici.
+
+import os, re, random, textwrap, zlib, logging
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+PAROLE = (
+    "motore valvola pressione manutenzione sensore filtro pompa circuito turbina olio "
+    "temperatura controllo sicurezza tubo cavo modulo scheda allarme guasto verifica "
+    "procedura installazione taratura ricambio cuscinetto vite flangia guarnizione"
+).split()
+
+
+# === EMBEDDER LOCALE ===
+class FakeEmbeddings(Embeddings):
+    """
+    Embedder deterministico senza rete: bag-of-words con hashing delle parole su `dim` dimensioni.
+    Testi con parole in comune hanno vettori simili, quindi è utilizzabile anche per misurare hit rate.
+    """
+    def __init__(self, dim: int = 768):
+        self.dim = dim
+
+    def _embed(self, text: str) -> list[float]:
+        v = np.zeros(self.dim, dtype=np.float32)
+        for parola in re.findall(r"\w+", text.lower()):
+            h = zlib.crc32(parola.encode("utf-8"))
+            v[h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        norma = np.linalg.norm(v)
+        return (v / norma if norma else v).tolist()
+
+    def embed_documents(self, texts):
+        """Restituisce gli embedding di una lista di testi"""
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        """Restituisce l'embedding di una singola query"""
+        return self._embed(text)
+
+
+# === LLM FINTO ===
+class FakeLLM:
+    """LLM finto con la stessa interfaccia di GeminiLLM (invoke / __call__): risponde sempre `risposta`."""
+    def __init__(self, risposta: str = "generale"):
+        self.risposta = risposta
+
+    def invoke(self, input):
+        return self.risposta
+
+    def __call__(self, input):
+        return self.invoke(input)
+
+
+def logger_silenzioso(nome="benchmark"):
+    """Logger che non scrive nulla (load_documents & co. loggano sempre)."""
+    logger = logging.getLogger(nome)
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    return logger
+
+
+# === GENERATORI DI DOCUMENTI ===
+def testo_casuale(n_parole: int, seed: int = 0) -> str:
+    """Testo pseudo-tecnico con frasi e paragrafi, riproducibile dato il seed."""
+    rnd = random.Random(seed)
+    frasi, corrente = [], []
+    for i in range(n_parole):
+        corrente.append(rnd.choice(PAROLE))
+        if len(corrente) >= rnd.randint(8, 18):
+            frasi.append(" ".join(corrente).capitalize() + ".")
+            corrente = []
+    if corrente:
+        frasi.append(" ".join(corrente).capitalize() + ".")
+    paragrafi = [" ".join(frasi[i:i + 5]) for i in range(0, len(frasi), 5)]
+    return "\n\n".join(paragrafi)
+
+
+def _escape_pdf(testo: str) -> str:
+    return testo.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def scrivi_pdf(path: str, pagine: list[str]):
+    """Scrive un PDF minimale (Helvetica, solo ASCII) con una pagina per elemento di `pagine`."""
+    n = len(pagine)
+    oggetti = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{4 + 2 * i} 0 R' for i in range(n))}] /Count {n} >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, testo in enumerate(pagine):
+        righe = textwrap.wrap(testo.replace("\n", " "), 95)[:60]
+        stream = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(f"({_escape_pdf(r)}) '" for r in righe) + " ET"
+        oggetti.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>"
+        )
+        oggetti.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    out, offsets = "%PDF-1.4\n", []
+    for i, obj in enumerate(oggetti, start=1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{obj}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(oggetti) + 1}\n0000000000 65535 f \n"
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets)
+    out += f"trailer\n<< /Size {len(oggetti) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    with open(path, "w", encoding="latin-1") as f:
+        f.write(out)
+
+
+def genera_documenti(cartella: str, n_parole: int = 5000, seed: int = 0) -> dict:
+    """Crea un file sintetico per ogni formato supportato (pdf, txt, docx, csv). Ritorna {ext: path}."""
+    import pandas as pd
+    from docx import Document as DocxDocument
+
+    os.makedirs(cartella, exist_ok=True)
+    testo = testo_casuale(n_parole, seed)
+    paragrafi = testo.split("\n\n")
+    files = {}
+
+    files["txt"] = os.path.join(cartella, "bench.txt")
+    with open(files["txt"], "w", encoding="utf-8") as f:
+        f.write(testo)
+
+    files["pdf"] = os.path.join(cartella, "bench.pdf")
+    scrivi_pdf(files["pdf"], [" ".join(paragrafi[i:i + 6]) for i in range(0, len(paragrafi), 6)])
+
+    files["docx"] = os.path.join(cartella, "bench.docx")
+    doc = DocxDocument()
+    for p in paragrafi:
+        doc.add_paragraph(p)
+    doc.save(files["docx"])
+
+    files["csv"] = os.path.join(cartella, "bench.csv")
+    rnd = random.Random(seed)
+    pd.DataFrame({
+        "codice": [f"R{i:05d}" for i in range(n_parole // 10)],
+        "componente": [rnd.choice(PAROLE) for _ in range(n_parole // 10)],
+        "valore": [round(rnd.uniform(0, 100), 2) for _ in range(n_parole // 10)],
+        "note": [" ".join(rnd.choices(PAROLE, k=6)) for _ in range(n_parole // 10)],
+    }).to_csv(files["csv"], index=False)
+
+    return files
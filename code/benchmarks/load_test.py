@@ -0,0 +1,313 @@
+"""
+Test di carico / soak end-to-end: avvia in-process la vera app FastAPI (/init_session, /upload, /chat, /reset)
+con LLM, VLM ed embedding Gemini puntati al mock locale (mock_gemini.py) e simula N sessioni concorrenti
+con traffico misto documenti / immagini / domande generali.
+
+Report: throughput, latenze p50/p95/p99 per endpoint e per agente, crescita memoria per sessione
+(RSS e tracemalloc), file descriptor aperti, dimensione delle cache in RAM dell'app.
+
+Uso (dalla root del progetto):
+    python -m code.benchmarks.load_test --sessioni 20 --turni 5
+    python -m code.benchmarks.load_test --sessioni 10 --durata 600 --latenza 1.0 --errori 0.02 --output soak.json
+"""
+import argparse, asyncio, json, os, random, struct, sys, tempfile, time, tracemalloc, zlib
+from collections import defaultdict
+
+import httpx
+
+from .fakes import testo_casuale, scrivi_pdf
+from .mock_gemini import crea_app_mock, avvia_in_thread
+
+DOMANDE = {
+    "documento": ["Riassumi il documento caricato", "Cerca nel manuale la procedura di manutenzione della pompa",
+                  "Spiega il contenuto del file", "Quali informazioni ci sono sulla pressione?"],
+    "immagine": ["Cosa vedi nella foto?", "Descrivi l'immagine", "Che componente è raffigurato nell'immagine?"],
+    "generale": ["Quanto fa 12 per 7?", "Cos'è un agente in AI?", "Dammi un consiglio per studiare meglio"],
+}
+
+
+# === RISORSE DI PROCESSO ===
+def rss_byte() -> int | None:
+    """RSS corrente del processo (Linux: /proc/self/status)."""
+    try:
+        with open("/proc/self/status") as f:
+            for riga in f:
+                if riga.startswith("VmRSS:"):
+                    return int(riga.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def fd_aperti() -> int | None:
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+def percentile(valori: list[float], p: float) -> float:
+    if not valori:
+        return 0.0
+    ordinati = sorted(valori)
+    return ordinati[min(len(ordinati) - 1, max(0, int(round(p / 100 * len(ordinati) + 0.5)) - 1))]
+
+
+def png_sintetico(lato: int = 64, seed: int = 0) -> bytes:
+    """PNG RGB valido con rumore (nessuna dipendenza grafica)."""
+    rnd = random.Random(seed)
+    righe = b"".join(b"\x00" + bytes(rnd.getrandbits(8) for _ in range(lato * 3)) for _ in range(lato))
+
+    def chunk(tipo, dati):
+        return struct.pack(">I", len(dati)) + tipo + dati + struct.pack(">I", zlib.crc32(tipo + dati) & 0xFFFFFFFF)
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", lato, lato, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(righe)) + chunk(b"IEND", b""))
+
+
+# === GENERATORE DI CARICO ===
+class Statistiche:
+    def __init__(self):
+        self.latenze_endpoint = defaultdict(list)
+        self.latenze_agente = defaultdict(list)
+        self.errori = defaultdict(int)
+        self.sessioni_completate = 0
+        self.richieste = 0
+
+    def registra(self, endpoint: str, durata: float, ok: bool, agente: str | None = None):
+        self.richieste += 1
+        self.latenze_endpoint[endpoint].append(durata)
+        if agente:
+            self.latenze_agente[agente].append(durata)
+        if not ok:
+            self.errori[endpoint] += 1
+
+
+async def _richiesta(client, stats, endpoint, **kwargs):
+    start = time.perf_counter()
+    try:
+        res = await client.post(endpoint, **kwargs)
+        durata = time.perf_counter() - start
+        data = res.json() if res.headers.get("content-type", "").startswith("application/json") else {}
+        agente = data.get("agente") if endpoint == "/chat" else None
+        stats.registra(endpoint, durata, res.status_code < 400 and agente != "errore", agente)
+        return data
+    except Exception:
+        stats.registra(endpoint, time.perf_counter() - start, False)
+        return {}
+
+
+async def _attendi_job(client, stats, session_id: str, job_id: str, intervallo: float = 0.2):
+    """Segue il job di ingestion fino alla fine: la durata complessiva è registrata come "/upload (job)"."""
+    start = time.perf_counter()
+    while True:
+        try:
+            stato = (await client.get(f"/upload/{job_id}", params={"session_id": session_id})).json()
+        except Exception:
+            stato = {"fase": "errore"}
+        if stato.get("fase") in ("completato", "errore"):
+            stats.registra("/upload (job)", time.perf_counter() - start, stato.get("fase") == "completato")
+            return
+        await asyncio.sleep(intervallo)
+
+
+async def sessione(client, stats, profilo: str, turni: int, cartella: str, n: int):
+    """Una sessione utente completa: init → eventuale upload → turni di chat → reset."""
+    data = await _richiesta(client, stats, "/init_session")
+    session_id = data.get("session_id")
+    if not session_id:
+        return
+
+    if profilo == "documento":
+        path = os.path.join(cartella, f"doc_{n}.pdf" if n % 2 else f"doc_{n}.txt")
+        if path.endswith(".pdf"):
+            testo = testo_casuale(1500, seed=n)
+            scrivi_pdf(path, [testo[i:i + 3000] for i in range(0, len(testo), 3000)])
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(testo_casuale(1500, seed=n))
+    elif profilo == "immagine":
+        path = os.path.join(cartella, f"img_{n}.png")
+        with open(path, "wb") as f:
+            f.write(png_sintetico(seed=n))
+    else:
+        path = None
+
+    if path:
+        with open(path, "rb") as f:
+            data = await _richiesta(client, stats, "/upload", files={"file": (os.path.basename(path), f, "application/octet-stream")},
+                                    data={"session_id": session_id})
+        if data.get("job_id"):
+            await _attendi_job(client, stats, session_id, data["job_id"])
+
+    for t in range(turni):
+        domanda = random.choice(DOMANDE[profilo])
+        await _richiesta(client, stats, "/chat", json={"session_id": session_id, "message": domanda})
+
+    await _richiesta(client, stats, "/reset", params={"session_id": session_id})
+    stats.sessioni_completate += 1
+
+
+async def campiona_risorse(app_module, stats, campioni: list, intervallo: float, stop: asyncio.Event):
+    """Campiona periodicamente RSS, memoria tracciata, fd aperti e dimensione delle cache dell'app."""
+    while not stop.is_set():
+        cache = {nome: len(getattr(app_module, nome)) for nome in dir(app_module)
+                 if nome.endswith("_cache") and isinstance(getattr(app_module, nome), dict)}
+        campioni.append({
+            "t": time.monotonic(),
+            "sessioni": stats.sessioni_completate,
+            "rss": rss_byte(),
+            "tracemalloc": tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None,
+            "fd": fd_aperti(),
+            "cache": cache,
+        })
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=intervallo)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def riscaldamento(base_url, args, cartella):
+    """Una sessione per profilo prima delle misure: esclude dal report import lazy e cache di primo avvio."""
+    stats = Statistiche()
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0) as client:
+        for i, profilo in enumerate(args.mix):
+            await sessione(client, stats, profilo, 1, cartella, -1 - i)
+
+
+async def esegui_carico(base_url, app_module, args, cartella) -> tuple[Statistiche, list, float]:
+    stats, campioni = Statistiche(), []
+    profili, pesi = zip(*args.mix.items())
+    stop = asyncio.Event()
+    contatore = iter(range(10**9))
+    limits = httpx.Limits(max_connections=args.sessioni * 2, max_keepalive_connections=args.sessioni)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0, limits=limits) as client:
+        campionatore = asyncio.create_task(campiona_risorse(app_module, stats, campioni, args.intervallo, stop))
+        scadenza = time.monotonic() + args.durata if args.durata else None
+        start = time.perf_counter()
+
+        async def utente():
+            for i in range(10**9 if scadenza else args.sessioni_per_utente):
+                if scadenza and time.monotonic() > scadenza:
+                    break
+                await sessione(client, stats, random.choices(profili, pesi)[0], args.turni, cartella, next(contatore))
+
+        await asyncio.gather(*(utente() for _ in range(args.sessioni)))
+        durata = time.perf_counter() - start
+        stop.set()
+        await campionatore
+    return stats, campioni, durata
+
+
+# === REPORT ===
+def crea_report(stats: Statistiche, campioni: list, durata: float, snapshot_diff, contatori_mock: dict) -> dict:
+    def riepilogo(latenze):
+        return {gruppo: {"n": len(v), "p50_s": percentile(v, 50), "p95_s": percentile(v, 95), "p99_s": percentile(v, 99)}
+                for gruppo, v in sorted(latenze.items())}
+
+    primo, ultimo = campioni[0], campioni[-1]
+    sessioni = max(ultimo["sessioni"] - primo["sessioni"], 1)
+
+    def crescita(chiave):
+        if primo[chiave] is None or ultimo[chiave] is None:
+            return None
+        return {"inizio": primo[chiave], "fine": ultimo[chiave], "per_sessione": (ultimo[chiave] - primo[chiave]) / sessioni}
+
+    return {
+        "durata_s": durata,
+        "richieste": stats.richieste,
+        "sessioni_completate": stats.sessioni_completate,
+        "throughput_rps": stats.richieste / durata if durata else 0.0,
+        "throughput_chat_rps": len(stats.latenze_endpoint["/chat"]) / durata if durata else 0.0,
+        "errori": dict(stats.errori),
+        "latenze_endpoint": riepilogo(stats.latenze_endpoint),
+        "latenze_agente": riepilogo(stats.latenze_agente),
+        "rss_byte": crescita("rss"),
+        "tracemalloc_byte": crescita("tracemalloc"),
+        "fd_aperti": crescita("fd"),
+        "cache_app": {"inizio": primo["cache"], "fine": ultimo["cache"]},
+        "top_allocazioni": [str(s) for s in snapshot_diff[:10]],
+        "mock_gemini": contatori_mock,
+        "campioni": campioni,
+    }
+
+
+def stampa_report(r: dict):
+    print(f"\n⏱️ Durata {r['durata_s']:.1f}s — {r['richieste']} richieste, {r['sessioni_completate']} sessioni")
+    print(f"🚀 Throughput: {r['throughput_rps']:.2f} req/s (chat {r['throughput_chat_rps']:.2f} req/s)")
+    for titolo, chiave in (("endpoint", "latenze_endpoint"), ("agente", "latenze_agente")):
+        print(f"\n{titolo:<20} {'n':>6} {'p50':>9} {'p95':>9} {'p99':>9}")
+        for nome, v in r[chiave].items():
+            print(f"{nome:<20} {v['n']:>6} {v['p50_s']:>8.3f}s {v['p95_s']:>8.3f}s {v['p99_s']:>8.3f}s")
+    if r["errori"]:
+        print(f"\n❌ Errori: {r['errori']}")
+    for nome in ("rss_byte", "tracemalloc_byte", "fd_aperti"):
+        c = r[nome]
+        if c:
+            print(f"📈 {nome}: {c['inizio']} → {c['fine']} ({c['per_sessione']:+.1f} per sessione)")
+    print(f"🗃️ Cache app: {r['cache_app']['inizio']} → {r['cache_app']['fine']}")
+    print("🔎 Top crescita allocazioni:")
+    for riga in r["top_allocazioni"]:
+        print(f"   {riga}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test di carico/soak end-to-end con mock Gemini")
+    parser.add_argument("--sessioni", type=int, default=10, help="Utenti concorrenti")
+    parser.add_argument("--sessioni-per-utente", type=int, default=1, help="Sessioni in sequenza per utente (se --durata=0)")
+    parser.add_argument("--turni", type=int, default=5, help="Messaggi di chat per sessione")
+    parser.add_argument("--durata", type=float, default=0, help="Soak: secondi di esecuzione continua (0 = disattivato)")
+    parser.add_argument("--mix", default="documento=0.4,immagine=0.3,generale=0.3")
+    parser.add_argument("--latenza", type=float, default=0.5, help="Latenza media mock LLM/VLM (s)")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--latenza-embedding", type=float, default=0.02)
+    parser.add_argument("--errori", type=float, default=0.0, help="Tasso errori 429/503 del mock (0-1)")
+    parser.add_argument("--porta-app", type=int, default=8765)
+    parser.add_argument("--porta-mock", type=int, default=9100)
+    parser.add_argument("--intervallo", type=float, default=2.0, help="Intervallo di campionamento risorse (s)")
+    parser.add_argument("--output", help="Salva il report completo in JSON")
+    args = parser.parse_args(argv)
+    args.mix = {k: float(v) for k, v in (p.split("=") for p in args.mix.split(","))}
+
+    # Dati isolati in una cartella temporanea, Gemini → mock, S3 disattivato.
+    # Va fatto prima di importare l'app: config legge l'ambiente all'import.
+    tmp = tempfile.mkdtemp(prefix="loadtest_")
+    os.environ.update({
+        "DATA_DIR": tmp,
+        "GEMINI_API_KEY": "mock",
+        "GEMINI_API_ENDPOINT": f"http://127.0.0.1:{args.porta_mock}",
+        "AWS_ACCESS_KEY_ID": "",
+        "AWS_SECRET_ACCESS_KEY": "",
+    })
+
+    mock_app = crea_app_mock(args.latenza, args.jitter, args.errori, args.latenza_embedding)
+    avvia_in_thread(mock_app, porta=args.porta_mock)
+
+    from .. import app as app_module
+    avvia_in_thread(app_module.app, porta=args.porta_app)
+
+    cartella = os.path.join(tmp, "input")
+    os.makedirs(cartella, exist_ok=True)
+
+    base_url = f"http://127.0.0.1:{args.porta_app}"
+    asyncio.run(riscaldamento(base_url, args, cartella))
+
+    tracemalloc.start()
+    snapshot_iniziale = tracemalloc.take_snapshot()
+    stats, campioni, durata = asyncio.run(esegui_carico(base_url, app_module, args, cartella))
+    snapshot_diff = tracemalloc.take_snapshot().compare_to(snapshot_iniziale, "lineno")
+    tracemalloc.stop()
+
+    report = crea_report(stats, campioni, durata, snapshot_diff, dict(mock_app.state.contatori))
+    stampa_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Report salvato in {args.output}")
+    print(f"📁 Dati di test in {tmp}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
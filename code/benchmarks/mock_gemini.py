@@ -0,0 +1,152 @@
+"""
+Server locale che simula le API REST di Gemini (generateContent, embedContent, batchEmbedContents,
+cachedContents per il context caching) con latenza e tasso di errore configurabili. Usato dal test di carico puntando GEMINI_API_ENDPOINT qui.
+
+Avvio stand-alone:
+    python -m code.benchmarks.mock_gemini --porta 9100 --latenza 0.8 --jitter 0.4 --errori 0.02
+"""
+import argparse, asyncio, random, threading, time, uuid
+from datetime import datetime, timedelta, timezone
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from .fakes import FakeEmbeddings
+
+
+def crea_app_mock(latenza: float = 0.5, jitter: float = 0.2, tasso_errori: float = 0.0,
+                  latenza_embedding: float = 0.05, seed: int | None = None) -> FastAPI:
+    """
+    Crea l'app FastAPI del mock.
+    - latenza/jitter: secondi di attesa per generateContent (uniforme in latenza ± jitter)
+    - latenza_embedding: secondi di attesa per ogni embedContent
+    - tasso_errori: probabilità di rispondere 429 RESOURCE_EXHAUSTED o 503 UNAVAILABLE
+    """
+    app = FastAPI(title="Mock Gemini")
+    rnd = random.Random(seed)
+    embeddings = FakeEmbeddings()
+    app.state.contatori = {"generate": 0, "embed": 0, "errori": 0, "cache": 0}
+    cache_contesto = {}            # nome → testo (istruzioni + contenuti) delle cache di contesto create
+
+    async def _attendi(base: float, variazione: float):
+        await asyncio.sleep(max(0.0, base + rnd.uniform(-variazione, variazione)))
+
+    def _errore():
+        app.state.contatori["errori"] += 1
+        if rnd.random() < 0.5:
+            return JSONResponse(status_code=429, content={"error": {
+                "code": 429, "message": "Quota exceeded (mock)", "status": "RESOURCE_EXHAUSTED"}})
+        return JSONResponse(status_code=503, content={"error": {
+            "code": 503, "message": "The model is overloaded (mock)", "status": "UNAVAILABLE"}})
+
+    def _testo_richiesta(body: dict) -> str:
+        return " ".join(
+            part.get("text", "")
+            for content in body.get("contents", [])
+            for part in content.get("parts", [])
+        )
+
+    def _risposta_testo(prompt: str, n_immagini: int) -> str:
+        if "Sei un router" in prompt:
+            return rnd.choice(["vision", "tecnico", "generale"])
+        if n_immagini:
+            return f"Nelle {n_immagini} immagini vedo un componente meccanico (risposta mock)."
+        return "Risposta simulata dal mock Gemini: " + " ".join(prompt.split()[:12])
+
+    @app.post("/v1beta/models/{modello_azione}")
+    async def modelli(modello_azione: str, request: Request):
+        modello, _, azione = modello_azione.partition(":")
+        body = await request.json()
+
+        if azione == "embedContent":
+            app.state.contatori["embed"] += 1
+            await _attendi(latenza_embedding, latenza_embedding * 0.2)
+            if rnd.random() < tasso_errori:
+                return _errore()
+            testo = " ".join(p.get("text", "") for p in body.get("content", {}).get("parts", []))
+            return {"embedding": {"values": embeddings.embed_query(testo)}}
+
+        if azione == "batchEmbedContents":
+            richieste = body.get("requests", [])
+            app.state.contatori["embed"] += len(richieste)
+            await _attendi(latenza_embedding, latenza_embedding * 0.2)
+            if rnd.random() < tasso_errori:
+                return _errore()
+            testi = [" ".join(p.get("text", "") for p in r.get("content", {}).get("parts", [])) for r in richieste]
+            return {"embeddings": [{"values": v} for v in embeddings.embed_documents(testi)]}
+
+        if azione == "generateContent":
+            app.state.contatori["generate"] += 1
+            await _attendi(latenza, jitter)
+            if rnd.random() < tasso_errori:
+                return _errore()
+            prompt = _testo_richiesta(body)
+            in_cache = len(cache_contesto.get(body.get("cachedContent"), "")) // 4
+            n_immagini = sum(
+                1 for c in body.get("contents", []) for p in c.get("parts", []) if "inlineData" in p or "inline_data" in p
+            )
+            testo = _risposta_testo(prompt, n_immagini)
+            return {
+                "candidates": [{"content": {"parts": [{"text": testo}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+                "usageMetadata": {
+                    "promptTokenCount": len(prompt) // 4 + in_cache,
+                    "cachedContentTokenCount": in_cache,
+                    "candidatesTokenCount": len(testo) // 4,
+                    "totalTokenCount": (len(prompt) + len(testo)) // 4 + in_cache,
+                },
+                "modelVersion": modello,
+            }
+
+        return JSONResponse(status_code=404, content={"error": {"code": 404, "message": f"Azione non simulata: {azione}", "status": "NOT_FOUND"}})
+
+    @app.post("/v1beta/cachedContents")
+    async def crea_cache(request: Request):
+        body = await request.json()
+        app.state.contatori["cache"] += 1
+        await _attendi(latenza, jitter)
+        nome = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        testo = " ".join(p.get("text", "") for p in body.get("systemInstruction", {}).get("parts", [])) + _testo_richiesta(body)
+        cache_contesto[nome] = testo
+        adesso = datetime.now(timezone.utc)
+        ttl = float(body.get("ttl", "3600s").rstrip("s"))
+        return {"name": nome, "model": body.get("model"), "createTime": adesso.isoformat(), "updateTime": adesso.isoformat(),
+                "expireTime": (adesso + timedelta(seconds=ttl)).isoformat(), "usageMetadata": {"totalTokenCount": len(testo) // 4}}
+
+    @app.delete("/v1beta/cachedContents/{nome}")
+    async def elimina_cache(nome: str):
+        cache_contesto.pop(f"cachedContents/{nome}", None)
+        return {}
+
+    return app
+
+
+def avvia_in_thread(app, host: str = "127.0.0.1", porta: int = 9100, timeout: float = 10.0) -> uvicorn.Server:
+    """Avvia un'app ASGI con uvicorn in un thread daemon e attende che sia pronta."""
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=porta, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    scadenza = time.monotonic() + timeout
+    while not server.started:
+        if time.monotonic() > scadenza or not thread.is_alive():
+            raise RuntimeError(f"Server su {host}:{porta} non avviato")
+        time.sleep(0.05)
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mock locale delle API Gemini")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=9100)
+    parser.add_argument("--latenza", type=float, default=0.5, help="Secondi medi per generateContent")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--latenza-embedding", type=float, default=0.05)
+    parser.add_argument("--errori", type=float, default=0.0, help="Tasso di errori 429/503 (0-1)")
+    args = parser.parse_args(argv)
+
+    app = crea_app_mock(args.latenza, args.jitter, args.errori, args.latenza_embedding)
+    uvicorn.run(app, host=args.host, port=args.porta, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
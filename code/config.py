@@ -4,14 +4,21 @@ from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent   
 load_dotenv()   
+DATA_DIR = Path(os.getenv("DATA_DIR", BASE_DIR))   # Radice dei dati (documenti, vectorstore, memorie, log); override utile per test di carico
                              
-UPLOAD_DIR = BASE_DIR/"models_e_docs"
+UPLOAD_DIR = DATA_DIR/"models_e_docs"
 MAX_FILE_SIZE_BYTE = 20 * 1024 * 1024   # Limite massimo in byte
-VECTORSTORE_DIR = BASE_DIR/"models_e_docs"/"vectorstore"
+VECTORSTORE_DIR = DATA_DIR/"models_e_docs"/"vectorstore"
 EMBEDDING_MODEL_DIR = BASE_DIR/"embedding_model"
-MEM_DIR = BASE_DIR/"memorie_utenti"
-LOG_DIR = BASE_DIR/"logs"
+MEM_DIR = DATA_DIR/"memorie_utenti"
+LOG_DIR = DATA_DIR/"logs"
 LOG_LEVEL = "INFO"                       # Choose: DEBUG, INFO, WARNING, ERROR, CRITICAL
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE")   # Opzionale: file JSONL dove esportare gli span per fase (vedi utils/metrics.py)
+
+# === Stato sessioni condiviso tra worker/repliche (storage/session_store.py) ===
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "sqlite")   # "sqlite" (stesso host / volume condiviso) o "redis" (rete)
+SESSION_STORE_PATH = DATA_DIR/"sessioni"/"sessioni.sqlite3"
+SESSION_STORE_URL = os.getenv("SESSION_STORE_URL", "redis://localhost:6379/0")   # "fakeredis://" come stand-in locale
 
 for d in [UPLOAD_DIR, VECTORSTORE_DIR, MEM_DIR, LOG_DIR]:
     Path(d).mkdir(parents=True, exist_ok=True)
@@ -21,10 +28,121 @@ for d in [UPLOAD_DIR, VECTORSTORE_DIR, MEM_DIR, LOG_DIR]:
 LLM_MODEL_NAME="gemini-2.5-flash" #"gemini-flash-latest"                          #run check_models_available_gemini.py
 VLM_MODEL_NAME="gemini-2.5-flash"                        
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")   # Opzionale: endpoint alternativo (es. mock locale http://127.0.0.1:9100), usa transport REST
+
+# === LLM locale (llama.cpp) per router e agente generale (loader/llama_pool.py) ===
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")     # "gemini" | "locale" (pip install llama-cpp-python)
+LLM_LOCAL_MODEL_PATH = os.getenv("LLM_LOCAL_MODEL_PATH", str(BASE_DIR/"models"/"model.gguf"))   # Modello GGUF instruct
+LLM_LOCAL_N_CTX = 2048
+LLM_LOCAL_MAX_TOKENS = 512
+LLM_LOCAL_THREADS = 4                           # Thread per istanza
+LLM_LOCAL_POOL = int(os.getenv("LLM_LOCAL_POOL", 0))   # Istanze del modello; 0 = core disponibili // LLM_LOCAL_THREADS
+LLM_LOCAL_CACHE_BYTES = 256 * 1024 * 1024       # LlamaRAMCache per istanza (stati KV dei prefissi di prompt già valutati)
+
+# === Scheduler richieste Gemini (loader/gemini_scheduler.py) ===
+GEMINI_RATE_LIMITS = {                          # modello → (richieste/secondo, burst), condiviso da LLM, VLM, router ed embedding
+    "gemini-2.5-flash": (5.0, 10),
+    "text-embedding-004": (25.0, 50),
+}
+GEMINI_RATE_DEFAULT = (5.0, 10)                 # Per modelli non elencati sopra
+GEMINI_MAX_RETRIES = 4                          # Tentativi extra su errori transitori (429, 503, timeout)
+GEMINI_BACKOFF_BASE = 0.5                       # Secondi; backoff esponenziale con jitter: uniforme(0, base * 2^tentativo)
+GEMINI_BACKOFF_MAX = 8.0
+GEMINI_HEDGE_DELAY = None                       # Secondi (es. 4.0): dopo questo tempo una chiamata interattiva viene duplicata; None = disattivato
+
+# === Backend di embedding (rag/embeddings.py) ===
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "gemini")      # "gemini" (API) | "locale" (CPU, pip install sentence-transformers)
+EMBEDDING_LOCAL_MODEL = "intfloat/multilingual-e5-small"
+EMBEDDING_FORMATO = os.getenv("EMBEDDING_FORMATO", "torch")       # "torch" | "int8" (quantizzazione dinamica) | "onnx" (pip install optimum[onnxruntime])
+EMBEDDING_ONNX_FILE = None                      # File ONNX nel repo del modello, es. "onnx/model_qint8_avx512_vnni.onnx" (variante quantizzata)
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", max(1, (os.cpu_count() or 2) // 2)))   # Budget thread dell'inferenza locale
+EMBEDDING_BATCH_SIZE = 32                       # Testi massimi per batch del modello locale
+EMBEDDING_MAX_ATTESA_MS = 5                     # Attesa massima per unire richieste concorrenti nello stesso batch
+
+# === Indice condiviso dei documenti (rag/corpus.py) ===
+VECTORSTORE_MODALITA = os.getenv("VECTORSTORE_MODALITA", "corpus")   # "corpus" (indice unico, vettori una volta per hash del file) | "sessione" (un indice per sessione)
+CORPUS_DIR = VECTORSTORE_DIR/"corpus"
+CORPUS_SOGLIA_ESATTA = 2_000                    # Su indici HNSW/IVF/compressi, sotto questi vettori posseduti la ricerca della sessione è esatta sul sottoinsieme
+
+# === Avvio: modelli e grafo creati in background subito dopo l'avvio, invece che all'import di app.py ===
+AVVIO_RISCALDAMENTO = os.getenv("AVVIO_RISCALDAMENTO", "1").lower() in ("1", "true")   # 0: tutto al primo uso
+
+# === Ingestion asincrona dei documenti (rag/ingestione.py) ===
+INGESTIONE_BLOCCO_CHUNK = 256      # Chunk indicizzati (e salvati) per blocco: dopo ogni blocco sono già cercabili in chat
+INGESTIONE_WORKERS = 2             # Job di ingestion eseguiti in parallelo per worker
+INGESTIONE_PARSING_WORKERS = 4     # File di un upload multiplo letti (load_documents) in parallelo
+INGESTIONE_JOB_PER_SESSIONE = 20   # Job più recenti conservati nel record di sessione
+
+# === Cache del parsing dei documenti per hash del file (rag/cache_parsing.py) ===
+PARSING_CACHE = os.getenv("PARSING_CACHE", "1").lower() in ("1", "true")   # 0: ogni load_documents rilegge il file
+PARSING_CACHE_DIR = DATA_DIR/"cache_parsing"
+
+# === Pulizia periodica di file di sessione, indici, memorie e log (storage/janitor.py) ===
+JANITOR_INTERVALLO_S = int(os.getenv("JANITOR_INTERVALLO_S", 3600))   # 0 = nessuna pulizia in background
+SESSIONE_TTL_S = int(os.getenv("SESSIONE_TTL_S", 7 * 24 * 3600))      # Sessioni inattive da più tempo vengono eliminate
+LOG_TTL_S = 30 * 24 * 3600                      # Log di sessioni non più attive oltre questa età (i log di servizio restano)
+JANITOR_GRAZIA_S = 3600                         # File non referenziati più recenti di così non vengono toccati (upload in corso)
+JANITOR_QUOTA_BYTE = int(os.getenv("JANITOR_QUOTA_BYTE", 10 * 1024**3))   # Oltre questa occupazione si eliminano le sessioni meno recenti
+
+# === Agente tecnico: risposta LLM speculativa in parallelo alla RAG (agents/speculazione.py) ===
+TECNICO_SPECULATIVO = os.getenv("TECNICO_SPECULATIVO", "0").lower() in ("1", "true")   # Opt-in: costa una chiamata LLM in più quando la RAG risponde
+TECNICO_SPECULAZIONI_AL_MINUTO = int(os.getenv("TECNICO_SPECULAZIONI_AL_MINUTO", 30))  # Tetto di costo per processo; oltre, fallback sequenziale
+
+# === Chunking dei documenti (rag/chunker.py) ===
+CHUNK_PROFILO = os.getenv("CHUNK_PROFILO", "strutturato")   # "strutturato" (a token, per struttura) | "caratteri" (splitter storico 500/50 caratteri)
+CHUNK_PROFILI_FORMATO = {                       # Profili per formato del chunking strutturato (token stimati)
+    "default": {"token_max": 250, "token_overlap": 30},
+    ".pdf": {"token_max": 300, "token_overlap": 30},
+    ".csv": {"token_max": 400, "token_overlap": 0},   # righe intere, intestazione ripetuta in ogni chunk
+}
+
+# === Post-elaborazione del retrieval (rag/post_retrieval.py) ===
+RAG_CANDIDATI = 10                              # Chunk recuperati con MMR prima del re-ranking
+RAG_MAX_DOCUMENTI = 6                           # Chunk tenuti dopo il re-ranking
+RAG_RERANKER = os.getenv("RAG_RERANKER", "lessicale")   # "lessicale" (BM25 + similarità) | "cross-encoder" | "nessuno"
+RAG_CROSS_ENCODER_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"   # Multilingue, CPU (pip install sentence-transformers)
+RAG_BUDGET_TOKEN = 1000                         # Budget del contesto: oltre si tengono solo le frasi più pertinenti; None = nessuna compressione
+
+# === Cache delle query RAG (rag/cache_ricerca.py) ===
+CACHE_EMBEDDING_QUERY_VOCI = int(os.getenv("CACHE_EMBEDDING_QUERY_VOCI", 2048))   # Embedding delle query per (modello, testo); 0 = disattivata
+CACHE_RISULTATI_VOCI = int(os.getenv("CACHE_RISULTATI_VOCI", 512))               # Risultati MMR per (versione indice, query, parametri); 0 = disattivata
+
+# === Strategia RAG adattiva: contesto completo per i documenti piccoli (rag/contesto_completo.py) ===
+RAG_CONTESTO_COMPLETO_TOKEN = int(os.getenv("RAG_CONTESTO_COMPLETO_TOKEN", 30_000))   # Documenti della sessione entro questi token: tutto il testo, niente retrieval; 0 = sempre retrieval
+CONTESTO_CACHE = os.getenv("CONTESTO_CACHE", "gemini")   # "gemini" (context caching lato provider) | "locale" (contesto ripetuto in ogni prompt)
+CONTESTO_CACHE_TTL_S = 900                      # Durata di una cache di contesto Gemini; scaduta viene ricreata alla domanda successiva
+CONTESTO_CACHE_TOKEN_MIN = 4096                 # Sotto il minimo del provider il contesto va nel prompt, senza cache
+CONTESTO_CACHE_MAX_VOCI = 32                    # Contesti in cache per processo (LRU, condivisi tra sessioni con gli stessi documenti)
+
+# === Tipo di indice FAISS (rag/vectorstore.py) ===
+FAISS_SOGLIA_VETTORI = 50_000                   # Sotto questa soglia resta l'indice esatto (Flat)
+FAISS_LATENZA_TARGET_MS = 10.0                  # Oltre la soglia si migra solo se la ricerca Flat misurata supera questo tempo
+FAISS_INDICE_GRANDE = "hnsw"                    # Indice approssimato per collezioni grandi: "hnsw" o "ivf"
+FAISS_HNSW_M = 32                               # Vicini per nodo HNSW
+FAISS_HNSW_EF_SEARCH = 64                       # Ampiezza di ricerca HNSW (più alto = recall maggiore, più lento)
+FAISS_IVF_NPROBE = 16                           # Liste IVF visitate per query
+
+# === Compressione dei vettori FAISS ===
+FAISS_QUANTIZZAZIONE = os.getenv("FAISS_QUANTIZZAZIONE") or None   # None (float32) | "fp16" (2×) | "sq8" (4×) | "pq" (~16× con M=192)
+FAISS_PQ_M = 192                                # Sotto-quantizzatori PQ (byte per vettore); deve dividere la dimensione degli embedding
+FAISS_RERANK_ESATTO = True                      # Riordina i candidati con i vettori float32 (file vettori.f32 su disco, letto in mmap)
+FAISS_RERANK_FATTORE = 4                        # Candidati presi dall'indice compresso per ogni risultato richiesto
+
+# === Vision multi-immagine ===
+VLM_MAX_IMAGES = 4                              # Immagini più recenti usate per ogni domanda vision (1 = solo l'ultima)
+VLM_MAX_BYTES_PER_REQUEST = 15 * 1024 * 1024    # Budget byte per singola richiesta al VLM (limite inline Gemini ~20 MB)
+VLM_MAX_CONCURRENCY = 4                         # Chiamate parallele massime al VLM quando le immagini non stanno in una richiesta
 
 # === AWS S3 ===
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")          # segreta -> .env / Railway vars
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")  # segreta -> .env / Railway vars
 S3_BUCKET_NAME="buckets3-ninni" 
 AWS_REGION="eu-north-1"
+S3_SYNC_ENABLED = bool(AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY)   # Senza credenziali il sync viene saltato senza chiamate di rete
+CORPUS_VOLUME_CONDIVISO = os.getenv("CORPUS_VOLUME_CONDIVISO", "0").lower() in ("1", "true")   # Tutte le repliche montano lo stesso DATA_DIR (o la replica è una sola)
+# Il corpus non passa da S3: con repliche su volumi diversi ognuna ne avrebbe una copia e su S3 resterebbe
+# l'ultima caricata. Con S3 attivo e un volume non condiviso si torna a un indice per sessione.
+CORPUS_SENZA_VOLUME = VECTORSTORE_MODALITA == "corpus" and S3_SYNC_ENABLED and not CORPUS_VOLUME_CONDIVISO
+if CORPUS_SENZA_VOLUME:
+    VECTORSTORE_MODALITA = "sessione"
 
@@ -0,0 +1,176 @@
+#Cache di contesto per la strategia "contesto completo" (rag/contesto_completo.py): il testo dei documenti
+#viene inviato una volta e le domande successive lo riusano, pagando per intero solo domanda e risposta.
+#CacheContestoGemini usa il context caching di Gemini; CacheContestoLocale non ha cache lato provider
+#(il contesto è ripetuto in ogni prompt) ed è pensata per LLM locali, mock e test.
+
+import hashlib, threading, time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from datetime import timedelta
+from ..config import CONTESTO_CACHE, CONTESTO_CACHE_TTL_S, CONTESTO_CACHE_TOKEN_MIN, CONTESTO_CACHE_MAX_VOCI
+from ..utils.metrics import span
+from ..utils.tokens import conta_token
+from .gemini_scheduler import get_scheduler, nome_modello, PRIORITA_INTERATTIVA
+from .llm_loader import configura_gemini, get_genai
+
+
+@dataclass
+class Generazione:
+    testo: str
+    token_prompt: int           # token fatturati per intero (il contesto solo se non servito dalla cache)
+    token_cache: int = 0        # token di contesto letti dalla cache del provider
+    token_risposta: int = 0
+
+
+class CacheContesto(ABC):
+    """
+    Contesti (istruzioni + testo dei documenti) indicizzati per SHA-256 del contenuto, tenuti in LRU:
+    sessioni con gli stessi documenti condividono la stessa voce. Le voci scadute vengono ricreate.
+    """
+    def __init__(self, max_voci: int = CONTESTO_CACHE_MAX_VOCI):
+        self.max_voci = max_voci
+        self._voci = OrderedDict()
+        self._lock = threading.Lock()
+
+    def genera(self, istruzioni: str, testo: str, prompt: str, logger=None) -> Generazione:
+        """Risposta a `prompt` con il contesto (istruzioni, testo), creato in cache alla prima domanda."""
+        return self._genera(self._voce(istruzioni, testo, logger), prompt)
+
+    def _voce(self, istruzioni: str, testo: str, logger=None):
+        # Nel dizionario c'è un Future per chiave: la creazione (per Gemini una chiamata remota) avviene fuori
+        # dal lock, e solo le richieste dello stesso contesto attendono la voce in creazione
+        chiave = hashlib.sha256(f"{istruzioni}\0{testo}".encode("utf-8")).hexdigest()
+        scaduta, uscite = None, []
+        with self._lock:
+            futuro = self._voci.get(chiave)
+            if futuro is not None and futuro.done() and self._scaduta(futuro.result()):
+                del self._voci[chiave]
+                scaduta, futuro = futuro, None
+            creatore = futuro is None
+            if creatore:
+                futuro = self._voci[chiave] = Future()
+                while len(self._voci) > self.max_voci:
+                    uscite.append(self._voci.popitem(last=False)[1])
+            else:
+                self._voci.move_to_end(chiave)
+
+        if scaduta is not None:
+            self._elimina(scaduta.result())
+        for uscita in uscite:
+            uscita.add_done_callback(self._rilascia)    # una voce ancora in creazione viene liberata appena pronta
+        if not creatore:
+            return futuro.result()
+        try:
+            voce = self._crea(istruzioni, testo, logger)
+        except BaseException as e:
+            with self._lock:
+                if self._voci.get(chiave) is futuro:
+                    del self._voci[chiave]      # la prossima domanda ritenta la creazione
+            futuro.set_exception(e)
+            raise
+        futuro.set_result(voce)
+        return voce
+
+    def _rilascia(self, futuro: Future):
+        if futuro.exception() is None:
+            self._elimina(futuro.result())
+
+    @abstractmethod
+    def _crea(self, istruzioni: str, testo: str, logger=None):
+        """Crea la voce per un contesto (ad es. la cache lato provider)."""
+
+    @abstractmethod
+    def _genera(self, voce, prompt: str) -> Generazione:
+        """Genera la risposta a `prompt` usando il contesto della voce."""
+
+    def _scaduta(self, voce) -> bool:
+        return False
+
+    def _elimina(self, voce):
+        """Libera le risorse della voce uscita dalla LRU."""
+
+
+class CacheContestoLocale(CacheContesto):
+    """Nessuna cache lato provider: il contesto precede ogni domanda nel prompt di `llm` (GeminiLLM o LLM locale)."""
+    def __init__(self, llm, max_voci: int = CONTESTO_CACHE_MAX_VOCI):
+        super().__init__(max_voci)
+        self.llm = llm
+
+    def _crea(self, istruzioni: str, testo: str, logger=None):
+        return f"{istruzioni}\n\n{testo}"
+
+    def _genera(self, voce, prompt: str) -> Generazione:
+        completo = f"{voce}\n\n{prompt}"
+        testo = self.llm.invoke(completo)
+        return Generazione(testo, conta_token(completo), 0, conta_token(testo))
+
+
+class CacheContestoGemini(CacheContesto):
+    """
+    Context caching di Gemini (CachedContent con TTL). Se il testo è sotto il minimo del provider
+    o la creazione della cache fallisce, la voce manda il contesto nel prompt (come CacheContestoLocale)
+    e la creazione viene ritentata alla scadenza della voce.
+    """
+    def __init__(self, model_name: str, ttl_s: int = CONTESTO_CACHE_TTL_S, token_min: int = CONTESTO_CACHE_TOKEN_MIN,
+                 max_voci: int = CONTESTO_CACHE_MAX_VOCI):
+        super().__init__(max_voci)
+        self.model_name = nome_modello(model_name)
+        self.ttl_s = ttl_s
+        self.token_min = token_min
+
+    def _crea(self, istruzioni: str, testo: str, logger=None):
+        genai = get_genai()
+        configura_gemini()
+        # Margine sulla scadenza: una voce non viene usata negli ultimi secondi di vita della cache remota
+        voce = {"scadenza": time.monotonic() + self.ttl_s * 0.9, "cache": None, "testo": testo}
+        if conta_token(testo) >= self.token_min:
+            try:
+                with span("creazione_cache_contesto"):
+                    voce["cache"] = get_scheduler().esegui(self.model_name, lambda: genai.caching.CachedContent.create(
+                        model=f"models/{self.model_name}", system_instruction=istruzioni, contents=[testo],
+                        ttl=timedelta(seconds=self.ttl_s)), hedge=False)
+                voce["modello"] = genai.GenerativeModel.from_cached_content(voce["cache"])
+                return voce
+            except Exception as e:
+                if logger:
+                    logger.warning(f"⚠️ Cache di contesto Gemini non creata, contesto nel prompt: {e!r}")
+        voce["modello"] = genai.GenerativeModel(self.model_name, system_instruction=istruzioni)
+        return voce
+
+    def _genera(self, voce, prompt: str) -> Generazione:
+        contenuto = prompt if voce["cache"] is not None else [voce["testo"], prompt]
+        risposta = get_scheduler().esegui(
+            self.model_name, lambda: voce["modello"].generate_content(contenuto), priorita=PRIORITA_INTERATTIVA)
+        uso = getattr(risposta, "usage_metadata", None)
+        testo = risposta.text
+        if uso is None or not uso.prompt_token_count:
+            inviato = conta_token(prompt) + (0 if voce["cache"] is not None else conta_token(voce["testo"]))
+            return Generazione(testo, inviato, 0, conta_token(testo))
+        in_cache = uso.cached_content_token_count or 0
+        return Generazione(testo, uso.prompt_token_count - in_cache, in_cache, uso.candidates_token_count or 0)
+
+    def _scaduta(self, voce) -> bool:
+        return time.monotonic() >= voce["scadenza"]
+
+    def _elimina(self, voce):
+        if voce["cache"] is not None:
+            try:
+                voce["cache"].delete()
+            except Exception:
+                pass                    # scade comunque per TTL
+
+
+_cache_contesto = None
+_cache_contesto_lock = threading.Lock()
+
+
+def get_cache_contesto(llm, model_name: str) -> CacheContesto:
+    """Cache di contesto del processo: Gemini o locale secondo CONTESTO_CACHE (creata al primo uso)."""
+    global _cache_contesto
+    with _cache_contesto_lock:
+        if _cache_contesto is None:
+            _cache_contesto = (CacheContestoGemini(model_name) if CONTESTO_CACHE == "gemini"
+                               else CacheContestoLocale(llm))
+        return _cache_contesto
@@ -0,0 +1,194 @@
+#Scheduler lato client condiviso per tutte le chiamate Gemini (LLM, VLM, router, embedding):
+#rate limit token-bucket per modello, classi di priorità, retry con jitter e richieste hedged opzionali.
+
+import heapq, itertools, random, threading, time
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from google.api_core import exceptions as gexc
+from ..config import (
+    GEMINI_RATE_LIMITS, GEMINI_RATE_DEFAULT, GEMINI_MAX_RETRIES,
+    GEMINI_BACKOFF_BASE, GEMINI_BACKOFF_MAX, GEMINI_HEDGE_DELAY,
+)
+from ..utils.metrics import GEMINI_QUEUE_WAIT, GEMINI_RETRIES, GEMINI_HEDGES
+
+# Classi di priorità: numero più basso = servito prima
+PRIORITA_INTERATTIVA = 0   # chat, router, VLM, embedding della query
+PRIORITA_SPECULATIVA = 1   # risposte LLM speculative (agente tecnico): annullabili finché sono in coda
+PRIORITA_BACKGROUND = 2    # embedding dei documenti in ingestion
+
+_NOMI_PRIORITA = {PRIORITA_INTERATTIVA: "interattiva", PRIORITA_SPECULATIVA: "speculativa", PRIORITA_BACKGROUND: "background"}
+
+# Evento di annullamento delle chiamate speculative del contesto corrente (vedi `speculativa`)
+_annullamento = contextvars.ContextVar("annullamento_speculativo", default=None)
+
+
+class RichiestaAnnullata(Exception):
+    """La chiamata speculativa è stata annullata prima di essere inviata a Gemini."""
+
+
+@contextmanager
+def speculativa(evento: threading.Event):
+    """
+    Le chiamate Gemini eseguite nel blocco passano con PRIORITA_SPECULATIVA (dopo quelle interattive)
+    e, se `evento` viene impostato mentre sono ancora in coda, escono con RichiestaAnnullata senza consumare quota.
+    """
+    token = _annullamento.set(evento)
+    try:
+        yield
+    finally:
+        _annullamento.reset(token)
+
+# Errori transitori (quota, sovraccarico, timeout): vale la pena riprovare
+ERRORI_RITENTABILI = (
+    gexc.ResourceExhausted, gexc.TooManyRequests, gexc.ServiceUnavailable,
+    gexc.DeadlineExceeded, gexc.InternalServerError,
+)
+
+
+def nome_modello(model_name: str) -> str:
+    """Normalizza 'models/gemini-2.5-flash' → 'gemini-2.5-flash' (chiave dei rate limit)."""
+    return model_name.split("/", 1)[1] if model_name.startswith("models/") else model_name
+
+
+class _CodaModello:
+    """
+    Token bucket per un modello con coda a priorità.
+    Un chiamante passa solo quando è in testa alla coda (priorità, ordine di arrivo) e c'è almeno un token.
+    """
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.token = float(burst)
+        self.ultimo = time.monotonic()
+        self.coda = []
+        self.cond = threading.Condition()
+
+    def _ricarica(self):
+        ora = time.monotonic()
+        self.token = min(self.burst, self.token + (ora - self.ultimo) * self.rate)
+        self.ultimo = ora
+
+    def acquisisci(self, priorita: int, biglietto: int, annullamento: threading.Event | None = None):
+        with self.cond:
+            voce = (priorita, biglietto)
+            heapq.heappush(self.coda, voce)
+            while True:
+                if annullamento is not None and annullamento.is_set():
+                    self.coda.remove(voce)
+                    heapq.heapify(self.coda)
+                    self.cond.notify_all()
+                    raise RichiestaAnnullata()
+                self._ricarica()
+                if self.coda[0] == voce and self.token >= 1:
+                    heapq.heappop(self.coda)
+                    self.token -= 1
+                    self.cond.notify_all()   # il prossimo in coda ricontrolla
+                    return
+                attesa = (1 - self.token) / self.rate if self.token < 1 else None
+                if annullamento is not None:
+                    attesa = min(attesa or 0.05, 0.05)   # ricontrolla l'annullamento anche senza notify
+                self.cond.wait(timeout=attesa)
+
+    def prova_acquisire(self) -> bool:
+        """Prende un token solo se disponibile subito e nessuno è in coda (usato per le richieste hedged)."""
+        with self.cond:
+            self._ricarica()
+            if not self.coda and self.token >= 1:
+                self.token -= 1
+                return True
+            return False
+
+
+class GeminiScheduler:
+    """
+    Punto unico da cui passano le chiamate a Gemini.
+    Uso: scheduler.esegui("gemini-2.5-flash", lambda: model.generate_content(prompt), priorita=PRIORITA_INTERATTIVA)
+    """
+    def __init__(self, limiti: dict = GEMINI_RATE_LIMITS, limite_default: tuple = GEMINI_RATE_DEFAULT,
+                 max_tentativi: int = GEMINI_MAX_RETRIES, backoff_base: float = GEMINI_BACKOFF_BASE,
+                 backoff_max: float = GEMINI_BACKOFF_MAX, hedge_delay: float | None = GEMINI_HEDGE_DELAY):
+        self.limiti = limiti
+        self.limite_default = limite_default
+        self.max_tentativi = max_tentativi
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_delay = hedge_delay
+        self._code = {}
+        self._lock = threading.Lock()
+        self._biglietti = itertools.count()
+        self._executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="gemini-hedge")
+
+    def _coda(self, modello: str) -> _CodaModello:
+        with self._lock:
+            if modello not in self._code:
+                rate, burst = self.limiti.get(modello, self.limite_default)
+                self._code[modello] = _CodaModello(rate, burst)
+            return self._code[modello]
+
+    def _attendi_turno(self, modello: str, priorita: int, annullamento: threading.Event | None = None):
+        start = time.perf_counter()
+        self._coda(modello).acquisisci(priorita, next(self._biglietti), annullamento)
+        GEMINI_QUEUE_WAIT.labels(modello=modello, priorita=_NOMI_PRIORITA.get(priorita, str(priorita))).observe(
+            time.perf_counter() - start)
+
+    def _submit(self, fn):
+        # copy_context: gli span eseguiti nel thread mantengono agente e traccia correnti
+        return self._executor.submit(contextvars.copy_context().run, fn)
+
+    def _chiama_hedged(self, modello: str, fn):
+        """Lancia la richiesta; se non risponde entro hedge_delay ne lancia una copia e tiene la prima che termina."""
+        principale = self._submit(fn)
+        fatti, _ = wait([principale], timeout=self.hedge_delay)
+        if fatti or not self._coda(modello).prova_acquisire():
+            return principale.result()
+
+        GEMINI_HEDGES.labels(modello=modello, esito="lanciata").inc()
+        copia = self._submit(fn)
+        in_corso = {principale, copia}
+        errore = None
+        while in_corso:
+            fatti, in_corso = wait(in_corso, return_when=FIRST_COMPLETED)
+            for f in fatti:
+                if f.exception() is None:
+                    if f is copia:
+                        GEMINI_HEDGES.labels(modello=modello, esito="vinta").inc()
+                    return f.result()
+                errore = f.exception()
+        raise errore
+
+    def esegui(self, modello: str, fn, priorita: int = PRIORITA_INTERATTIVA, hedge: bool | None = None):
+        """
+        Esegue `fn` rispettando il rate limit del modello.
+        Sugli errori transitori riprova con backoff esponenziale "full jitter" (ogni tentativo ripassa dal rate limit).
+        Le richieste hedged (se hedge_delay è configurato) sono attive di default solo per la priorità interattiva.
+        Dentro un blocco `speculativa(...)` la priorità scende a PRIORITA_SPECULATIVA e la chiamata è annullabile.
+        """
+        modello = nome_modello(modello)
+        annullamento = _annullamento.get()
+        if annullamento is not None:
+            priorita = max(priorita, PRIORITA_SPECULATIVA)
+        usa_hedge = self.hedge_delay is not None and (priorita == PRIORITA_INTERATTIVA if hedge is None else hedge)
+
+        for tentativo in range(self.max_tentativi + 1):
+            self._attendi_turno(modello, priorita, annullamento)
+            try:
+                return self._chiama_hedged(modello, fn) if usa_hedge else fn()
+            except ERRORI_RITENTABILI as e:
+                if tentativo == self.max_tentativi:
+                    raise
+                GEMINI_RETRIES.labels(modello=modello, errore=type(e).__name__).inc()
+                time.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** tentativo)))
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> GeminiScheduler:
+    """Scheduler condiviso dal processo (creato al primo uso)."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = GeminiScheduler()
+        return _scheduler
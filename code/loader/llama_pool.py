@@ -0,0 +1,139 @@
+#Backend LLM locale (llama.cpp) per router e agente generale:
+#pool di istanze dimensionato sui core, riuso della KV cache per i prefissi comuni dei prompt e streaming dei token.
+
+import os, threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from langchain_core.messages import BaseMessage
+from langchain_core.prompt_values import ChatPromptValue
+from ..config import LLM_LOCAL_N_CTX, LLM_LOCAL_MAX_TOKENS, LLM_LOCAL_THREADS, LLM_LOCAL_POOL, LLM_LOCAL_CACHE_BYTES
+from ..utils.metrics import span
+
+# Prompt di sistema fisso: è il prefisso comune a tutte le richieste, la sua KV cache viene riusata
+PROMPT_SISTEMA = "Sei un assistente utile e preciso. Rispondi in italiano, in modo chiaro e conciso."
+
+_RUOLI = {"system": "system", "human": "user", "ai": "assistant"}
+
+# Funzione che riceve i token generati (impostata dalla /chat in streaming, propagata nei thread col contesto)
+_destinatario_token = ContextVar("destinatario_token", default=None)
+
+
+def imposta_destinatario_token(callback):
+    """Registra nel contesto corrente la funzione che riceve i token man mano che vengono generati."""
+    _destinatario_token.set(callback)
+
+
+def _messaggi(input) -> list[dict]:
+    """Converte gli input accettati da GeminiLLM in messaggi chat, con il prompt di sistema in testa."""
+    if isinstance(input, ChatPromptValue):
+        messaggi = [{"role": _RUOLI.get(m.type, "user"), "content": m.content} for m in input.messages]
+    elif isinstance(input, tuple) and input[0] == "messages":
+        messaggi = [
+            {"role": _RUOLI.get(m.type, "user"), "content": m.content} if isinstance(m, BaseMessage)
+            else {"role": "user", "content": str(m)}
+            for m in input[1]
+        ]
+    elif isinstance(input, dict):
+        messaggi = [{"role": "user", "content": input.get("input", "")}]
+    elif isinstance(input, str):
+        messaggi = [{"role": "user", "content": input}]
+    else:
+        raise TypeError(f"Tipo di input non supportato: {type(input)}")
+
+    if not messaggi or messaggi[0]["role"] != "system":
+        messaggi.insert(0, {"role": "system", "content": PROMPT_SISTEMA})
+    return messaggi
+
+
+class LlamaPool:
+    """
+    Pool di istanze llama.cpp dello stesso modello (pesi in mmap, quindi condivisi tra le istanze in RAM).
+    Ogni istanza ha la sua KV cache e una LlamaRAMCache: llama.cpp salta la valutazione dei token
+    già visti all'inizio del prompt. Per massimizzare il riuso, una richiesta va all'istanza libera
+    il cui ultimo prompt ha il prefisso comune più lungo (es. tutte le chiamate del router sulla stessa istanza).
+    """
+    def __init__(self, model_path: str, n_istanze: int = LLM_LOCAL_POOL, n_threads: int = LLM_LOCAL_THREADS,
+                 n_ctx: int = LLM_LOCAL_N_CTX, cache_bytes: int = LLM_LOCAL_CACHE_BYTES):
+        self.model_path = model_path
+        self.n_istanze = n_istanze or max(1, (os.cpu_count() or 1) // n_threads)
+        self.n_threads = n_threads
+        self.n_ctx = n_ctx
+        self.cache_bytes = cache_bytes
+        self._libere = []           # [(istanza, ultimo prompt)]
+        self._create = 0
+        self._cond = threading.Condition()
+
+    def _nuova_istanza(self):
+        from llama_cpp import Llama, LlamaRAMCache
+        llama = Llama(model_path=self.model_path, n_ctx=self.n_ctx, n_threads=self.n_threads,
+                      n_gpu_layers=0, verbose=False)
+        if self.cache_bytes:
+            llama.set_cache(LlamaRAMCache(capacity_bytes=self.cache_bytes))
+        return llama
+
+    @contextmanager
+    def istanza(self, prompt: str):
+        """Presta un'istanza per una generazione (le istanze vengono create al primo bisogno)."""
+        with self._cond:
+            while not self._libere and self._create >= self.n_istanze:
+                self._cond.wait()
+            if self._libere:
+                migliore = max(range(len(self._libere)),
+                               key=lambda i: len(os.path.commonprefix([self._libere[i][1], prompt])))
+                llama = self._libere.pop(migliore)[0]
+            else:
+                llama = None
+                self._create += 1
+
+        if llama is None:
+            try:
+                llama = self._nuova_istanza()
+            except Exception:
+                with self._cond:
+                    self._create -= 1
+                    self._cond.notify()
+                raise
+
+        try:
+            yield llama
+        finally:
+            with self._cond:
+                self._libere.append((llama, prompt))
+                self._cond.notify()
+
+
+class LLMLocale:
+    """
+    Stessa interfaccia di GeminiLLM (invoke / __call__ → stringa) su un LlamaPool.
+    Con streaming=True, se la richiesta corrente ha un destinatario dei token (chat NDJSON) i token
+    vengono inoltrati man mano; il router usa un'istanza con streaming=False.
+    """
+    def __init__(self, pool: LlamaPool, streaming: bool = False, max_tokens: int = LLM_LOCAL_MAX_TOKENS,
+                 temperature: float = 0.3):
+        self.pool = pool
+        self.streaming = streaming
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+
+    def invoke(self, input):
+        messaggi = _messaggi(input)
+        destinatario = _destinatario_token.get() if self.streaming else None
+
+        with span("generazione_llm", backend="locale"), \
+                self.pool.istanza("\n".join(m["content"] for m in messaggi)) as llama:
+            if destinatario is None:
+                risposta = llama.create_chat_completion(
+                    messages=messaggi, max_tokens=self.max_tokens, temperature=self.temperature)
+                return risposta["choices"][0]["message"]["content"]
+
+            parti = []
+            for pezzo in llama.create_chat_completion(
+                    messages=messaggi, max_tokens=self.max_tokens, temperature=self.temperature, stream=True):
+                testo = pezzo["choices"][0]["delta"].get("content")
+                if testo:
+                    parti.append(testo)
+                    destinatario(testo)
+            return "".join(parti)
+
+    def __call__(self, input):
+        return self.invoke(input)
@@ -1,20 +1,40 @@
-import os, sys
-from langchain_community.llms import LlamaCpp
-import google.generativeai as genai
-from ..config import GEMINI_API_KEY
-import sys
+import os
+from ..config import GEMINI_API_KEY, GEMINI_API_ENDPOINT
+from ..utils.metrics import span
+from .gemini_scheduler import get_scheduler, PRIORITA_INTERATTIVA
+from .llama_pool import LlamaPool, LLMLocale
 from langchain_core.messages import BaseMessage
 from langchain_core.prompt_values import ChatPromptValue
 
 
 
+def get_genai():
+    """SDK google-generativeai, importato al primo client Gemini (è l'import più pesante dell'avvio, ~0.7 s)."""
+    import google.generativeai as genai
+    return genai
+
+
+# Configurazione unica dell'SDK genai (LLM, VLM ed embedding)
+def configura_gemini(api_key=None):
+    """
+    Configura genai con la chiave API.
+    Se GEMINI_API_ENDPOINT è impostato, le chiamate vanno a quell'endpoint via REST (es. mock locale per i test di carico).
+    """
+    kwargs = {"api_key": api_key or GEMINI_API_KEY}
+    if GEMINI_API_ENDPOINT:
+        kwargs.update(transport="rest", client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+    get_genai().configure(**kwargs)
+
+
 # Carica il modello LLM da file locale
 def get_llm(model_path, logger=None):
 
     if not os.path.exists(model_path):
-        logger.error(f"❌ Modello non trovato in: {model_path}")
-        sys.exit(1)
+        if logger:
+            logger.error(f"❌ Modello non trovato in: {model_path}")
+        raise FileNotFoundError(f"Modello non trovato in: {model_path}")
 
+    from langchain_community.llms import LlamaCpp
     return LlamaCpp(
         model_path=model_path,
         n_ctx=2048,
@@ -28,6 +48,29 @@ def get_llm(model_path, logger=None):
 
 
 
+# Modello locale condiviso da router e agente generale (pool llama.cpp)
+_pool_locale = None
+
+def get_llm_locale(model_path, logger=None, streaming=False):
+    """
+    LLM locale con la stessa interfaccia di GeminiLLM. Tutte le istanze restituite condividono un solo pool,
+    quindi router (streaming=False) e agente generale (streaming=True) non duplicano il modello in RAM.
+    """
+    global _pool_locale
+
+    if not os.path.exists(model_path):
+        if logger:
+            logger.error(f"❌ Modello non trovato in: {model_path}")
+        raise FileNotFoundError(f"Modello non trovato in: {model_path}")
+
+    if _pool_locale is None:
+        _pool_locale = LlamaPool(model_path)
+        if logger:
+            logger.info(f"✅ LLM locale '{os.path.basename(model_path)}': pool di {_pool_locale.n_istanze} istanze "
+                        f"x {_pool_locale.n_threads} thread")
+    return LLMLocale(_pool_locale, streaming=streaming)
+
+
 # Modello API-based: Gemini (Flash o Pro)
 def get_llm_API(model_name=None, logger=None):
     api_key = GEMINI_API_KEY
@@ -35,11 +78,11 @@ def get_llm_API(model_name=None, logger=None):
     if not api_key:
         if logger:
             logger.error("❌ Nessuna chiave API Gemini trovata. Assicurati che sia impostata in .env o config.py.")
-        sys.exit(1)
+        raise ValueError("Nessuna chiave API Gemini trovata. Assicurati che sia impostata in .env o config.py.")
 
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel(model_name)
+        configura_gemini(api_key)
+        model = get_genai().GenerativeModel(model_name)
 
         class GeminiLLM:
             def __init__(self, model):
@@ -73,7 +116,9 @@ def get_llm_API(model_name=None, logger=None):
                     raise TypeError(f"Tipo di input non supportato: {type(input)}")
 
                 # Chiamata a Gemini
-                response = self.model.generate_content(prompt)
+                with span("generazione_llm"):
+                    response = get_scheduler().esegui(
+                        model_name, lambda: self.model.generate_content(prompt), priorita=PRIORITA_INTERATTIVA)
                 return response.text if hasattr(response, "text") else str(response)
 
             def __call__(self, input):   
@@ -84,7 +129,7 @@ def get_llm_API(model_name=None, logger=None):
     except Exception as e:
         if logger:
             logger.exception("❌ Errore durante la configurazione del modello Gemini.")
-        sys.exit(1)
+        raise RuntimeError(f"Errore durante la configurazione del modello Gemini: {e}") from e
 
 
 #Qui non usiamo il wrapper GeminiLLM, ma direttamente GenerativeModel dell’SDK genai.
@@ -100,8 +145,8 @@ def get_vlm_API(model_name=None, logger=None):
         raise ValueError("API key Gemini mancante")
     
     try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        model = genai.GenerativeModel(model_name)
+        configura_gemini(GEMINI_API_KEY)
+        model = get_genai().GenerativeModel(model_name)
         if logger:
             logger.info(f"✅ Modello VLM '{model_name}' inizializzato")
         return model
@@ -7,6 +7,22 @@ from ..config import MEM_DIR
 
 #funzioni per recuperare e salvare la memoria per ogni sessione utente
 
+def messaggi_da_memoria(memory: ChatMessageHistory) -> list:
+    """Cronologia in forma serializzabile: [["human" | "ai", testo], ...] (stesso formato dei file JSON)."""
+    return [["human" if m.type == "human" else "ai", m.content] for m in memory.messages]
+
+
+def memoria_da_messaggi(messaggi: list) -> ChatMessageHistory:
+    """Ricostruisce la cronologia dal formato [["human" | "ai", testo], ...]."""
+    memory = ChatMessageHistory()
+    for role, content in messaggi:
+        if role == "human":
+            memory.add_user_message(content)
+        else:
+            memory.add_ai_message(content)
+    return memory
+
+
 def get_memory(session_id: str) -> ChatMessageHistory:
     """
     Recupera la cronologia chat salvata per una data sessione.
@@ -15,15 +31,10 @@ def get_memory(session_id: str) -> ChatMessageHistory:
     #Creo la cartella per le memorie se non esiste
     os.makedirs(MEM_DIR, exist_ok=True)
     path = os.path.join(MEM_DIR, f"{session_id}.json")
-    memory = ChatMessageHistory()
     if os.path.exists(path):
         with open(path, "r", encoding="utf-8") as f:  
-            for role, content in json.load(f):      
-                if role == "human":
-                    memory.add_user_message(content)
-                else:
-                    memory.add_ai_message(content)
-    return memory
+            return memoria_da_messaggi(json.load(f))
+    return ChatMessageHistory()
 
 
 def save_memory(session_id: str, memory: ChatMessageHistory):
@@ -34,7 +45,7 @@ def save_memory(session_id: str, memory: ChatMessageHistory):
     path = os.path.join(MEM_DIR, f"{session_id}.json")
     with open(path, "w", encoding="utf-8") as f:
         json.dump(              
-            [["human" if m.type == "human" else "ai", m.content] for m in memory.messages],
+            messaggi_da_memoria(memory),
             f,
             ensure_ascii=False,  
             indent=2             
@@ -0,0 +1,47 @@
+#Cache del parsing dei documenti per SHA-256 del file: il testo normalizzato delle pagine/sezioni estratto
+#da PyPDF / python-docx / pandas, con i metadata di pagina, è salvato come JSON compresso con zlib in
+#PARSING_CACHE_DIR. Un nuovo chunking (cambio di profilo), un riavvio o l'upload dello stesso file in
+#un'altra sessione non rileggono il file. Le voci dei documenti che nessuna sessione possiede più
+#vengono eliminate dalla pulizia periodica (storage/janitor.py).
+
+import json, os, zlib
+from pathlib import Path
+from langchain.schema import Document
+from ..config import PARSING_CACHE_DIR
+from ..utils.metrics import RAG_CACHE
+
+VERSIONE_PARSING = 1    # Da incrementare quando cambia l'estrazione in load_documents: le voci precedenti non vengono più lette
+
+
+def percorso_voce(hash_documento: str, ext: str) -> Path:
+    """File della voce: lo stesso contenuto con estensione diversa (es. .txt / .csv) è letto in modo diverso."""
+    return Path(PARSING_CACHE_DIR) / f"{hash_documento}{ext}.v{VERSIONE_PARSING}.json.z"
+
+
+def leggi_pagine(hash_documento: str, ext: str, source: str) -> list[Document] | None:
+    """Pagine estratte in precedenza dallo stesso file (con `source` del file corrente), None se non in cache."""
+    try:
+        with open(percorso_voce(hash_documento, ext), "rb") as f:
+            pagine = json.loads(zlib.decompress(f.read()))
+    except FileNotFoundError:
+        pagine = None
+    except (OSError, zlib.error, ValueError):
+        pagine = None                       # voce illeggibile: si rifà il parsing e la si riscrive
+    RAG_CACHE.labels(cache="parsing", esito="hit" if pagine is not None else "miss").inc()
+    if pagine is None:
+        return None
+    return [Document(page_content=testo, metadata={**metadata, "source": source}) for testo, metadata in pagine]
+
+
+def salva_pagine(hash_documento: str, ext: str, pagine: list[Document], logger=None):
+    """Scrive la voce (file temporaneo rinominato: un worker concorrente legge la voce intera o nessuna)."""
+    percorso = percorso_voce(hash_documento, ext)
+    dati = [[p.page_content, {k: v for k, v in p.metadata.items() if k != "source"}] for p in pagine]
+    temporaneo = percorso.with_name(f"{percorso.name}.{os.getpid()}.tmp")
+    try:
+        percorso.parent.mkdir(parents=True, exist_ok=True)
+        with open(temporaneo, "wb") as f:
+            f.write(zlib.compress(json.dumps(dati, ensure_ascii=False, default=str).encode("utf-8")))
+        os.replace(temporaneo, percorso)
+    except OSError as e:
+        if logger: logger.warning(f"⚠️ Cache del parsing non scritta per {hash_documento[:12]}: {e}")
@@ -0,0 +1,93 @@
+#Cache in RAM delle query RAG, per processo: embedding delle query per (modello, testo) e risultati MMR
+#per (versione dell'indice, query, parametri). La versione cambia da sola quando l'indice riceve nuovi chunk,
+#quindi i risultati in cache non sopravvivono a un add_documents. Entrambe LRU a numero di voci.
+
+import threading, uuid
+from collections import OrderedDict
+import numpy as np
+from ..config import CACHE_EMBEDDING_QUERY_VOCI, CACHE_RISULTATI_VOCI
+from ..utils.metrics import span, RAG_CACHE
+from .corpus import VistaCorpus
+
+
+class CacheLRU:
+    """Dizionario LRU thread-safe con al più `max_voci` voci (0 = cache disattivata)."""
+    def __init__(self, nome: str, max_voci: int):
+        self.nome = nome
+        self.max_voci = max_voci
+        self._voci = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chiave):
+        if not self.max_voci:
+            return None                 # cache disattivata: niente lock né metriche
+        with self._lock:
+            valore = self._voci.get(chiave)
+            if valore is not None:
+                self._voci.move_to_end(chiave)
+        RAG_CACHE.labels(cache=self.nome, esito="hit" if valore is not None else "miss").inc()
+        return valore
+
+    def put(self, chiave, valore):
+        if not self.max_voci:
+            return
+        with self._lock:
+            self._voci[chiave] = valore
+            self._voci.move_to_end(chiave)
+            while len(self._voci) > self.max_voci:
+                self._voci.popitem(last=False)
+
+
+cache_embedding_query = CacheLRU("embedding_query", CACHE_EMBEDDING_QUERY_VOCI)
+cache_risultati = CacheLRU("risultati", CACHE_RISULTATI_VOCI)
+_lock_id = threading.Lock()
+
+
+def _modello(embeddings) -> str:
+    """Identità dell'embedder: classe, modello e formato (vettori di modelli o formati diversi non sono confrontabili)."""
+    # model_name prima di model: per LocalCPUEmbeddings `model` è l'oggetto SentenceTransformer, non il nome
+    nome = getattr(embeddings, "model_name", None) or getattr(embeddings, "model", None)
+    if not isinstance(nome, str):
+        nome = ""
+    return f"{type(embeddings).__name__}:{nome}:{getattr(embeddings, 'formato', '')}"
+
+
+def embedding_query(embeddings, testo: str) -> np.ndarray:
+    """Embedding della query dalla cache, calcolato (e messo in cache come float32) solo se manca."""
+    chiave = (_modello(embeddings), testo)
+    vettore = cache_embedding_query.get(chiave)
+    if vettore is None:
+        with span("embedding_query"):
+            vettore = np.asarray(embeddings.embed_query(testo), dtype="float32")
+        vettore.setflags(write=False)
+        cache_embedding_query.put(chiave, vettore)
+    return vettore
+
+
+def versione_indice(vectorstore) -> tuple:
+    """
+    Versione del contenuto cercabile del vectorstore.
+    Vista sul corpus: documenti posseduti (con il nome che la sessione vede come source) e numero dei loro chunk,
+    così l'ingestion di documenti di altre sessioni non invalida i risultati e sessioni con gli stessi documenti
+    condividono la cache. Indice di sessione: identificativo dell'oggetto e numero di vettori
+    (gli indici crescono solo per aggiunta, ogni add_documents cambia la versione).
+    """
+    if isinstance(vectorstore, VistaCorpus):
+        return ("corpus", tuple(sorted(vectorstore.nomi.items())), len(vectorstore.selettore()[0]))
+    if not hasattr(vectorstore, "_id_cache"):
+        with _lock_id:
+            if not hasattr(vectorstore, "_id_cache"):
+                vectorstore._id_cache = uuid.uuid4().hex
+    return ("sessione", vectorstore._id_cache, vectorstore.index.ntotal)
+
+
+def cerca_mmr(vectorstore, query: str, k: int) -> list:
+    """MMR con punteggi (documento, distanza) come max_marginal_relevance_search_with_score_by_vector, con cache."""
+    chiave = (versione_indice(vectorstore), _modello(vectorstore.embeddings), query, "mmr", k)
+    risultati = cache_risultati.get(chiave)
+    if risultati is None:
+        vettore = embedding_query(vectorstore.embeddings, query)
+        with span("ricerca_faiss"):
+            risultati = vectorstore.max_marginal_relevance_search_with_score_by_vector(vettore, k=k)
+        cache_risultati.put(chiave, risultati)
+    return list(risultati)
@@ -0,0 +1,170 @@
+#Chunking a token e consapevole della struttura (titoli, elenchi, righe di tabella, cambi pagina).
+#Il testo viene diviso in blocchi, poi i blocchi vengono impacchettati in chunk fino a `token_max`:
+#un titolo apre un nuovo chunk, le righe di tabella e le voci di elenco non vengono mai spezzate,
+#e solo i blocchi più grandi di un chunk vengono divisi con lo splitter ricorsivo (misurato in token).
+
+import re
+from dataclasses import dataclass
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain.schema import Document
+from ..config import CHUNK_PROFILI_FORMATO
+from ..utils.tokens import conta_token
+
+_TITOLO_MARKDOWN = re.compile(r"^\s{0,3}#{1,6}\s+\S")
+_TITOLO_NUMERATO = re.compile(r"^\s*(\d+(\.\d+)*\.?|[IVX]+\.|capitolo|sezione|articolo|art\.)\s+\S", re.IGNORECASE)
+_VOCE_ELENCO = re.compile(r"^\s*([-*•▪–]|\d+[.)]|[a-z][.)])\s+\S")
+_RIGA_TABELLA = re.compile(r"\|.*\||\t.*\t")
+
+
+@dataclass
+class Blocco:
+    tipo: str          # "titolo" | "elenco" | "tabella" | "testo"
+    inizio: int        # offset nel testo completo
+    fine: int
+    pagina: int = 0
+    token: int = 0
+
+
+def _tipo_riga(riga: str) -> str:
+    testo = riga.strip()
+    if _RIGA_TABELLA.search(riga):
+        return "tabella"
+    if _VOCE_ELENCO.match(riga):
+        return "elenco"
+    # Titolo: markdown, numerato o tutto maiuscolo, corto e senza punto finale
+    corto = len(testo) <= 80 and not testo.endswith((".", ",", ";", ":"))
+    if _TITOLO_MARKDOWN.match(riga) or (corto and (_TITOLO_NUMERATO.match(riga) or (testo.isupper() and len(testo) > 3))):
+        return "titolo"
+    return "testo"
+
+
+def segmenta(testo: str, inizi_pagina: list[int] = (0,)) -> list[Blocco]:
+    """
+    Divide il testo in blocchi strutturali. Le righe di testo consecutive formano un paragrafo
+    (fino a una riga vuota); la continuazione di una voce di elenco resta nella voce.
+    `inizi_pagina`: offset di inizio di ogni pagina (il cambio pagina chiude sempre il blocco).
+    """
+    blocchi, corrente = [], None
+    pagina, offset = 0, 0
+
+    def chiudi():
+        nonlocal corrente
+        if corrente is not None:
+            corrente.token = conta_token(testo[corrente.inizio:corrente.fine])
+            blocchi.append(corrente)
+            corrente = None
+
+    for riga in testo.splitlines(keepends=True):
+        inizio, fine = offset, offset + len(riga.rstrip("\r\n\f"))
+        offset += len(riga)
+        while pagina + 1 < len(inizi_pagina) and inizio >= inizi_pagina[pagina + 1]:
+            pagina += 1
+            chiudi()
+
+        if not riga.strip():
+            chiudi()
+            continue
+        inizio += len(riga) - len(riga.lstrip())
+        tipo = _tipo_riga(riga)
+
+        if tipo == "testo" and corrente is not None and corrente.tipo in ("testo", "elenco"):
+            corrente.fine = fine                    # continua paragrafo o voce di elenco
+            continue
+        chiudi()
+        corrente = Blocco(tipo, inizio, fine, pagina)
+        if tipo in ("titolo", "tabella"):
+            chiudi()                                # titoli e righe di tabella sono blocchi di una riga
+    chiudi()
+    return blocchi
+
+
+def _sezione(testo: str, blocco: Blocco) -> str:
+    return testo[blocco.inizio:blocco.fine].strip().lstrip("#").strip()
+
+
+def dividi_strutturato(testo: str, metadata: dict, token_max: int, token_overlap: int,
+                       inizi_pagina: list[int] = (0,)) -> list[Document]:
+    """
+    Impacchetta i blocchi in chunk di al più `token_max` token (stimati).
+    Il testo di ogni chunk è esattamente testo[start_index:end_index], così i chunk contigui
+    possono essere riuniti nel contesto RAG; i metadata riportano pagina iniziale e titolo della sezione.
+    Tra un chunk e il successivo della stessa sezione si ripetono gli ultimi blocchi fino a `token_overlap` token.
+    """
+    # Niente add_start_index: LangChain stima l'offset del pezzo successivo sottraendo chunk_overlap in caratteri,
+    # ma qui l'overlap è in token, e la ricerca può fallire (start_index = -1). Gli offset sono calcolati sotto.
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=token_max, chunk_overlap=token_overlap, length_function=conta_token)
+    chunk, gruppo, sezione = [], [], None
+    nuovi = 0          # blocchi del gruppo non ancora emessi (esclusa la coda di overlap)
+
+    def emetti(blocchi: list[Blocco]):
+        inizio, fine = blocchi[0].inizio, blocchi[-1].fine
+        chunk.append(Document(page_content=testo[inizio:fine], metadata={
+            **metadata, "page": blocchi[0].pagina, "start_index": inizio, "end_index": fine,
+            "offset": "documento", **({"sezione": sezione} if sezione else {}),
+        }))
+
+    def chiudi_gruppo(con_overlap: bool):
+        nonlocal gruppo, nuovi
+        if not nuovi:
+            gruppo = []                             # solo overlap già emesso: niente chunk duplicato
+            return
+        emetti(gruppo)
+        nuovi = 0
+        coda, token = [], 0
+        if con_overlap:
+            for b in reversed(gruppo[1:]):          # mai l'intero gruppo: il chunk successivo deve avanzare
+                if token + b.token > token_overlap:
+                    break
+                coda.insert(0, b)
+                token += b.token
+        gruppo = coda
+
+    for blocco in segmenta(testo, inizi_pagina):
+        if blocco.tipo == "titolo":
+            chiudi_gruppo(con_overlap=False)
+            sezione = _sezione(testo, blocco)
+
+        if blocco.token > token_max:
+            # Blocco troppo grande (paragrafo lunghissimo): diviso dallo splitter ricorsivo a token
+            chiudi_gruppo(con_overlap=False)
+            testo_blocco, cursore = testo[blocco.inizio:blocco.fine], 0
+            for pezzo in splitter.split_text(testo_blocco):
+                posizione = testo_blocco.find(pezzo, cursore)
+                if posizione < 0:
+                    posizione = testo_blocco.find(pezzo)
+                s = blocco.inizio + posizione
+                emetti([Blocco(blocco.tipo, s, s + len(pezzo), blocco.pagina)])
+                cursore = posizione + 1
+            continue
+
+        if gruppo and sum(b.token for b in gruppo) + blocco.token > token_max:
+            chiudi_gruppo(con_overlap=True)
+            if gruppo and sum(b.token for b in gruppo) + blocco.token > token_max:
+                gruppo = []                         # l'overlap non lascia spazio al blocco: riparto senza
+        gruppo.append(blocco)
+        nuovi += 1
+    chiudi_gruppo(con_overlap=False)
+    return chunk
+
+
+def dividi_tabella(intestazione: str, righe: list[str], metadata: dict, token_max: int) -> list[Document]:
+    """Righe di una tabella (CSV) impacchettate fino a `token_max`, con l'intestazione ripetuta in ogni chunk."""
+    chunk, gruppo = [], []
+    token_intestazione = conta_token(intestazione)
+    token = token_intestazione
+    for riga in righe:
+        t = conta_token(riga) + 1
+        if gruppo and token + t > token_max:
+            chunk.append(Document(page_content="\n".join([intestazione, *gruppo]), metadata=dict(metadata)))
+            gruppo, token = [], token_intestazione
+        gruppo.append(riga)
+        token += t
+    if gruppo:
+        chunk.append(Document(page_content="\n".join([intestazione, *gruppo]), metadata=dict(metadata)))
+    return chunk
+
+
+def profilo(ext: str) -> dict:
+    """Parametri di chunking per il formato (CHUNK_PROFILI_FORMATO, con ripiego su "default")."""
+    return {**CHUNK_PROFILI_FORMATO["default"], **CHUNK_PROFILI_FORMATO.get(ext, {})}
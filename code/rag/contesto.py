@@ -0,0 +1,66 @@
+#Assemblaggio del contesto RAG consapevole delle posizioni dei chunk (source, pagina, offset):
+#i chunk contigui o sovrapposti vengono uniti in un unico span senza ripetere il testo in overlap,
+#e gli span sono ordinati per posizione nel documento.
+
+from langchain.schema import Document
+
+# Caratteri di distanza ancora considerati "contigui" (lo splitter toglie gli spazi ai bordi dei chunk)
+TOLLERANZA_CONTIGUI = 2
+
+
+def _posizione(doc: Document):
+    # Chunker strutturato: offset relativi all'intero documento; splitter a caratteri: relativi alla pagina
+    if doc.metadata.get("offset") == "documento":
+        return doc.metadata.get("source"), None
+    return doc.metadata.get("source"), doc.metadata.get("page", 0)
+
+
+def _unisci(chunk: list[Document]) -> list[Document]:
+    """Unisce i chunk di una stessa pagina già ordinati per start_index."""
+    uniti_in_span, testo, inizio, fine, primo, uniti = [], "", 0, -1, None, 0
+
+    def chiudi():
+        if primo is not None:
+            uniti_in_span.append(Document(page_content=testo, metadata={
+                **primo.metadata, "start_index": inizio, "end_index": fine, "chunk_uniti": uniti}))
+
+    for doc in chunk:
+        s = doc.metadata["start_index"]
+        e = s + len(doc.page_content)
+        if primo is not None and s <= fine + TOLLERANZA_CONTIGUI:
+            if e > fine:
+                # Tengo solo la parte nuova: l'overlap con lo span corrente è già nel testo
+                testo += doc.page_content[fine - s:] if s <= fine else "\n" + doc.page_content
+                fine = e
+            uniti += 1
+            continue
+        chiudi()
+        testo, inizio, fine, primo, uniti = doc.page_content, s, e, doc, 1
+    chiudi()
+    return uniti_in_span
+
+
+def assembla_contesto(documenti: list[Document]) -> list[Document]:
+    """
+    Raggruppa i documenti (in ordine di rilevanza) per source e pagina, unisce i chunk contigui
+    e ordina gli span per posizione. Le source restano nell'ordine del loro chunk più rilevante.
+    I chunk senza start_index (vectorstore creati prima di add_start_index) restano com'erano.
+    """
+    per_source = {}
+    for doc in documenti:
+        per_source.setdefault(doc.metadata.get("source"), []).append(doc)
+
+    assemblati = []
+    for chunk in per_source.values():
+        posizionati = sorted((d for d in chunk if "start_index" in d.metadata),
+                             key=lambda d: (_posizione(d)[1] or 0, d.metadata["start_index"]))
+        pagina, gruppo = None, []
+        for doc in posizionati:
+            if gruppo and _posizione(doc) != pagina:
+                assemblati += _unisci(gruppo)
+                gruppo = []
+            pagina = _posizione(doc)
+            gruppo.append(doc)
+        assemblati += _unisci(gruppo)
+        assemblati += [d for d in chunk if "start_index" not in d.metadata]
+    return assemblati
@@ -0,0 +1,93 @@
+#Strategia RAG adattiva. Se il testo dei documenti della sessione sta entro RAG_CONTESTO_COMPLETO_TOKEN,
+#l'agente tecnico risponde con tutto il testo come contesto (niente embedding della query, riformulazione
+#e ricerca, niente chunk mancati): il testo è impacchettato una volta e riusato tramite la cache di contesto
+#(loader/cache_contesto.py). Oltre la soglia resta la catena di retrieval (rag_chain.py).
+
+from langchain.schema import Document
+from ..config import RAG_CONTESTO_COMPLETO_TOKEN
+from ..utils.metrics import span, osserva_token_rag
+from ..utils.tokens import conta_token
+from .contesto import assembla_contesto
+from .corpus import VistaCorpus
+
+ISTRUZIONI = (
+    "Sei un assistente tecnico. Rispondi in modo mirato SOLO alla domanda usando i documenti forniti.\n"
+    "- Se l'informazione NON è nei documenti, rispondi: 'Non lo so'.\n"
+    "- Cita le fonti rilevanti con il loro 'source' (es. nome file) in fondo alla risposta.\n"
+)
+MESSAGGI_CRONOLOGIA = 6         # Ultimi messaggi della chat inclusi nel prompt
+
+
+def documenti_vectorstore(vectorstore, token_max: int) -> list[Document] | None:
+    """
+    Tutti i chunk del vectorstore (per una vista sul corpus solo quelli dei documenti posseduti).
+    None se superano certamente `token_max` (oltre 2x: l'overlap tra chunk è ben sotto il 50%)
+    o se un documento è ancora in indicizzazione (il testo sarebbe incompleto).
+    La scelta usa i token stimati per documento (corpus) o dal docstore: i testi sono letti, in una query,
+    solo se la strategia a contesto completo è possibile.
+    """
+    if isinstance(vectorstore, VistaCorpus):
+        corpus = vectorstore.corpus
+        if any(not corpus.contiene(h) for h in vectorstore.nomi):
+            return None
+        token = sum(corpus.token_per_hash.get(h, 0) for h in vectorstore.nomi)
+        ids = vectorstore.ids_docstore()
+    else:
+        token = vectorstore.docstore.token()
+        mappa = vectorstore.index_to_docstore_id
+        ids = [mappa[p] for p in sorted(mappa)]
+    if token > 2 * token_max:
+        return None
+    return vectorstore.docstore.documenti(ids)
+
+
+def impacchetta(documenti: list[Document]) -> str:
+    """Testo dei documenti senza ripetere l'overlap dei chunk, in ordine di posizione, con la fonte di ogni span."""
+    return "\n---\n".join(f"[Fonte: {d.metadata.get('source')}]\n{d.page_content}" for d in assembla_contesto(documenti))
+
+
+class CatenaContestoCompleto:
+    """
+    Stessa interfaccia della catena di retrieval per cerca_contenuti:
+    invoke({"input", "chat_history"}) → {"input", "answer"}. Il contesto è creato in cache alla prima domanda.
+    """
+    strategia = "contesto_completo"
+
+    def __init__(self, testo: str, cache, token: int, logger=None):
+        self.testo = testo
+        self.cache = cache
+        self.token = token
+        self.logger = logger
+
+    def invoke(self, inputs: dict) -> dict:
+        domanda = inputs["input"]
+        cronologia = list(inputs.get("chat_history", []))
+        if cronologia and cronologia[-1].content == domanda:
+            cronologia.pop()                        # la domanda corrente è già in memoria
+        prompt = f"Domanda: {domanda}"
+        if cronologia:
+            righe = "\n".join(f"{'Utente' if m.type == 'human' else 'Assistente'}: {m.content}"
+                              for m in cronologia[-MESSAGGI_CRONOLOGIA:])
+            prompt = f"Cronologia della conversazione:\n{righe}\n\n{prompt}"
+
+        with span("generazione_contesto_completo", token_contesto=self.token):
+            generazione = self.cache.genera(ISTRUZIONI, self.testo, prompt, self.logger)
+        osserva_token_rag(self.strategia, generazione.token_prompt, generazione.token_cache, generazione.token_risposta)
+        return {"input": domanda, "answer": generazione.testo}
+
+
+def build_contesto_completo_chain(vectorstore, cache, token_max: int = RAG_CONTESTO_COMPLETO_TOKEN,
+                                  logger=None) -> CatenaContestoCompleto | None:
+    """Catena a contesto completo se i documenti del vectorstore stanno entro `token_max` token, altrimenti None."""
+    if not token_max or vectorstore is None:
+        return None
+    documenti = documenti_vectorstore(vectorstore, token_max)
+    if not documenti:
+        return None
+    testo = impacchetta(documenti)
+    token = conta_token(testo)
+    if token > token_max:
+        return None
+    if logger:
+        logger.info(f"📚 Strategia RAG: contesto completo ({token} token, {len(documenti)} chunk)")
+    return CatenaContestoCompleto(testo, cache, token, logger)
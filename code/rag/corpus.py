@@ -0,0 +1,499 @@
+#Indice FAISS condiviso tra le sessioni (corpus): i vettori di un documento sono salvati una sola volta
+#per hash SHA-256 del file, qualunque sia il numero di sessioni che lo caricano.
+#Ogni sessione vede il corpus attraverso una VistaCorpus: la ricerca è filtrata (faiss.IDSelector)
+#sui chunk dei documenti che possiede, e nello store delle sessioni resta solo la lista degli hash.
+
+import fcntl, os, shutil, threading, time
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+import faiss
+from langchain_community.vectorstores import FAISS
+from ..config import CORPUS_DIR, CORPUS_SOGLIA_ESATTA
+from ..utils.tokens import conta_token
+from .embeddings import get_embeddings
+from .docstore import FILE_DOCSTORE
+from .vectorstore import (
+    get_vectorstore_multidoc, tipo_indice, scegli_tipo_indice, parametri_ricerca, costruisci_indice,
+    quantizza_vectorstore, scrivi_indice, IndiceQuantizzato, FAISSSQLite, FILE_VETTORI,
+)
+
+# Una compattazione prepara i nuovi file in CARTELLA_COMPATTAZIONE e li sposta al loro posto solo dopo aver
+# scritto il marker: se il processo si interrompe durante lo spostamento, chi prende il lock lo completa.
+CARTELLA_COMPATTAZIONE = "compattazione"
+MARKER_COMPATTAZIONE = "PRONTA"
+FILE_CORPUS = (FILE_DOCSTORE, FILE_VETTORI, "index.faiss")   # index.faiss per ultimo: la sua mtime è la generazione
+# Un file vuoto per hash, toccato quando una sessione adotta un documento già nel corpus (o ne avvia l'indicizzazione):
+# la compattazione non toglie i documenti adottati di recente, anche se il record della sessione non li elenca ancora.
+CARTELLA_ADOZIONI = "adozioni"
+
+
+class Corpus:
+    """
+    Vectorstore FAISS unico in CORPUS_DIR. Ogni chunk ha nei metadata l'hash del documento di origine;
+    `ids_per_hash` mappa l'hash sulle posizioni FAISS dei suoi chunk (ricostruita al caricamento).
+    I worker dello stesso host (o volume) si coordinano con un file lock e ricaricano l'indice
+    quando un altro processo lo ha aggiornato.
+    """
+    def __init__(self, path=CORPUS_DIR, embeddings=None):
+        self.path = str(path)
+        self.embeddings = embeddings
+        self.vectorstore = None
+        self.ids_per_hash: dict[str, np.ndarray] = {}
+        self.chunk_attesi: dict[str, int] = {}     # chunk totali dei documenti indicizzati a blocchi
+        self.token_per_hash: dict[str, int] = {}   # token stimati dei chunk indicizzati (strategia RAG senza leggere i testi)
+        self.generazione = 0            # incrementata a ogni modifica: invalida i selettori delle viste
+        self._versione_disco = None
+        self._lock = threading.RLock()
+        self._lock_file_tenuto = False  # letto e scritto solo sotto self._lock
+        self._lock_stato = threading.Lock()     # scambio di vectorstore e mappe per hash (mai tenuto durante I/O)
+
+    def _file_indice(self) -> str:
+        return os.path.join(self.path, "index.faiss")
+
+    def _versione_su_disco(self):
+        try:
+            return os.stat(self._file_indice()).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _marker_compattazione(self) -> str:
+        return os.path.join(self.path, CARTELLA_COMPATTAZIONE, MARKER_COMPATTAZIONE)
+
+    @contextmanager
+    def _lock_file(self, condiviso: bool = False, attendi: bool = True):
+        """
+        Lock tra processi (worker uvicorn) su .lock: esclusivo per chi scrive index.faiss / docstore.sqlite3,
+        condiviso per chi li carica (mai una compattazione a metà). Produce False se `attendi` è False e il
+        lock è occupato. Va preso sotto self._lock; dentro un lock già tenuto dal processo non fa nulla.
+        """
+        if self._lock_file_tenuto:
+            yield True
+            return
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, ".lock"), "w") as f:
+            try:
+                fcntl.flock(f, (fcntl.LOCK_SH if condiviso else fcntl.LOCK_EX) | (0 if attendi else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            self._lock_file_tenuto = True
+            try:
+                if os.path.exists(self._marker_compattazione()):
+                    fcntl.flock(f, fcntl.LOCK_EX)       # compattazione interrotta durante lo spostamento dei file
+                    self._completa_compattazione()
+                yield True
+            finally:
+                self._lock_file_tenuto = False
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _completa_compattazione(self):
+        """Sposta al loro posto i file preparati da una compattazione (idempotente: riprende da dove si era fermata)."""
+        cartella = os.path.join(self.path, CARTELLA_COMPATTAZIONE)
+        for nome in FILE_CORPUS:
+            if os.path.exists(os.path.join(cartella, nome)):
+                os.replace(os.path.join(cartella, nome), os.path.join(self.path, nome))
+        shutil.rmtree(cartella, ignore_errors=True)
+
+    @staticmethod
+    def _indicizza_hash(vectorstore) -> tuple[dict, dict, dict]:
+        """ids_per_hash, chunk_attesi e token_per_hash di un vectorstore del corpus."""
+        posizioni, attesi = {}, {}
+        # Solo i due campi dei metadata, letti in SQL: i testi dei chunk non vengono caricati
+        for i, h, chunk_totali in vectorstore.docstore.valori_metadata("hash", "chunk_totali"):
+            if h:
+                posizioni.setdefault(h, []).append(i)
+                if chunk_totali is not None:
+                    attesi[h] = chunk_totali
+        ids_per_hash = {h: np.asarray(ids, dtype="int64") for h, ids in posizioni.items()}
+        return ids_per_hash, attesi, {h: n for h, n in vectorstore.docstore.token(per="hash").items() if h}
+
+    def aggiorna_da_disco(self, logger=None) -> bool:
+        """
+        Ricarica il corpus se su disco c'è una versione diversa da quella in memoria. Ritorna True se ricaricato.
+        Chi ha già un corpus in memoria non attende un writer di un altro processo: la ricarica è rimandata
+        al prossimo accesso.
+        """
+        with self._lock:
+            if self._versione_su_disco() == self._versione_disco and not os.path.exists(self._marker_compattazione()):
+                return False
+            with self._lock_file(condiviso=True, attendi=self.vectorstore is None) as preso:
+                if not preso:
+                    return False
+                versione = self._versione_su_disco()
+                if versione == self._versione_disco:
+                    return False
+                vectorstore, mappe = None, ({}, {}, {})     # corpus svuotato da una compattazione
+                if versione is not None:
+                    vectorstore = get_vectorstore_multidoc(
+                        None, self.path, logger, embeddings=self.embeddings or get_embeddings(), migra=False)
+                    mappe = self._indicizza_hash(vectorstore)
+                with self._lock_stato:          # le viste leggono posizioni e id sempre della stessa generazione
+                    self.vectorstore = vectorstore
+                    self.ids_per_hash, self.chunk_attesi, self.token_per_hash = mappe
+                    self._versione_disco = versione
+                    self.generazione += 1
+            self.valuta_migrazione(logger)
+            return True
+
+    def valuta_migrazione(self, logger=None) -> threading.Thread | None:
+        """Come vectorstore.valuta_migrazione, ma la migrazione passa da Corpus.migra (una sola alla volta)."""
+        with self._lock:
+            vectorstore = self.vectorstore
+            if vectorstore is None or getattr(vectorstore, "_migrazione_in_corso", False):
+                return None
+            tipo = scegli_tipo_indice(vectorstore.index)
+            if tipo == tipo_indice(vectorstore.index):
+                return None
+            vectorstore._migrazione_in_corso = True
+
+        def esegui():
+            try:
+                self.migra(vectorstore, tipo, logger)
+            except Exception as e:
+                if logger:
+                    logger.warning(f"⚠️ Migrazione del corpus fallita, resta l'indice attuale: {e}")
+            finally:
+                vectorstore._migrazione_in_corso = False
+
+        thread = threading.Thread(target=esegui, daemon=True, name="corpus-migrazione")
+        thread.start()
+        return thread
+
+    def migra(self, vectorstore, tipo: str, logger=None) -> bool:
+        """
+        Ricostruisce l'indice del corpus nel tipo richiesto. La costruzione avviene su una copia dei vettori,
+        senza lock; lo scambio e il salvataggio sono sotto il lock di thread e il file lock, e solo se il corpus
+        su disco è ancora quello copiato (più i vettori aggiunti nel frattempo da questo worker): se un altro
+        processo lo ha cambiato la migrazione si abbandona e si rivaluta sul corpus ricaricato.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            if self.vectorstore is not vectorstore:
+                return False
+            n0 = vectorstore.index.ntotal
+            vettori = vectorstore.index.reconstruct_n(0, n0)
+        nuovo = costruisci_indice(vettori, tipo, vectorstore.index.metric_type)
+
+        with self._lock, self._lock_file():
+            self.aggiorna_da_disco(logger)
+            if self.vectorstore is not vectorstore or self._versione_su_disco() != self._versione_disco:
+                if logger:
+                    logger.info("🔀 Migrazione del corpus abbandonata: il corpus è cambiato su disco")
+                return False
+            if vectorstore.index.ntotal > n0:
+                nuovo.add(vectorstore.index.reconstruct_n(n0, vectorstore.index.ntotal - n0))
+            vectorstore.index = nuovo
+            vectorstore.save_local(self.path)
+            self._versione_disco = self._versione_su_disco()
+        if logger:
+            logger.info(f"🔀 Indice del corpus migrato flat → {tipo} ({nuovo.ntotal} vettori, {time.perf_counter() - start:.1f}s)")
+        return True
+
+    def contiene(self, hash_documento: str) -> bool:
+        """True se il documento è nel corpus con tutti i suoi chunk."""
+        ids = self.ids_per_hash.get(hash_documento)
+        return ids is not None and len(ids) >= self.chunk_attesi.get(hash_documento, 0)
+
+    def in_indicizzazione(self, hash_documento: str) -> bool:
+        """True se del documento è indicizzata solo una parte (ingestion a blocchi in corso o interrotta)."""
+        return hash_documento in self.ids_per_hash and not self.contiene(hash_documento)
+
+    def adotta(self, hashes: set[str], logger=None) -> set[str]:
+        """
+        Registra che una sessione sta per possedere i documenti `hashes` e ritorna quelli già completi nel corpus.
+        Sotto file lock: l'adozione avviene prima di una compattazione (che la vede) o dopo (e il corpus
+        ricaricato non contiene più i documenti tolti).
+        """
+        with self._lock, self._lock_file(condiviso=True):
+            cartella = os.path.join(self.path, CARTELLA_ADOZIONI)
+            os.makedirs(cartella, exist_ok=True)
+            for h in hashes:
+                with open(os.path.join(cartella, h), "a"):
+                    pass
+                os.utime(os.path.join(cartella, h))
+            self.aggiorna_da_disco(logger)
+            return {h for h in hashes if self.contiene(h)}
+
+    def adottati_di_recente(self, grazia: float, pulisci: bool = False) -> set[str]:
+        """Hash adottati negli ultimi `grazia` secondi; con `pulisci` elimina i file delle adozioni più vecchie."""
+        cartella = os.path.join(self.path, CARTELLA_ADOZIONI)
+        recenti, limite = set(), time.time() - grazia
+        for voce in os.scandir(cartella) if os.path.isdir(cartella) else ():
+            try:
+                if voce.stat().st_mtime >= limite:
+                    recenti.add(voce.name)
+                elif pulisci:
+                    os.remove(voce.path)
+            except FileNotFoundError:
+                pass
+        return recenti
+
+    def aggiungi(self, hash_documento: str, docs, logger=None, blocco: int | None = None, progresso=None) -> bool:
+        """
+        Indicizza i chunk di un documento nel corpus, se il suo hash non è già presente.
+        Ritorna False se il documento era già nel corpus (nessun embedding calcolato).
+        """
+        return bool(self.aggiungi_documenti({hash_documento: docs}, logger, blocco, progresso))
+
+    def aggiungi_documenti(self, docs_per_hash: dict[str, list], logger=None, blocco: int | None = None,
+                           progresso=None) -> list[str]:
+        """
+        Indicizza i chunk di più documenti {hash: chunk}, saltando quelli già presenti. I chunk di documenti
+        diversi sono impacchettati negli stessi blocchi (stessi batch di embedding, una scrittura dell'indice
+        per blocco). Con `blocco` i chunk sono indicizzati e salvati a blocchi: dopo ogni blocco sono già
+        cercabili dalle viste delle sessioni e viene chiamato `progresso(indicizzati, totali)`.
+        Un'indicizzazione interrotta riprende dal primo chunk mancante (il chunking dello stesso file è
+        deterministico), anche se a riprenderla è un altro worker. Ritorna gli hash aggiunti.
+        """
+        totali = sum(len(docs) for docs in docs_per_hash.values())
+        blocco = blocco or max(1, totali)
+        aggiunti = []
+        while True:
+            with self._lock, self._lock_file():
+                self.aggiorna_da_disco(logger)      # non sovrascrivere documenti aggiunti da altri worker
+                parti = []                          # [(hash, chunk mancanti del blocco)]
+                spazio = blocco
+                for h, docs in docs_per_hash.items():
+                    if spazio <= 0:
+                        break
+                    if self.contiene(h):
+                        continue
+                    gia = len(self.ids_per_hash.get(h, ()))
+                    parte = docs[gia:gia + spazio]
+                    if parte:
+                        parti.append((h, parte))
+                        spazio -= len(parte)
+                if not parti:
+                    break
+                for h, parte in parti:
+                    for d in parte:
+                        d.metadata["hash"] = h
+                        d.metadata["chunk_totali"] = len(docs_per_hash[h])
+                n0 = self.vectorstore.index.ntotal if self.vectorstore is not None else 0
+                self.vectorstore = get_vectorstore_multidoc(
+                    [d for _, parte in parti for d in parte], self.path, logger, self.vectorstore,
+                    embeddings=self.embeddings or get_embeddings(), migra=False)
+                for h, parte in parti:
+                    gia = self.ids_per_hash.get(h, np.empty(0, dtype="int64"))
+                    self.ids_per_hash[h] = np.concatenate([gia, np.arange(n0, n0 + len(parte), dtype="int64")])
+                    self.chunk_attesi[h] = len(docs_per_hash[h])
+                    self.token_per_hash[h] = self.token_per_hash.get(h, 0) + sum(conta_token(d.page_content) for d in parte)
+                    n0 += len(parte)
+                    if h not in aggiunti:
+                        aggiunti.append(h)
+                self._versione_disco = self._versione_su_disco()
+                self.generazione += 1
+                indicizzati = sum(min(len(self.ids_per_hash.get(h, ())), len(docs)) for h, docs in docs_per_hash.items())
+            if progresso:
+                progresso(indicizzati, totali)
+        if aggiunti:
+            self.valuta_migrazione(logger)
+        if aggiunti and logger:
+            chunk = sum(len(docs_per_hash[h]) for h in aggiunti)
+            logger.info(f"📚 {len(aggiunti)} documenti aggiunti al corpus condiviso "
+                        f"({chunk} chunk, {len(self.ids_per_hash)} documenti nel corpus)")
+        return aggiunti
+
+    def compatta(self, hash_vivi: set[str], logger=None, grazia: float = 0) -> list[str]:
+        """
+        Toglie dal corpus i documenti che nessuna sessione possiede più e che nessuna ha adottato negli ultimi
+        `grazia` secondi, ricostruendo indice (stesso tipo e compressione) e docstore con i soli chunk rimasti.
+        Ritorna gli hash rimossi.
+        I nuovi file sono scritti a parte e sostituiscono i vecchi con os.replace (index.faiss per ultimo):
+        gli altri worker continuano a leggere la generazione che hanno aperto finché non ricaricano.
+        Non fa nulla se è in corso una migrazione dell'indice.
+        """
+        with self._lock, self._lock_file():
+            self.aggiorna_da_disco(logger)
+            if self.vectorstore is None or getattr(self.vectorstore, "_migrazione_in_corso", False):
+                return []
+            # Adozioni lette sotto il lock esclusivo: un'ingestion che adotta dopo questo punto attende la fine
+            hash_vivi = set(hash_vivi) | self.adottati_di_recente(grazia, pulisci=True)
+            rimossi = [h for h in self.ids_per_hash if h not in hash_vivi]
+            if not rimossi:
+                return []
+
+            vecchio = self.vectorstore
+            tenuti = sorted(i for h, ids in self.ids_per_hash.items() if h in hash_vivi for i in ids.tolist())
+            if not tenuti:
+                for nome in reversed(FILE_CORPUS):      # prima index.faiss: gli altri worker vedono il corpus vuoto
+                    if os.path.exists(os.path.join(self.path, nome)):
+                        os.remove(os.path.join(self.path, nome))
+                with self._lock_stato:
+                    self.vectorstore, self.ids_per_hash, self.chunk_attesi, self.token_per_hash = None, {}, {}, {}
+                    self._versione_disco = None
+                    self.generazione += 1
+                return rimossi
+
+            index = vecchio.index
+            ids = np.asarray(tenuti, dtype="int64")
+            if isinstance(index, IndiceQuantizzato) and index._vettori is not None and len(index._vettori) >= index.ntotal:
+                vettori = np.asarray(index._vettori[ids])
+            else:
+                vettori = (index.base if isinstance(index, IndiceQuantizzato) else index).reconstruct_batch(ids)
+            tipo = tipo_indice(index)
+            mappa = {nuovo: vecchio.index_to_docstore_id[i] for nuovo, i in enumerate(tenuti)}
+            nuovo_indice = costruisci_indice(vettori, tipo if tipo in ("hnsw", "ivf") else "flat", index.metric_type)
+
+            cartella = os.path.join(self.path, CARTELLA_COMPATTAZIONE)
+            shutil.rmtree(cartella, ignore_errors=True)     # residuo di una compattazione interrotta prima del marker
+            os.makedirs(cartella)
+            vecchio.docstore.estrai(os.path.join(cartella, FILE_DOCSTORE), list(mappa.values()))
+            if isinstance(index, IndiceQuantizzato):
+                nuovo = FAISSSQLite(vecchio.embedding_function, nuovo_indice, vecchio.docstore, mappa)
+                nuovo_indice = quantizza_vectorstore(
+                    nuovo, tipo, cartella, rerank=index.percorso_vettori is not None).index.base
+            scrivi_indice(nuovo_indice, Path(cartella) / "index.faiss")
+            open(self._marker_compattazione(), "w").close()
+            self._completa_compattazione()
+
+            self._versione_disco = None         # la nuova generazione si carica da disco come per gli altri worker
+            self.aggiorna_da_disco(logger)
+        if logger:
+            logger.info(f"🧹 Corpus compattato: rimossi {len(rimossi)} documenti, restano {len(tenuti)} chunk")
+        return rimossi
+
+    def vista(self, documenti: list[dict]) -> "VistaCorpus":
+        """Vectorstore della sessione: `documenti` è la lista del record di sessione [{"file", "hash"}]."""
+        return VistaCorpus(self, {d["hash"]: os.path.basename(d["file"]) for d in documenti})
+
+
+class IndiceFiltrato:
+    """
+    Indice visto da LangChain per una sessione (search, reconstruct, ntotal, d): cerca solo tra i chunk
+    dei documenti posseduti. Su indice esatto il filtro è un IDSelector; su indici approssimati o compressi,
+    se i vettori posseduti sono pochi (CORPUS_SOGLIA_ESATTA) la ricerca è esatta sul sottoinsieme,
+    perché HNSW/IVF con un filtro molto selettivo possono restituire meno di k risultati.
+    """
+    def __init__(self, vista: "VistaCorpus"):
+        self.vista = vista
+
+    @property
+    def base(self):
+        return self.vista.corpus.vectorstore.index
+
+    @property
+    def ntotal(self):
+        return self.base.ntotal
+
+    @property
+    def d(self):
+        return self.base.d
+
+    @property
+    def metric_type(self):
+        return self.base.metric_type
+
+    def reconstruct(self, i: int):
+        return self.base.reconstruct(i)
+
+    def _sottoinsieme(self, index, ids: np.ndarray) -> np.ndarray:
+        if isinstance(index, IndiceQuantizzato) and index._vettori is not None and len(index._vettori) >= index.ntotal:
+            return np.asarray(index._vettori[ids])      # vettori float32 originali (mmap)
+        if isinstance(index, IndiceQuantizzato):
+            index = index.base
+        return index.reconstruct_batch(ids)
+
+    def search(self, x, k: int):
+        index = self.base
+        ids, selettore = self.vista.selettore()
+        out_d = np.full((len(x), k), np.inf, dtype="float32")
+        out_i = np.full((len(x), k), -1, dtype="int64")
+        if not len(ids):
+            return out_d, out_i
+
+        if tipo_indice(index) != "flat" and len(ids) <= CORPUS_SOGLIA_ESATTA:
+            distanze, posizioni = faiss.knn(np.ascontiguousarray(x, dtype="float32"), self._sottoinsieme(index, ids),
+                                            min(k, len(ids)), metric=index.metric_type)
+            out_d[:, :posizioni.shape[1]] = distanze
+            out_i[:, :posizioni.shape[1]] = np.where(posizioni >= 0, ids[posizioni], -1)
+            return out_d, out_i
+        return index.search(x, k, params=parametri_ricerca(index, selettore))
+
+
+class _DocstoreSessione:
+    """Docstore del corpus visto da una sessione: la source dei chunk è il nome con cui la sessione ha caricato il file."""
+    def __init__(self, vista: "VistaCorpus"):
+        self.vista = vista
+
+    def _rinomina(self, doc):
+        nome = self.vista.nomi.get(getattr(doc, "metadata", {}).get("hash"))
+        if nome is None:
+            return doc
+        return doc.model_copy(update={"metadata": {**doc.metadata, "source": nome}})
+
+    def search(self, doc_id: str):
+        return self._rinomina(self.vista.corpus.vectorstore.docstore.search(doc_id))
+
+    def documenti(self, ids: list[str]) -> list:
+        return [self._rinomina(d) for d in self.vista.corpus.vectorstore.docstore.documenti(ids)]
+
+
+class VistaCorpus(FAISS):
+    """
+    Vectorstore di sessione sopra il corpus condiviso: stessa interfaccia di ricerca di FAISS (similarity, MMR),
+    nessuna copia dei vettori. Indice, docstore e mappa degli id sono sempre quelli correnti del corpus,
+    anche dopo una migrazione dell'indice o un ricaricamento da disco.
+    """
+    def __init__(self, corpus: Corpus, nomi: dict[str, str]):
+        self.corpus = corpus
+        self.nomi = nomi                # hash → nome del file per questa sessione
+        self._cache_selettore = None
+        vs = corpus.vectorstore
+        super().__init__(vs.embedding_function, IndiceFiltrato(self), _DocstoreSessione(self), {},
+                         normalize_L2=vs._normalize_L2, distance_strategy=vs.distance_strategy)
+
+    @property
+    def index_to_docstore_id(self):
+        return self.corpus.vectorstore.index_to_docstore_id
+
+    @index_to_docstore_id.setter
+    def index_to_docstore_id(self, _):
+        pass                            # la mappa è quella del corpus (impostata da FAISS.__init__)
+
+    @property
+    def hash_mancanti(self) -> list[str]:
+        """Documenti posseduti di cui il corpus non ha ancora nessun chunk."""
+        return [h for h in self.nomi if h not in self.corpus.ids_per_hash]
+
+    def selettore(self) -> tuple[np.ndarray, faiss.IDSelector]:
+        """Id FAISS dei chunk posseduti e relativo IDSelector, ricalcolati solo se il corpus è cambiato."""
+        generazione = self.corpus.generazione   # letta prima delle mappe: al più si ricalcola una volta in più
+        if self._cache_selettore is None or self._cache_selettore[0] != generazione:
+            parti = [self.corpus.ids_per_hash[h] for h in self.nomi if h in self.corpus.ids_per_hash]
+            ids = np.sort(np.concatenate(parti)) if parti else np.empty(0, dtype="int64")
+            self._cache_selettore = (generazione, ids, faiss.IDSelectorBatch(ids))
+        return self._cache_selettore[1], self._cache_selettore[2]
+
+    def ids_docstore(self) -> list[str]:
+        """
+        Id del docstore dei chunk posseduti, in ordine di posizione FAISS. Posizioni e mappa degli id sono
+        lette insieme: un ricaricamento (es. dopo una compattazione) non le mescola.
+        """
+        with self.corpus._lock_stato:
+            if self.corpus.vectorstore is None:
+                return []
+            mappa = self.corpus.vectorstore.index_to_docstore_id
+            parti = [self.corpus.ids_per_hash[h] for h in self.nomi if h in self.corpus.ids_per_hash]
+            return [mappa[p] for p in (np.sort(np.concatenate(parti)).tolist() if parti else [])]
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        raise TypeError("VistaCorpus è in sola lettura: i documenti si aggiungono al corpus con Corpus.aggiungi")
+
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None, **kwargs):
+        raise TypeError("VistaCorpus è in sola lettura: i documenti si aggiungono al corpus con Corpus.aggiungi")
+
+
+_corpus = None
+_corpus_lock = threading.Lock()
+
+
+def get_corpus(logger=None) -> Corpus:
+    """Corpus condiviso del worker, caricato da disco al primo uso."""
+    global _corpus
+    with _corpus_lock:
+        if _corpus is None:
+            _corpus = Corpus(CORPUS_DIR)
+            _corpus.aggiorna_da_disco(logger)
+        return _corpus
@@ -0,0 +1,154 @@
+#Docstore dei vectorstore FAISS su SQLite (docstore.sqlite3 accanto a index.faiss), al posto del pickle index.pkl
+#di LangChain: al caricamento si legge solo la mappa posizione → id, il testo di un chunk viene letto solo quando
+#è tra i risultati di una ricerca, e le aggiunte sono INSERT (i chunk già salvati non vengono riscritti).
+
+import json, os, sqlite3, threading
+from pathlib import Path
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain.schema import Document
+from ..utils.tokens import CARATTERI_PER_TOKEN
+
+FILE_DOCSTORE = "docstore.sqlite3"
+SCHEMA = ("CREATE TABLE IF NOT EXISTS {}chunk ("
+          "posizione INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, testo TEXT NOT NULL, metadata TEXT NOT NULL)")
+
+
+class DocstoreSQLite(Docstore, AddableMixin):
+    """
+    Chunk (testo e metadata JSON) indicizzati per id del docstore, con la loro posizione nell'indice FAISS.
+    Le righe vengono aggiunte nello stesso ordine dei vettori (come fa FAISS.add_documents): `righe` è il numero
+    di vettori dell'indice caricato, le righe oltre sono di un'aggiunta il cui index.faiss non è stato salvato
+    (ignorate in lettura, sovrascritte dalla prossima add). Ogni add è una transazione: nessuna scrittura resta
+    in sospeso fino a save_local. Una connessione per docstore, condivisa tra i thread sotto lock (niente WAL:
+    il file resta autosufficiente per la sincronizzazione S3).
+    """
+    def __init__(self, path, nuovo: bool = False, righe: int | None = None):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if nuovo and os.path.exists(self.path):
+            os.remove(self.path)            # residuo di un salvataggio interrotto prima di index.faiss
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        self._conn.execute(SCHEMA.format(""))
+        if righe is None:
+            righe = self._conn.execute("SELECT COALESCE(MAX(posizione) + 1, 0) FROM chunk").fetchone()[0]
+        self.righe = righe
+
+    def add(self, texts: dict[str, Document]) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM chunk WHERE posizione >= ?", (self.righe,))
+                self._conn.executemany("INSERT INTO chunk VALUES (?, ?, ?, ?)", [
+                    (self.righe + j, doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False, default=str))
+                    for j, (doc_id, doc) in enumerate(texts.items())])
+                self._conn.execute("COMMIT")
+                self.righe += len(texts)
+            except sqlite3.IntegrityError:
+                self._conn.execute("ROLLBACK")
+                raise ValueError("Tried to add ids that already exist")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, ids: list) -> None:
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunk WHERE id = ?", [(i,) for i in ids])
+
+    def search(self, search: str) -> Document | str:
+        with self._lock:
+            riga = self._conn.execute("SELECT testo, metadata FROM chunk WHERE id = ?", (search,)).fetchone()
+        if riga is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=riga[0], metadata=json.loads(riga[1]))
+
+    def mappa_posizioni(self) -> dict[int, str]:
+        """index_to_docstore_id del vectorstore (solo posizioni e id, senza testo)."""
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT posizione, id FROM chunk WHERE posizione < ? ORDER BY posizione", (self.righe,)))
+
+    def documenti(self, ids: list[str]) -> list[Document]:
+        """
+        Chunk con gli `ids` del docstore, nello stesso ordine, letti con una query per blocco di id.
+        La lettura per id (non per posizione) resta corretta anche se il file è stato sostituito da una
+        compattazione: gli id rimossi sono semplicemente assenti.
+        """
+        righe = {}
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                blocco = ids[i:i + 500]
+                righe.update((r[0], r[1:]) for r in self._conn.execute(
+                    f"SELECT id, testo, metadata FROM chunk WHERE id IN ({','.join('?' * len(blocco))})", blocco))
+        return [Document(id=i, page_content=righe[i][0], metadata=json.loads(righe[i][1])) for i in ids if i in righe]
+
+    def token(self, per: str | None = None):
+        """
+        Token stimati dei chunk come conta_token, calcolati in SQL senza leggere i testi:
+        il totale, oppure {valore del campo `per` dei metadata: token}.
+        """
+        stima = f"SUM((LENGTH(testo) + {CARATTERI_PER_TOKEN - 1}) / {CARATTERI_PER_TOKEN})"
+        with self._lock:
+            if per is None:
+                return self._conn.execute(f"SELECT COALESCE({stima}, 0) FROM chunk WHERE posizione < ?",
+                                          (self.righe,)).fetchone()[0]
+            return dict(self._conn.execute(
+                f"SELECT json_extract(metadata, '$.{per}'), {stima} FROM chunk WHERE posizione < ? GROUP BY 1",
+                (self.righe,)))
+
+    def valori_metadata(self, *campi: str) -> list[tuple]:
+        """[(posizione, valore di ogni campo)] letti dal JSON dei metadata, senza caricare i testi."""
+        colonne = "".join(f", json_extract(metadata, '$.{c}')" for c in campi)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT posizione{colonne} FROM chunk WHERE posizione < ? ORDER BY posizione", (self.righe,)).fetchall()
+
+    def estrai(self, path, ids: list[str]) -> None:
+        """
+        Scrive in `path` un docstore nuovo con i soli chunk `ids`, alle posizioni 0..len(ids)-1 nell'ordine dato
+        (compattazione). Il docstore corrente non viene toccato: il nuovo file lo sostituisce con os.replace.
+        """
+        if os.path.exists(path):
+            os.remove(path)
+        with self._lock:
+            self._conn.execute("ATTACH DATABASE ? AS nuovo", (str(path),))
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._conn.execute(SCHEMA.format("nuovo."))
+                    self._conn.execute("CREATE TEMP TABLE nuove (id TEXT PRIMARY KEY, posizione INTEGER NOT NULL)")
+                    self._conn.executemany("INSERT INTO temp.nuove VALUES (?, ?)", [(doc_id, i) for i, doc_id in enumerate(ids)])
+                    self._conn.execute(
+                        "INSERT INTO nuovo.chunk SELECT n.posizione, c.id, c.testo, c.metadata "
+                        "FROM temp.nuove AS n JOIN main.chunk AS c ON c.id = n.id")
+                    self._conn.execute("DROP TABLE temp.nuove")
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            finally:
+                self._conn.execute("DETACH DATABASE nuovo")
+
+    def copia_in(self, path) -> None:
+        """Copia consistente del docstore in `path` (save_local verso un'altra cartella)."""
+        if Path(path).resolve() == Path(self.path).resolve():
+            return
+        destinazione = sqlite3.connect(str(path))
+        try:
+            with self._lock:
+                self._conn.backup(destinazione)
+        finally:
+            destinazione.close()
+
+    def chiudi(self):
+        with self._lock:
+            self._conn.close()
+
+    @classmethod
+    def da_documenti(cls, path, documenti: list[tuple[str, Document]]) -> "DocstoreSQLite":
+        """Docstore nuovo in `path` con i chunk [(id, documento)] nell'ordine delle posizioni FAISS."""
+        docstore = cls(path, nuovo=True)
+        if documenti:
+            docstore.add(dict(documenti))
+        return docstore
@@ -0,0 +1,127 @@
+#Backend di embedding selezionabili con EMBEDDING_BACKEND: "gemini" (API remota) o "locale" (modello su CPU).
+#Il backend locale usa sentence-transformers (opzionale: ONNX Runtime o quantizzazione int8) con batching dinamico.
+#Attenzione: cambiando backend i vettori non sono confrontabili, i vectorstore esistenti vanno ricreati.
+
+import itertools, queue, threading, time
+from concurrent.futures import Future
+from langchain_core.embeddings import Embeddings
+from ..config import (
+    EMBEDDING_BACKEND, EMBEDDING_MODEL_DIR, EMBEDDING_LOCAL_MODEL, EMBEDDING_FORMATO, EMBEDDING_ONNX_FILE,
+    EMBEDDING_THREADS, EMBEDDING_BATCH_SIZE, EMBEDDING_MAX_ATTESA_MS,
+)
+from ..loader.gemini_scheduler import PRIORITA_INTERATTIVA, PRIORITA_BACKGROUND
+from ..utils.metrics import span
+
+
+class LocalCPUEmbeddings(Embeddings):
+    """
+    Embedding con un modello sentence-transformers su CPU.
+    Tutte le richieste (query delle chat e documenti in ingestion) passano da una coda a priorità servita
+    da un solo thread: le richieste arrivate entro `max_attesa_ms` vengono unite in un unico batch fino a
+    `batch_size` testi, e le query vengono servite prima dei blocchi di documenti.
+    `threads` limita i thread usati dall'inferenza (torch o ONNX Runtime).
+    """
+    def __init__(self, model_name: str = EMBEDDING_LOCAL_MODEL, model_dir=EMBEDDING_MODEL_DIR,
+                 formato: str = EMBEDDING_FORMATO, threads: int = EMBEDDING_THREADS,
+                 batch_size: int = EMBEDDING_BATCH_SIZE, max_attesa_ms: float = EMBEDDING_MAX_ATTESA_MS):
+        self.model_name = model_name
+        self.formato = formato
+        self.threads = threads
+        self.batch_size = batch_size
+        self.max_attesa = max_attesa_ms / 1000
+        # I modelli E5 si aspettano i prefissi "query: " / "passage: "
+        e5 = "e5" in model_name.lower()
+        self.prefisso_query = "query: " if e5 else ""
+        self.prefisso_documento = "passage: " if e5 else ""
+
+        self.model = self._carica_modello(str(model_dir))
+        self._coda = queue.PriorityQueue()
+        self._biglietti = itertools.count()
+        threading.Thread(target=self._ciclo_batch, daemon=True, name="embedding-batch").start()
+
+    def _carica_modello(self, model_dir: str):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        torch.set_num_threads(self.threads)
+        if self.formato == "onnx":
+            import onnxruntime as ort
+            opzioni = ort.SessionOptions()
+            opzioni.intra_op_num_threads = self.threads
+            opzioni.inter_op_num_threads = 1
+            model_kwargs = {"provider": "CPUExecutionProvider", "session_options": opzioni}
+            if EMBEDDING_ONNX_FILE:
+                model_kwargs["file_name"] = EMBEDDING_ONNX_FILE
+            return SentenceTransformer(self.model_name, cache_folder=model_dir, device="cpu",
+                                       backend="onnx", model_kwargs=model_kwargs)
+
+        model = SentenceTransformer(self.model_name, cache_folder=model_dir, device="cpu")
+        if self.formato == "int8":
+            # Quantizzazione dinamica dei layer lineari: pesi int8, attivazioni quantizzate a runtime
+            torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        return model
+
+    def _ciclo_batch(self):
+        while True:
+            voci = [self._coda.get()]
+            n_testi = len(voci[0][2])
+            scadenza = time.monotonic() + self.max_attesa
+            while n_testi < self.batch_size:
+                resto = scadenza - time.monotonic()
+                if resto <= 0:
+                    break
+                try:
+                    voce = self._coda.get(timeout=resto)
+                except queue.Empty:
+                    break
+                voci.append(voce)
+                n_testi += len(voce[2])
+
+            testi = [t for voce in voci for t in voce[2]]
+            try:
+                vettori = self.model.encode(testi, batch_size=self.batch_size, normalize_embeddings=True,
+                                            convert_to_numpy=True, show_progress_bar=False)
+            except Exception as e:
+                for voce in voci:
+                    voce[3].set_exception(e)
+                continue
+            inizio = 0
+            for _, _, parte, futuro in voci:
+                futuro.set_result(vettori[inizio:inizio + len(parte)].tolist())
+                inizio += len(parte)
+
+    def _embed(self, testi: list[str], priorita: int) -> list[list[float]]:
+        # I documenti vanno in coda a blocchi di batch_size: una query può inserirsi tra un blocco e l'altro
+        futuri = []
+        for i in range(0, len(testi), self.batch_size):
+            futuro = Future()
+            self._coda.put((priorita, next(self._biglietti), testi[i:i + self.batch_size], futuro))
+            futuri.append(futuro)
+        return [v for futuro in futuri for v in futuro.result()]
+
+    def embed_documents(self, texts):
+        """Restituisce gli embedding di una lista di testi"""
+        with span("embedding_documenti", tipo="ingestion", testi=len(texts)):
+            return self._embed([self.prefisso_documento + t for t in texts], PRIORITA_BACKGROUND)
+
+    def embed_query(self, text):
+        """Restituisce l'embedding di una singola query"""
+        return self._embed([self.prefisso_query + text], PRIORITA_INTERATTIVA)[0]
+
+
+_backend = {}
+_backend_lock = threading.Lock()
+
+
+def get_embeddings(backend: str = EMBEDDING_BACKEND) -> Embeddings:
+    """Embedder del backend configurato, condiviso dal processo (il modello locale viene caricato una volta sola)."""
+    with _backend_lock:
+        if backend not in _backend:
+            if backend == "locale":
+                _backend[backend] = LocalCPUEmbeddings()
+            elif backend == "gemini":
+                from .vectorstore import GoogleGenerativeEmbeddings
+                _backend[backend] = GoogleGenerativeEmbeddings()
+            else:
+                raise ValueError(f"EMBEDDING_BACKEND non supportato: {backend}")
+        return _backend[backend]
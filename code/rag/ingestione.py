@@ -0,0 +1,87 @@
+#Ingestion asincrona dei documenti: /upload registra un job e risponde subito con il suo id,
+#il parsing, l'embedding e la sincronizzazione S3 proseguono in background.
+#Lo stato del job (fase, chunk indicizzati, ETA) è salvato nel record di sessione,
+#così /upload/{job_id} risponde da qualunque worker o replica.
+
+import threading, time, uuid
+from dataclasses import dataclass, field, asdict
+from ..config import INGESTIONE_JOB_PER_SESSIONE
+
+# Fasi di un job, nell'ordine
+FASI = ("in_coda", "parsing", "indicizzazione", "sincronizzazione", "completato", "errore")
+
+
+@dataclass
+class JobIngestione:
+    session_id: str
+    files: list[str]
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    fase: str = "in_coda"
+    chunk_totali: int = 0
+    chunk_indicizzati: int = 0
+    creato: float = field(default_factory=time.time)
+    inizio_indicizzazione: float | None = None
+    aggiornato: float = field(default_factory=time.time)
+    errore: str | None = None
+    scartati: list[dict] = field(default_factory=list)    # [{"file", "errore"}]: file senza contenuto valido
+
+    @property
+    def terminato(self) -> bool:
+        return self.fase in ("completato", "errore")
+
+    def eta_s(self) -> float | None:
+        """Secondi stimati alla fine dell'indicizzazione, dalla velocità dei blocchi già indicizzati."""
+        if self.fase != "indicizzazione" or not self.chunk_indicizzati or self.inizio_indicizzazione is None:
+            return None
+        velocita = self.chunk_indicizzati / max(1e-6, time.time() - self.inizio_indicizzazione)
+        return round((self.chunk_totali - self.chunk_indicizzati) / velocita, 1)
+
+    def come_dict(self) -> dict:
+        return {**asdict(self), "eta_s": self.eta_s()}
+
+
+class RegistroJob:
+    """
+    Job di ingestion del worker, con copia nel record di sessione (chiave "job") a ogni cambio di fase
+    e a ogni blocco indicizzato. Nel record restano solo gli ultimi INGESTIONE_JOB_PER_SESSIONE job.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.locali: dict[str, JobIngestione] = {}
+        self._lock = threading.Lock()
+
+    def _salva(self, job: JobIngestione):
+        stato = job.come_dict()
+
+        def modifica(r):
+            jobs = r.setdefault("job", {})
+            jobs[job.id] = stato
+            for vecchio in sorted(jobs, key=lambda j: jobs[j]["creato"])[:-INGESTIONE_JOB_PER_SESSIONE]:
+                jobs.pop(vecchio)
+        self.store.aggiorna(job.session_id, modifica)
+
+    def crea(self, session_id: str, files: list[str]) -> JobIngestione:
+        job = JobIngestione(session_id, files)
+        with self._lock:
+            self.locali[job.id] = job
+        self._salva(job)
+        return job
+
+    def aggiorna(self, job: JobIngestione, **campi):
+        for nome, valore in campi.items():
+            setattr(job, nome, valore)
+        if campi.get("fase") == "indicizzazione":
+            job.inizio_indicizzazione = time.time()
+        job.aggiornato = time.time()
+        self._salva(job)
+        if job.terminato:
+            with self._lock:
+                self.locali.pop(job.id, None)
+
+    def stato(self, session_id: str, job_id: str) -> dict | None:
+        """Stato del job: dal worker che lo esegue, altrimenti dal record di sessione."""
+        job = self.locali.get(job_id)
+        if job is not None and job.session_id == session_id:
+            return job.come_dict()
+        record = self.store.get(session_id) or {}
+        return (record.get("job") or {}).get(job_id)
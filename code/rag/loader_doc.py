@@ -1,14 +1,79 @@
 import os, sys
-import pandas as pd
-from docx import Document as DocxDocument
-from langchain_community.document_loaders import PyPDFLoader
+# pandas, python-docx e il loader PDF sono importati al primo file del loro formato (avvio più rapido)
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain.schema import Document
+from ..config import CHUNK_PROFILO, PARSING_CACHE
+from ..utils.metrics import span
+from ..utils.hashing import hash_file
+from .cache_parsing import leggi_pagine, salva_pagine
+from .chunker import dividi_strutturato, dividi_tabella, profilo
 
-def load_documents(logger=None, FILE_DIR=None):
+def _testo_docx(doc) -> str:
+    """Testo dei paragrafi DOCX; i paragrafi con stile titolo/elenco vengono marcati per il chunker strutturato."""
+    righe = []
+    for p in doc.paragraphs:
+        stile = (p.style.name if p.style is not None else "").lower()
+        if stile.startswith(("heading", "titolo", "title")):
+            righe.append(f"# {p.text}" if p.text.strip() else p.text)
+        elif stile.startswith(("list", "elenco")):
+            righe.append(f"- {p.text}" if p.text.strip() else p.text)
+        else:
+            righe.append(p.text)
+    return "\n".join(righe)
+
+
+def _unisci_pagine(pages: list[Document]) -> tuple[str, list[int]]:
+    """Testo completo del documento e offset di inizio di ogni pagina."""
+    testo, inizi_pagina = "", []
+    for p in pages:
+        if testo:
+            testo += "\n\n"
+        inizi_pagina.append(len(testo))
+        testo += p.page_content
+    return testo, inizi_pagina or [0]
+
+
+ESTENSIONI_CACHE = (".pdf", ".docx", ".csv")     # Un TXT si rilegge prima di quanto si legga (e decomprima) la voce in cache
+
+
+def _estrai_pagine(FILE_DIR: str, ext: str, logger=None) -> list[Document]:
+    """Parsing del file: pagine (PDF) o testo unico (TXT, DOCX con i titoli marcati, CSV come tabella di testo)."""
+    if ext == ".pdf":
+        if logger: logger.info("📄 Caricamento documento PDF...")
+        from langchain_community.document_loaders import PyPDFLoader
+        loader = PyPDFLoader(FILE_DIR)
+        return loader.load()
+
+    elif ext == ".txt":
+        if logger: logger.info("📄 Caricamento documento TXT...")
+        with open(FILE_DIR, "r", encoding="utf-8") as f:
+            text = f.read()
+        return [Document(page_content=text, metadata={"source": FILE_DIR})]
+
+    elif ext == ".docx":
+        if logger: logger.info("📄 Caricamento documento DOCX...")
+        from docx import Document as DocxDocument
+        doc = DocxDocument(FILE_DIR)
+        return [Document(page_content=_testo_docx(doc), metadata={"source": FILE_DIR})]
+
+    elif ext == ".csv":
+        if logger: logger.info("📄 Caricamento documento CSV...")
+        import pandas as pd
+        df = pd.read_csv(FILE_DIR)
+        text = df.to_string()
+        return [Document(page_content=text, metadata={"source": FILE_DIR})]
+
+    raise ValueError(f"❌ Formato non supportato: {ext}")
+
+
+def load_documents(logger=None, FILE_DIR=None, profilo_chunk=CHUNK_PROFILO, hash_documento=None, usa_cache=PARSING_CACHE):
     """
-    Carica i documenti da un file (PDF o TXT), li splitta in chunk
+    Carica i documenti da un file (PDF, TXT, DOCX o CSV), li splitta in chunk
     e aggiunge i metadata (source = nome file).
+    profilo_chunk: "strutturato" (chunker a token per titoli/elenchi/tabelle, parametri per formato
+    in CHUNK_PROFILI_FORMATO) oppure "caratteri" (splitter storico a 500 caratteri).
+    Con usa_cache le pagine estratte da PDF, DOCX e CSV sono lette/salvate nella cache del parsing per
+    SHA-256 del file (hash_documento se già calcolato dal chiamante): un file già letto viene solo ri-chunkato.
     """
     filename = os.path.basename(FILE_DIR)
 
@@ -21,43 +86,42 @@ def load_documents(logger=None, FILE_DIR=None):
         sys.exit(1)
 
     ext = os.path.splitext(FILE_DIR)[1].lower()
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+    # add_start_index: offset del chunk nella pagina/testo, usato per unire i chunk contigui nel contesto RAG
+    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50, add_start_index=True)
 
     try:
-        if ext == ".pdf":
-            if logger: logger.info("📄 Caricamento documento PDF...")
-            loader = PyPDFLoader(FILE_DIR)
-            pages = loader.load()
-            docs = splitter.split_documents(pages)
-
-        elif ext == ".txt":
-            if logger: logger.info("📄 Caricamento documento TXT...")
-            with open(FILE_DIR, "r", encoding="utf-8") as f:
-                text = f.read()
-            docs = splitter.split_documents([Document(page_content=text, metadata={"source": FILE_DIR})])
-
-        elif ext == ".docx":
-            if logger: logger.info("📄 Caricamento documento DOCX...")
-            doc = DocxDocument(FILE_DIR)
-            full_text = "\n".join([p.text for p in doc.paragraphs])
-            docs = splitter.split_documents([Document(page_content=full_text, metadata={"source": FILE_DIR})])
-
-        elif ext == ".csv":
-            if logger: logger.info("📄 Caricamento documento CSV...")
-            df = pd.read_csv(FILE_DIR)
-            text = df.to_string()
-            docs = splitter.split_documents([Document(page_content=text, metadata={"source": FILE_DIR})])
+        pages = None
+        usa_cache = usa_cache and ext in ESTENSIONI_CACHE
+        if usa_cache:
+            hash_documento = hash_documento or hash_file(FILE_DIR)
+            pages = leggi_pagine(hash_documento, ext, FILE_DIR)
+            if pages is not None and logger:
+                logger.info(f"♻️ Parsing di {filename} già in cache: il file non viene riletto")
+        if pages is None:
+            with span("parsing_documento", tipo="ingestion", formato=ext):
+                pages = _estrai_pagine(FILE_DIR, ext, logger)
+            if usa_cache:
+                salva_pagine(hash_documento, ext, pages, logger)
 
-        else:
-            raise ValueError(f"❌ Formato non supportato: {ext}")
-         
+        with span("chunking", tipo="ingestion", formato=ext, profilo=profilo_chunk):
+            if profilo_chunk == "caratteri":
+                docs = splitter.split_documents(pages)
+            elif ext == ".csv":
+                # Una riga della tabella non viene mai spezzata; l'intestazione è ripetuta in ogni chunk
+                righe = pages[0].page_content.splitlines()
+                docs = dividi_tabella(righe[0], righe[1:], {"source": FILE_DIR}, profilo(ext)["token_max"]) if righe else []
+            else:
+                parametri = profilo(ext)
+                testo, inizi_pagina = _unisci_pagine(pages)
+                docs = dividi_strutturato(testo, {"source": FILE_DIR}, parametri["token_max"],
+                                          parametri["token_overlap"], inizi_pagina)
 
         #Aggiungo il campo "source" ai metadata di ciascun chunk
         for d in docs:
             d.metadata["source"] = filename
 
 
-        logger.info(f"📑 Estratti {len(docs)} chunk da {filename} (source impostato)")
+        if logger: logger.info(f"📑 Estratti {len(docs)} chunk da {filename} (source impostato, profilo {profilo_chunk})")
         return docs
 
 
@@ -0,0 +1,158 @@
+#Post-elaborazione dei risultati del retriever, prima della costruzione del contesto:
+#1) re-ranking locale dei candidati FAISS (lessicale BM25 + similarità vettoriale, oppure cross-encoder opzionale)
+#2) unione dei chunk contigui (rag/contesto.py)
+#3) compressione estrattiva a livello di frase entro un budget di token del contesto.
+
+import math, re, threading
+from collections import Counter
+from langchain.schema import Document
+from ..config import RAG_RERANKER, RAG_CROSS_ENCODER_MODEL, RAG_MAX_DOCUMENTI, RAG_BUDGET_TOKEN
+from ..utils.metrics import span, RAG_CONTEXT_TOKENS, RAG_CONTEXT_TOKENS_SAVED
+from ..utils.tokens import conta_token, parole
+from .contesto import assembla_contesto
+
+# Parole frequenti che non aiutano a distinguere i chunk
+STOPWORD = {
+    "il", "lo", "la", "i", "gli", "le", "un", "uno", "una", "di", "da", "in", "con", "su", "per", "tra", "fra",
+    "del", "dello", "della", "dei", "degli", "delle", "al", "allo", "alla", "ai", "agli", "alle", "dal", "dalla",
+    "nel", "nello", "nella", "nei", "negli", "nelle", "sul", "sulla", "sui", "che", "chi", "cosa", "come", "e",
+    "ed", "o", "ma", "non", "si", "mi", "ti", "ci", "vi", "se", "è", "sono", "era", "essere", "ha", "hanno",
+    "questo", "questa", "quello", "quella", "quale", "quali", "quanto", "dove", "quando", "perché", "anche",
+    "the", "of", "and", "to", "a", "is", "are", "what", "how",
+}
+
+# Fine frase: punteggiatura seguita da spazio, oppure a capo
+_FINE_FRASE = re.compile(r"(?<=[.!?;:])\s+|\n+")
+
+
+def termini(testo: str) -> list[str]:
+    """Parole significative, troncate a 6 caratteri (stemming grezzo: documento/documenti → docume)."""
+    return [p[:6] for p in parole(testo) if len(p) > 1 and p not in STOPWORD]
+
+
+def bm25(query: list[str], testi: list[list[str]], k1: float = 1.2, b: float = 0.75) -> list[float]:
+    """Punteggio BM25 di ogni testo (già diviso in termini) rispetto ai termini della query."""
+    if not testi:
+        return []
+    n = len(testi)
+    lunghezza_media = sum(len(t) for t in testi) / n or 1
+    df = Counter(t for testo in testi for t in set(testo))
+    punteggi = []
+    for testo in testi:
+        tf = Counter(testo)
+        punteggio = 0.0
+        for q in set(query):
+            if q in tf:
+                idf = math.log(1 + (n - df[q] + 0.5) / (df[q] + 0.5))
+                punteggio += idf * tf[q] * (k1 + 1) / (tf[q] + k1 * (1 - b + b * len(testo) / lunghezza_media))
+        punteggi.append(punteggio)
+    return punteggi
+
+
+def _normalizza(valori: list[float]) -> list[float]:
+    massimo = max(valori, default=0)
+    return [v / massimo for v in valori] if massimo > 0 else [0.0] * len(valori)
+
+
+## === RE-RANKING ===
+
+_cross_encoder = None
+_cross_encoder_lock = threading.Lock()
+
+
+def _get_cross_encoder():
+    global _cross_encoder
+    with _cross_encoder_lock:
+        if _cross_encoder is None:
+            from sentence_transformers import CrossEncoder
+            _cross_encoder = CrossEncoder(RAG_CROSS_ENCODER_MODEL, device="cpu")
+        return _cross_encoder
+
+
+def rerank(query: str, risultati: list[tuple[Document, float]], max_documenti: int = RAG_MAX_DOCUMENTI,
+           metodo: str = RAG_RERANKER) -> list[Document]:
+    """
+    Riordina i candidati (documento, distanza FAISS) e tiene i migliori `max_documenti`.
+    - "lessicale": media tra similarità vettoriale e BM25 della query sui candidati (nessun modello, < 1 ms)
+    - "cross-encoder": punteggio di un cross-encoder multilingue su CPU (pip install sentence-transformers)
+    - "nessuno": ordine del retriever
+    """
+    documenti = [doc for doc, _ in risultati]
+    if metodo == "nessuno" or len(documenti) <= 1:
+        return documenti[:max_documenti]
+
+    if metodo == "cross-encoder":
+        punteggi = list(_get_cross_encoder().predict([(query, d.page_content) for d in documenti]))
+    else:
+        similarita = _normalizza([1 / (1 + max(distanza, 0)) for _, distanza in risultati])
+        lessicale = _normalizza(bm25(termini(query), [termini(d.page_content) for d in documenti]))
+        punteggi = [0.5 * s + 0.5 * l for s, l in zip(similarita, lessicale)]
+
+    ordine = sorted(range(len(documenti)), key=lambda i: punteggi[i], reverse=True)
+    return [documenti[i] for i in ordine[:max_documenti]]
+
+
+## === COMPRESSIONE ESTRATTIVA ===
+
+def frasi(testo: str) -> list[str]:
+    return [f.strip() for f in _FINE_FRASE.split(testo) if f.strip()]
+
+
+def comprimi(query: str, documenti: list[Document], budget_token: int | None = RAG_BUDGET_TOKEN) -> list[Document]:
+    """
+    Tiene le frasi più pertinenti alla query finché il contesto resta entro `budget_token`.
+    Le frasi sono scelte per punteggio BM25 (a parità, documento meglio classificato e posizione),
+    poi rimesse nell'ordine originale; i documenti senza frasi scelte vengono scartati.
+    Se i documenti stanno già nel budget non viene tolto nulla.
+    """
+    if not budget_token or sum(conta_token(d.page_content) for d in documenti) <= budget_token:
+        return documenti
+
+    candidate = [(i, j, f) for i, d in enumerate(documenti) for j, f in enumerate(frasi(d.page_content))]
+    punteggi = bm25(termini(query), [termini(f) for _, _, f in candidate])
+    ordine = sorted(range(len(candidate)), key=lambda c: (-punteggi[c], candidate[c][0], candidate[c][1]))
+
+    scelte, usati = set(), 0
+    for c in ordine:
+        token = conta_token(candidate[c][2])
+        if usati + token > budget_token:
+            continue
+        scelte.add(c)
+        usati += token
+    if not scelte:   # nessuna frase entra nel budget (frasi lunghissime): meglio il primo documento intero che niente
+        return documenti[:1]
+
+    compressi = []
+    for i, doc in enumerate(documenti):
+        tenute = [(j, f) for c, (d, j, f) in enumerate(candidate) if d == i and c in scelte]
+        if not tenute:
+            continue
+        # " … " segnala al modello che tra due frasi è stato tolto del testo
+        testo = tenute[0][1]
+        for (j_prec, _), (j, f) in zip(tenute, tenute[1:]):
+            testo += (" " if j == j_prec + 1 else " … ") + f
+        compressi.append(Document(page_content=testo, metadata={**doc.metadata, "compresso": True}))
+    return compressi
+
+
+def post_elabora(query: str, risultati: list[tuple[Document, float]]) -> list[Document]:
+    """
+    Re-ranking, unione dei chunk contigui e compressione. Per ogni query registra (metriche e span esportati)
+    i token dei documenti scelti dal re-ranking, quelli del contesto finale e quindi i token risparmiati.
+    """
+    with span("reranking", candidati=len(risultati)):
+        documenti = rerank(query, risultati)
+    with span("assemblaggio_contesto", chunk=len(documenti)) as s:
+        assemblati = assembla_contesto(documenti)
+        s["span"] = len(assemblati)
+    with span("compressione_contesto") as s:
+        compressi = comprimi(query, assemblati)
+        token_documenti = sum(conta_token(d.page_content) for d in documenti)
+        token_contesto = sum(conta_token(d.page_content) for d in compressi)
+        s.update(token_documenti=token_documenti, token_contesto=token_contesto,
+                 token_risparmiati=token_documenti - token_contesto)
+
+    RAG_CONTEXT_TOKENS.labels(fase="documenti").observe(token_documenti)
+    RAG_CONTEXT_TOKENS.labels(fase="contesto").observe(token_contesto)
+    RAG_CONTEXT_TOKENS_SAVED.inc(token_documenti - token_contesto)
+    return compressi
@@ -1,25 +1,41 @@
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder, PromptTemplate
 from langchain.schema.output_parser import StrOutputParser
 from langchain.chains import create_history_aware_retriever, create_retrieval_chain
-from langchain.schema.runnable import RunnableLambda
-from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain.schema.runnable import RunnableLambda, RunnablePassthrough
+from langchain_core.prompts import format_document
+from ..utils.metrics import span, osserva_token_rag
+from ..utils.tokens import conta_token
+from ..config import RAG_CANDIDATI
+from .post_retrieval import post_elabora
+from .cache_ricerca import cerca_mmr
 
 def build_rag_chain(llm, vectorstore):
     """
     Costruisce la catena RAG con un vectorstore come retriever.
+    Ogni fase (riformulazione, embedding query, ricerca FAISS, re-ranking, compressione, costruzione contesto)
+    è misurata con uno span.
     """
     #PROMPT per riformulare la domanda usando la cronologia. 
     retriever_prompt = ChatPromptTemplate.from_messages([
         ("system", "Sei un assistente tecnico. Se utile, riformula la domanda usando la cronologia."),
         ("human", "{input}")
     ])
+
+    #RETRIEVER MMR (k=RAG_CANDIDATI) + re-ranking e compressione del contesto entro il budget di token.
+    #Embedding della query e risultati MMR passano dalle cache per versione dell'indice (cache_ricerca.py)
+    def cerca(query: str):
+        return post_elabora(query, cerca_mmr(vectorstore, query, k=RAG_CANDIDATI))
+
+    def riformula(prompt_value):
+        with span("riformulazione_query"):
+            risposta = llm.invoke(prompt_value)
+        osserva_token_rag("retrieval", conta_token(prompt_value.to_string()), risposta=conta_token(risposta))
+        return risposta
     
     #CREO IL RETRIEVER con cronologia conversazionale
     retriever = create_history_aware_retriever(
-        llm=llm,
-         retriever=vectorstore.as_retriever(
-        search_type="mmr",          
-        search_kwargs={"k": 6}),    
+        llm=RunnableLambda(riformula),
+        retriever=RunnableLambda(cerca),
         prompt=retriever_prompt
     )
 
@@ -40,13 +56,22 @@ def build_rag_chain(llm, vectorstore):
         template="[Fonte: {source}]\n{page_content}"
     )
 
-    # Catena di combinazione documenti
-    combine_docs_chain = create_stuff_documents_chain(
-        llm=llm,
-        prompt=final_prompt,
-        document_variable_name="context",
-        document_separator="\n---\n",
-        document_prompt=document_prompt   
+    # Catena di combinazione documenti (equivalente a create_stuff_documents_chain, con la costruzione del contesto misurata)
+    def costruisci_contesto(inputs):
+        with span("costruzione_contesto", documenti=len(inputs["context"])):
+            return "\n---\n".join(format_document(doc, document_prompt) for doc in inputs["context"])
+
+    # Token stimati di prompt e risposta (metriche per strategia, confrontabili con il contesto completo)
+    def genera(prompt_value):
+        risposta = llm.invoke(prompt_value)
+        osserva_token_rag("retrieval", conta_token(prompt_value.to_string()), risposta=conta_token(risposta))
+        return risposta
+
+    combine_docs_chain = (
+        RunnablePassthrough.assign(context=RunnableLambda(costruisci_contesto))
+        | final_prompt
+        | RunnableLambda(genera)
+        | StrOutputParser()
     )
 
     base_rag_chain = create_retrieval_chain(
@@ -56,5 +81,3 @@ def build_rag_chain(llm, vectorstore):
 
     return base_rag_chain
 
-
-
@@ -1,10 +1,22 @@
 
 
-import os
+import os, pickle, shutil, threading, time
+from pathlib import Path
 import humanize
+import numpy as np
+import faiss
 from langchain_community.vectorstores import FAISS
 from langchain_core.embeddings import Embeddings
-import google.generativeai as genai
+from ..loader.llm_loader import configura_gemini, get_genai
+from ..loader.gemini_scheduler import get_scheduler, PRIORITA_INTERATTIVA, PRIORITA_BACKGROUND
+from ..utils.metrics import span
+from .embeddings import get_embeddings
+from .docstore import DocstoreSQLite, FILE_DOCSTORE
+from ..config import (
+    FAISS_SOGLIA_VETTORI, FAISS_LATENZA_TARGET_MS, FAISS_INDICE_GRANDE,
+    FAISS_HNSW_M, FAISS_HNSW_EF_SEARCH, FAISS_IVF_NPROBE,
+    FAISS_QUANTIZZAZIONE, FAISS_PQ_M, FAISS_RERANK_ESATTO, FAISS_RERANK_FATTORE,
+)
 
 
 
@@ -17,138 +29,372 @@ class GoogleGenerativeEmbeddings(Embeddings):
         self.api_key = api_key or os.getenv("GEMINI_API_KEY")
         if not self.api_key:
             raise ValueError("GEMINI_API_KEY non impostata.")
-        genai.configure(api_key=self.api_key)
+        configura_gemini(self.api_key)
 
     def embed_documents(self, texts):
         """Restituisce gli embedding di una lista di testi"""
         embeddings = []
-        for text in texts:
-            response = genai.embed_content(model=self.model, content=text)
-            embeddings.append(response["embedding"])
+        with span("embedding_documenti", tipo="ingestion", testi=len(texts)):
+            for text in texts:
+                response = get_scheduler().esegui(
+                    self.model, lambda: get_genai().embed_content(model=self.model, content=text), priorita=PRIORITA_BACKGROUND)
+                embeddings.append(response["embedding"])
         return embeddings
 
     def embed_query(self, text):
         """Restituisce l'embedding di una singola query"""
-        response = genai.embed_content(model=self.model, content=text)
+        response = get_scheduler().esegui(
+            self.model, lambda: get_genai().embed_content(model=self.model, content=text), priorita=PRIORITA_INTERATTIVA)
         return response["embedding"]
 
-def get_vectorstore_multidoc(docs=None, vectors_path=None, logger=None, vectorstore_esistente=None):
+
+## === SCELTA AUTOMATICA DEL TIPO DI INDICE (Flat → HNSW/IVF) ===
+
+def tipo_indice(index) -> str:
+    """Tipo di un indice FAISS: "hnsw", "ivf", "flat" oppure il tipo di compressione ("fp16", "sq8", "pq")."""
+    if isinstance(index, IndiceQuantizzato):
+        return index.tipo
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def parametri_ricerca(index, selettore):
     """
-    Crea o aggiorna un vectorstore FAISS.
-    Se vectorstore_esistente è passato, aggiunge i nuovi documenti invece di ricrearlo da zero.
+    SearchParameters con filtro sugli id (faiss.IDSelector) che mantengono i parametri di ricerca
+    dell'indice (efSearch per HNSW, nprobe per IVF): i default di SearchParameters* li sovrascriverebbero.
+    """
+    if isinstance(index, IndiceQuantizzato):
+        index = index.base
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selettore, efSearch=index.hnsw.efSearch)
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selettore, nprobe=index.nprobe)
+    if isinstance(index, faiss.IndexPQ):
+        return faiss.SearchParametersPQ(sel=selettore)
+    return faiss.SearchParameters(sel=selettore)
+
+
+def costruisci_indice(vettori: np.ndarray, tipo: str, metrica=faiss.METRIC_L2):
+    """Crea un indice FAISS del tipo richiesto e vi aggiunge i vettori (stessa metrica dell'indice originale)."""
+    d = vettori.shape[1]
+    if tipo == "hnsw":
+        index = faiss.IndexHNSWFlat(d, FAISS_HNSW_M, metrica)
+        index.hnsw.efSearch = FAISS_HNSW_EF_SEARCH
+    elif tipo == "ivf":
+        nlist = max(1, min(int(4 * np.sqrt(len(vettori))), len(vettori) // 39))   # ~39 vettori di training per lista
+        index = faiss.IndexIVFFlat(faiss.IndexFlat(d, metrica), d, nlist, metrica)
+        index.train(vettori)
+        index.make_direct_map()     # reconstruct() serve alla ricerca MMR
+        index.nprobe = min(FAISS_IVF_NPROBE, nlist)
+    else:
+        index = faiss.IndexFlat(d, metrica)
+    index.add(vettori)
+    return index
+
+
+def misura_latenza_ricerca(index, k: int = 20, prove: int = 5) -> float:
+    """Latenza mediana (ms) di una ricerca k-NN sull'indice, con query prese dall'indice stesso."""
+    n = index.ntotal
+    tempi = []
+    for i in np.linspace(0, n - 1, prove, dtype="int64"):
+        query = index.reconstruct(int(i)).reshape(1, -1)
+        start = time.perf_counter()
+        index.search(query, k)
+        tempi.append((time.perf_counter() - start) * 1000)
+    return float(np.median(tempi))
+
+
+def scegli_tipo_indice(index) -> str:
     """
-    embeddings = GoogleGenerativeEmbeddings()
+    Flat finché i vettori sono sotto FAISS_SOGLIA_VETTORI o la ricerca esatta rispetta FAISS_LATENZA_TARGET_MS;
+    oltre, FAISS_INDICE_GRANDE (HNSW o IVF). Un indice già approssimato non viene cambiato.
+    """
+    attuale = tipo_indice(index)
+    if attuale != "flat" or index.ntotal < FAISS_SOGLIA_VETTORI:
+        return attuale
+    if misura_latenza_ricerca(index) <= FAISS_LATENZA_TARGET_MS:
+        return "flat"
+    return FAISS_INDICE_GRANDE
 
-    index_file_path = os.path.join(vectors_path, "index.faiss")
 
-    # Caso 1: aggiorno un vectorstore già in memoria (più file cumulativi)
-    if vectorstore_esistente is not None and docs:
-        vectorstore_esistente.add_documents(docs)
-        if logger:
-            logger.info("--------")
-            logger.info(f"➕ Aggiunti {len(docs)} documenti/chunk al vectorstore esistente.")
-            logger.info(f"📊 Ora contiene circa {len(vectorstore_esistente.index_to_docstore_id)} documenti / chunk")
-            logger.info("--------")
-        vectorstore_esistente.save_local(vectors_path)
-        return vectorstore_esistente
+_lock_creazione = threading.Lock()
 
-    # Caso 2: carico da disco se già esiste
-    if os.path.exists(vectors_path) and os.path.exists(index_file_path):
-        vectorstore = FAISS.load_local(vectors_path, embeddings, allow_dangerous_deserialization=True)
-        file_size = os.path.getsize(index_file_path)
-        num_docs = len(vectorstore.index_to_docstore_id)
-        if logger:
-            logger.info("--------")
-            logger.info(f"📦 Vectorstore trovato e caricato da: {vectors_path}")
-            logger.info(f"📊 Contiene circa {num_docs} documenti / chunk")
-            logger.info(f"💾 Dimensione file FAISS: {humanize.naturalsize(file_size)}")
-            logger.info("--------")
-        return vectorstore
 
-    # Caso 3: non esiste → lo creo da zero
-    if docs is None:
-        logger.info("--------")
-        raise ValueError("Documenti non forniti per creare un nuovo vectorstore.")
+def _lock(vectorstore) -> threading.RLock:
+    """Lock per vectorstore: serializza aggiunte, salvataggi e swap dell'indice (creato sotto un lock di modulo)."""
+    lock = getattr(vectorstore, "_lock_indice", None)
+    if lock is None:
+        with _lock_creazione:
+            lock = getattr(vectorstore, "_lock_indice", None)
+            if lock is None:
+                lock = vectorstore._lock_indice = threading.RLock()
+    return lock
 
-    vectorstore = FAISS.from_documents(docs, embeddings) 
-    vectorstore.save_local(vectors_path)
 
-    index_file_path = os.path.join(vectors_path, "index.faiss")
-    file_size = os.path.getsize(index_file_path)
-    num_docs = len(vectorstore.index_to_docstore_id)
+def migra_indice(vectorstore, tipo: str, vectors_path=None, logger=None):
+    """
+    Ricostruisce l'indice nel tipo richiesto senza bloccare le ricerche: la costruzione avviene su una copia
+    dei vettori; sotto lock si aggiungono i vettori arrivati nel frattempo, si sostituisce l'indice e si salva.
+    """
+    start = time.perf_counter()
+    with _lock(vectorstore):
+        # Copia dei vettori sotto lock: un add_documents concorrente può riallocare la memoria dell'indice flat
+        vecchio = vectorstore.index
+        n0 = vecchio.ntotal
+        vettori = vecchio.reconstruct_n(0, n0)
+    nuovo = costruisci_indice(vettori, tipo, vecchio.metric_type)
+
+    with _lock(vectorstore):
+        if vectorstore.index.ntotal > n0:
+            nuovo.add(vectorstore.index.reconstruct_n(n0, vectorstore.index.ntotal - n0))
+        vectorstore.index = nuovo
+        if vectors_path:
+            vectorstore.save_local(vectors_path)
 
     if logger:
-        logger.info("--------")
-        logger.info(f"🆕 Vectorstore creato e salvato in: {vectors_path}")
-        logger.info(f"📊 Contiene circa {num_docs} documenti / chunk")
-        logger.info(f"💾 Dimensione file FAISS: {humanize.naturalsize(file_size)}")
-        logger.info("--------")
-    return vectorstore
+        logger.info(f"🔀 Indice FAISS migrato flat → {tipo} ({nuovo.ntotal} vettori, {time.perf_counter() - start:.1f}s)")
+
 
+def valuta_migrazione(vectorstore, vectors_path=None, logger=None) -> threading.Thread | None:
+    """Se serve un indice diverso avvia la migrazione in un thread in background (una sola alla volta)."""
+    with _lock(vectorstore):
+        if getattr(vectorstore, "_migrazione_in_corso", False):
+            return None
+        tipo = scegli_tipo_indice(vectorstore.index)
+        if tipo == tipo_indice(vectorstore.index):
+            return None
+        vectorstore._migrazione_in_corso = True
 
-## === CREAZIONE DATABASE VETTORIALE FAISS (VERSIONE HUGGING FACE) ===
+    def esegui():
+        try:
+            migra_indice(vectorstore, tipo, vectors_path, logger)
+        except Exception as e:
+            if logger:
+                logger.warning(f"⚠️ Migrazione indice FAISS fallita, resta l'indice attuale: {e}")
+        finally:
+            vectorstore._migrazione_in_corso = False
 
-'''
-#import os
-#import humanize
-#from langchain_community.vectorstores import FAISS
-#from langchain_huggingface import HuggingFaceEmbeddings
-#from ..config import EMBEDDING_MODEL_DIR
+    thread = threading.Thread(target=esegui, daemon=True, name="faiss-migrazione")
+    thread.start()
+    return thread
 
 
-#Crea la cartella se non esiste
-os.makedirs(EMBEDDING_MODEL_DIR, exist_ok=True)
+## === DOCSTORE SU SQLITE AL POSTO DI index.pkl ===
 
-# === CREAZIONE DATABASE VETTORIALE FAISS (VERSIONE HUGGING FACE) ===
+def scrivi_indice(index, percorso: Path):
+    """write_index su un file temporaneo rinominato: chi ricarica non legge mai un index.faiss scritto a metà."""
+    temporaneo = percorso.with_name(f"{percorso.name}.{os.getpid()}.tmp")
+    faiss.write_index(index, str(temporaneo))
+    os.replace(temporaneo, percorso)
 
 
-class LocalHuggingFaceEmbeddings:
+class FAISSSQLite(FAISS):
     """
-    Wrapper per Hugging Face Embeddings basato su 'intfloat/multilingual-e5-small'
+    Vectorstore FAISS con DocstoreSQLite: save_local scrive solo index.faiss, perché i chunk sono già
+    nel docstore (salvati a ogni aggiunta). Nessun pickle né allow_dangerous_deserialization al caricamento.
     """
-    def __init__(self, model_name: str = "intfloat/multilingual-e5-small", model_dir: str = EMBEDDING_MODEL_DIR):
-        self.model_name = model_name
-        self.model = HuggingFaceEmbeddings(
-        model_name=self.model_name,
-        model_kwargs={"cache_folder": model_dir}  # forza cartella locale
-        )
 
-    def embed_documents(self, texts):
-        """Restituisce gli embedding di una lista di testi"""
-        return self.model.embed_documents(texts)
+    def save_local(self, folder_path: str, index_name: str = "index") -> None:
+        path = Path(folder_path)
+        path.mkdir(exist_ok=True, parents=True)
+        self.docstore.copia_in(path / FILE_DOCSTORE)
+        scrivi_indice(self.index, path / f"{index_name}.faiss")
+
+
+def converti_docstore(vectors_path: str, logger=None):
+    """Vectorstore salvato con il pickle di LangChain (index.pkl): il docstore viene convertito una volta in SQLite."""
+    path = Path(vectors_path)
+    with open(path / "index.pkl", "rb") as f:
+        docstore, mappa = pickle.load(f)     # file scritto da questa app: unico punto in cui si legge un pickle
+    temporaneo = path / f"{FILE_DOCSTORE}.{os.getpid()}.tmp"
+    DocstoreSQLite.da_documenti(temporaneo, [(mappa[i], docstore.search(mappa[i])) for i in sorted(mappa)]).chiudi()
+    os.replace(temporaneo, path / FILE_DOCSTORE)
+    try:
+        os.remove(path / "index.pkl")
+    except FileNotFoundError:
+        pass                                # convertito nello stesso momento da un altro worker
+    if logger:
+        logger.info(f"🔁 Docstore di {vectors_path} convertito da index.pkl a {FILE_DOCSTORE} ({len(mappa)} chunk)")
 
-    def embed_query(self, text):
-        """Restituisce l'embedding di una singola query"""
-        return self.model.embed_query(text)
-
-def get_vectorstore_multidoc_local(
-    docs=None,
-    vectors_path=None,
-    logger=None,
-    vectorstore_esistente=None
-):
+
+## === VETTORI COMPRESSI (fp16 / sq8 / PQ) CON RE-RANKING ESATTO ===
+
+FILE_VETTORI = "vettori.f32"   # vettori float32 originali, solo append, letti in mmap per il re-ranking
+
+
+def costruisci_quantizzatore(d: int, tipo: str, n_training: int, metrica=faiss.METRIC_L2):
+    """Indice compresso vuoto: scalar quantizer fp16/int8 oppure product quantization."""
+    if tipo == "fp16":
+        return faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_fp16, metrica)
+    if tipo == "sq8":
+        return faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, metrica)
+    if tipo == "pq":
+        m = max(x for x in range(1, min(FAISS_PQ_M, d) + 1) if d % x == 0)
+        nbits = int(min(8, max(1, np.log2(max(2, n_training)))))   # con pochi vettori meno centroidi per sotto-spazio
+        return faiss.IndexPQ(d, m, nbits, metrica)
+    raise ValueError(f"Quantizzazione non supportata: {tipo}")
+
+
+def tipo_quantizzazione(index) -> str | None:
+    """Tipo di compressione di un indice FAISS letto da disco (None se non compresso)."""
+    if isinstance(index, faiss.IndexPQ):
+        return "pq"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "fp16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return None
+
+
+class IndiceQuantizzato:
+    """
+    Indice compresso usato al posto dell'indice FAISS del vectorstore (stessa interfaccia usata da LangChain:
+    search, add, reconstruct, ntotal, d).
+    La ricerca prende `fattore` × k candidati dall'indice compresso e li riordina con le distanze esatte
+    calcolate sui vettori float32 in `vettori.f32`, letti in mmap solo per i candidati (non restano in RAM).
+    Senza il file dei vettori i punteggi sono quelli dell'indice compresso.
+    """
+    def __init__(self, base, tipo: str, percorso_vettori: str | None = None, fattore: int = FAISS_RERANK_FATTORE):
+        self.base = base
+        self.tipo = tipo
+        self.percorso_vettori = percorso_vettori
+        self.fattore = fattore
+        self._vettori = None
+        self._apri_vettori()
+
+    @property
+    def ntotal(self):
+        return self.base.ntotal
+
+    @property
+    def d(self):
+        return self.base.d
+
+    @property
+    def metric_type(self):
+        return self.base.metric_type
+
+    def _apri_vettori(self):
+        if not self.percorso_vettori or not os.path.exists(self.percorso_vettori):
+            self._vettori = None
+            return
+        n = os.path.getsize(self.percorso_vettori) // (4 * self.d)
+        self._vettori = np.memmap(self.percorso_vettori, dtype="float32", mode="r", shape=(n, self.d)) if n else None
+
+    def add(self, x):
+        x = np.ascontiguousarray(x, dtype="float32")
+        if not self.base.is_trained:
+            self.base.train(x)
+        self.base.add(x)
+        if self.percorso_vettori:
+            with open(self.percorso_vettori, "ab") as f:   # append: i vettori esistenti non vengono riscritti
+                f.write(x.tobytes())
+            self._apri_vettori()
+
+    def reconstruct(self, i: int):
+        if self._vettori is not None and i < len(self._vettori):
+            return np.array(self._vettori[i])
+        return self.base.reconstruct(i)
+
+    def search(self, x, k: int, params=None):
+        if self._vettori is None or len(self._vettori) < self.ntotal:
+            return self.base.search(x, k, params=params)
+
+        distanze, ids = self.base.search(x, k * self.fattore, params=params)
+        inner_product = self.metric_type == faiss.METRIC_INNER_PRODUCT
+        out_d = np.full((len(x), k), -np.inf if inner_product else np.inf, dtype="float32")
+        out_i = np.full((len(x), k), -1, dtype="int64")
+        for r, (q, candidati) in enumerate(zip(x, ids)):
+            candidati = candidati[candidati >= 0]
+            if not len(candidati):
+                continue
+            ordinati = np.sort(candidati)            # lettura mmap in ordine di offset
+            v = self._vettori[ordinati]
+            esatte = v @ q if inner_product else ((v - q) ** 2).sum(axis=1)
+            migliori = np.argsort(-esatte if inner_product else esatte)[:k]
+            out_d[r, :len(migliori)] = esatte[migliori]
+            out_i[r, :len(migliori)] = ordinati[migliori]
+        return out_d, out_i
+
+
+class FAISSQuantizzato(FAISSSQLite):
+    """Vectorstore FAISS con IndiceQuantizzato: su disco index.faiss contiene solo i codici compressi."""
+
+    def save_local(self, folder_path: str, index_name: str = "index") -> None:
+        path = Path(folder_path)
+        path.mkdir(exist_ok=True, parents=True)
+        destinazione = path / FILE_VETTORI
+        if self.index.percorso_vettori and Path(self.index.percorso_vettori).resolve() != destinazione.resolve():
+            shutil.copyfile(self.index.percorso_vettori, destinazione)
+        self.docstore.copia_in(path / FILE_DOCSTORE)
+        scrivi_indice(self.index.base, path / f"{index_name}.faiss")
+
+
+def quantizza_vectorstore(vectorstore, tipo: str, vectors_path: str, rerank: bool = FAISS_RERANK_ESATTO):
+    """Converte un vectorstore FAISS float32 in uno compresso; i vettori originali vanno in vettori.f32 se rerank."""
+    vettori = vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal)
+    os.makedirs(vectors_path, exist_ok=True)
+    percorso = os.path.join(vectors_path, FILE_VETTORI)
+    if os.path.exists(percorso):
+        os.remove(percorso)
+    indice = IndiceQuantizzato(
+        costruisci_quantizzatore(vettori.shape[1], tipo, len(vettori), vectorstore.index.metric_type),
+        tipo, percorso if rerank else None)
+    indice.add(vettori)
+    return FAISSQuantizzato(
+        vectorstore.embedding_function, indice, vectorstore.docstore, vectorstore.index_to_docstore_id,
+        normalize_L2=vectorstore._normalize_L2, distance_strategy=vectorstore.distance_strategy)
+
+
+def carica_vectorstore(vectors_path: str, embeddings, logger=None):
+    """
+    Apre index.faiss e il docstore SQLite (solo la mappa posizione → id: i testi restano su disco);
+    un index.faiss compresso viene riaperto come FAISSQuantizzato. I vectorstore con index.pkl vengono convertiti.
+    """
+    path = Path(vectors_path)
+    if not (path / FILE_DOCSTORE).exists() and (path / "index.pkl").exists():
+        converti_docstore(vectors_path, logger)
+    index = faiss.read_index(str(path / "index.faiss"))
+    docstore = DocstoreSQLite(path / FILE_DOCSTORE, righe=index.ntotal)
+    mappa = docstore.mappa_posizioni()
+    tipo = tipo_quantizzazione(index)
+    if tipo is None:
+        return FAISSSQLite(embeddings, index, docstore, mappa)
+    percorso = path / FILE_VETTORI
+    indice = IndiceQuantizzato(index, tipo, str(percorso) if percorso.exists() else None)
+    return FAISSQuantizzato(embeddings, indice, docstore, mappa)
+
+
+def get_vectorstore_multidoc(docs=None, vectors_path=None, logger=None, vectorstore_esistente=None, embeddings=None,
+                             migra: bool = True):
     """
     Crea o aggiorna un vectorstore FAISS.
     Se vectorstore_esistente è passato, aggiunge i nuovi documenti invece di ricrearlo da zero.
+    Se embeddings non è passato usa il backend configurato in EMBEDDING_BACKEND (i benchmark passano un embedder finto).
+    Con migra=False non avvia la migrazione dell'indice (il corpus condiviso la gestisce da sé, sotto il suo file lock).
     """
-    embeddings = LocalHuggingFaceEmbeddings()
+    embeddings = embeddings or get_embeddings()
 
     index_file_path = os.path.join(vectors_path, "index.faiss")
 
-    # Caso 1: aggiorno un vectorstore già in memoria
+    # Caso 1: aggiorno un vectorstore già in memoria (più file cumulativi)
     if vectorstore_esistente is not None and docs:
-        vectorstore_esistente.add_documents(docs)
+        with _lock(vectorstore_esistente):   # niente swap dell'indice durante l'aggiunta
+            vectorstore_esistente.add_documents(docs)
+            vectorstore_esistente.save_local(vectors_path)
         if logger:
             logger.info("--------")
             logger.info(f"➕ Aggiunti {len(docs)} documenti/chunk al vectorstore esistente.")
             logger.info(f"📊 Ora contiene circa {len(vectorstore_esistente.index_to_docstore_id)} documenti / chunk")
             logger.info("--------")
-        vectorstore_esistente.save_local(vectors_path)
+        if migra:
+            valuta_migrazione(vectorstore_esistente, vectors_path, logger)
         return vectorstore_esistente
 
     # Caso 2: carico da disco se già esiste
     if os.path.exists(vectors_path) and os.path.exists(index_file_path):
-        vectorstore = FAISS.load_local(vectors_path, embeddings.model, allow_dangerous_deserialization=True)
+        vectorstore = carica_vectorstore(vectors_path, embeddings, logger)
         file_size = os.path.getsize(index_file_path)
         num_docs = len(vectorstore.index_to_docstore_id)
         if logger:
@@ -156,16 +402,24 @@ def get_vectorstore_multidoc_local(
             logger.info(f"📦 Vectorstore trovato e caricato da: {vectors_path}")
             logger.info(f"📊 Contiene circa {num_docs} documenti / chunk")
             logger.info(f"💾 Dimensione file FAISS: {humanize.naturalsize(file_size)}")
+            logger.info(f"🧭 Tipo indice: {tipo_indice(vectorstore.index)}")
             logger.info("--------")
+        if migra:
+            valuta_migrazione(vectorstore, vectors_path, logger)
         return vectorstore
 
     # Caso 3: non esiste → lo creo da zero
     if docs is None:
+        logger.info("--------")
         raise ValueError("Documenti non forniti per creare un nuovo vectorstore.")
 
-    vectorstore = FAISS.from_documents(docs, embeddings.model)
+    vectorstore = FAISSSQLite.from_documents(
+        docs, embeddings, docstore=DocstoreSQLite(os.path.join(vectors_path, FILE_DOCSTORE), nuovo=True))
+    if FAISS_QUANTIZZAZIONE:
+        vectorstore = quantizza_vectorstore(vectorstore, FAISS_QUANTIZZAZIONE, vectors_path)
     vectorstore.save_local(vectors_path)
 
+    index_file_path = os.path.join(vectors_path, "index.faiss")
     file_size = os.path.getsize(index_file_path)
     num_docs = len(vectorstore.index_to_docstore_id)
 
@@ -174,8 +428,8 @@ def get_vectorstore_multidoc_local(
         logger.info(f"🆕 Vectorstore creato e salvato in: {vectors_path}")
         logger.info(f"📊 Contiene circa {num_docs} documenti / chunk")
         logger.info(f"💾 Dimensione file FAISS: {humanize.naturalsize(file_size)}")
+        logger.info(f"🧭 Tipo indice: {tipo_indice(vectorstore.index)}")
         logger.info("--------")
-
+    if migra:
+        valuta_migrazione(vectorstore, vectors_path, logger)
     return vectorstore
-
-'''
\ No newline at end of file
@@ -0,0 +1,308 @@
+"""
+Pulizia periodica degli artefatti delle sessioni: upload, indici FAISS per sessione, documenti del corpus
+condiviso, cache del parsing, memorie JSON e log, in locale e su S3.
+
+Mark & sweep: le sessioni inattive da più di SESSIONE_TTL_S vengono eliminate dallo store; i riferimenti
+vivi (file, indici, hash dei documenti) sono quelli dei record rimasti, e tutto ciò che nessuna sessione
+usa più viene eliminato, anche se lo stesso upload era condiviso da più sessioni. Se l'occupazione supera
+JANITOR_QUOTA_BYTE si eliminano le sessioni meno recenti finché si rientra nella quota.
+
+Uso manuale (dalla root del progetto):
+    python -m code.storage.janitor --simulazione   # cosa verrebbe eliminato, senza toccare nulla
+    python -m code.storage.janitor
+"""
+import argparse, fcntl, os, sys, time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+import humanize
+from ..config import (
+    DATA_DIR, UPLOAD_DIR, VECTORSTORE_DIR, CORPUS_DIR, MEM_DIR, LOG_DIR, PARSING_CACHE_DIR, S3_SYNC_ENABLED,
+    SESSIONE_TTL_S, LOG_TTL_S, JANITOR_GRAZIA_S, JANITOR_QUOTA_BYTE,
+)
+from ..utils.metrics import span, JANITOR_BYTES_RECLAIMED, JANITOR_SESSIONS_EXPIRED
+from .session_store import get_session_store
+from .s3_utils import list_s3_objects, delete_files_from_s3
+
+PREFISSI_S3 = {"models_e_docs": UPLOAD_DIR, "logs": LOG_DIR}   # prefisso S3 → cartella locale (come nei sync)
+PREFISSO_INDICE = "vectorstore_faiss_"
+SUFFISSO_LOG = "_multiagent.log"
+LOG_DI_SERVIZIO = {"startup", "Inizializzazione", "janitor"}   # setup_logger non di sessione: file aperti per tutta la vita del processo
+
+
+@dataclass
+class Riferimenti:
+    """Artefatti ancora usati da almeno una sessione nello store."""
+    sessioni: set[str] = field(default_factory=set)
+    file: set[str] = field(default_factory=set)       # percorsi assoluti di immagini e documenti
+    indici: set[str] = field(default_factory=set)     # cartelle dei vectorstore per sessione
+    hash: set[str] = field(default_factory=set)       # documenti posseduti (corpus condiviso e cache del parsing)
+
+
+@dataclass
+class ReportPulizia:
+    simulazione: bool = False
+    sessioni_scadute: list[str] = field(default_factory=list)
+    sessioni_quota: list[str] = field(default_factory=list)
+    file_eliminati: int = 0
+    byte_locali: dict[str, int] = field(default_factory=dict)   # categoria → byte liberati
+    oggetti_s3: int = 0
+    byte_s3: int = 0
+    documenti_corpus: int = 0
+    occupazione: int = 0                                      # byte occupati a fine pulizia
+    durata_s: float = 0.0
+
+    @property
+    def byte_recuperati(self) -> int:
+        return sum(self.byte_locali.values())
+
+    def riepilogo(self) -> str:
+        dettaglio = ", ".join(f"{c} {humanize.naturalsize(b)}" for c, b in sorted(self.byte_locali.items())) or "nulla"
+        return (f"{'[simulazione] ' if self.simulazione else ''}"
+                f"{len(self.sessioni_scadute)} sessioni scadute, {len(self.sessioni_quota)} eliminate per quota, "
+                f"{self.file_eliminati} file ({humanize.naturalsize(self.byte_recuperati)}: {dettaglio}), "
+                f"{self.documenti_corpus} documenti tolti dal corpus, "
+                f"{self.oggetti_s3} oggetti S3 ({humanize.naturalsize(self.byte_s3)}); "
+                f"occupazione {humanize.naturalsize(self.occupazione)} in {self.durata_s:.1f}s")
+
+
+def _sotto(path: Path, cartella: Path) -> bool:
+    return path == cartella or cartella in path.parents
+
+
+def _assoluto(path) -> str:
+    return os.path.abspath(str(path))
+
+
+def raccogli_riferimenti(store, escluse: set[str] = frozenset()) -> Riferimenti:
+    rif = Riferimenti()
+    for session_id in store.sessioni():
+        record = store.get(session_id) if session_id not in escluse else None
+        if record is None:
+            continue
+        rif.sessioni.add(session_id)
+        rif.file.update(_assoluto(p) for p in record.get("image_paths", []))
+        for doc in record.get("documenti", []):
+            rif.file.add(_assoluto(doc["file"]))
+            rif.hash.add(doc["hash"])
+        if record.get("vectorstore_path"):
+            rif.indici.add(_assoluto(record["vectorstore_path"]))
+    return rif
+
+
+def categoria_da_eliminare(path: Path, mtime: float, rif: Riferimenti, ora: float, forza_log: bool = False) -> str | None:
+    """
+    Categoria dell'artefatto ("upload", "indici", "cache_parsing", "memorie", "log") se nessuna sessione
+    lo usa più, altrimenti None.
+    """
+    recente = ora - mtime < JANITOR_GRAZIA_S
+    if _sotto(path, Path(CORPUS_DIR)):
+        # Il corpus si compatta per documento (Corpus.compatta); i suoi file spariscono solo quando è vuoto
+        return "indici" if not rif.hash and not os.path.exists(CORPUS_DIR) else None
+    if _sotto(path, Path(VECTORSTORE_DIR)):
+        cartella = Path(VECTORSTORE_DIR) / path.relative_to(VECTORSTORE_DIR).parts[0]
+        if cartella.name.startswith(PREFISSO_INDICE) and _assoluto(cartella) not in rif.indici and not recente:
+            return "indici"
+        return None
+    if _sotto(path, Path(PARSING_CACHE_DIR)):
+        # Voce <hash><ext>.v<versione>.json.z: resta finché una sessione possiede il documento
+        return "cache_parsing" if path.name.split(".")[0] not in rif.hash and not recente else None
+    if _sotto(path, Path(UPLOAD_DIR)):
+        return "upload" if _assoluto(path) not in rif.file and not recente else None
+    if _sotto(path, Path(MEM_DIR)):
+        return "memorie" if path.stem not in rif.sessioni and not recente else None
+    if _sotto(path, Path(LOG_DIR)):
+        session_id = path.name[:-len(SUFFISSO_LOG)] if path.name.endswith(SUFFISSO_LOG) else None
+        if session_id is None or session_id in LOG_DI_SERVIZIO or session_id in rif.sessioni:
+            return None                 # solo i log di sessione: quelli di servizio hanno un FileHandler sempre aperto
+        # Log di sessioni non più attive: tenuti LOG_TTL_S per la diagnostica, salvo quota superata
+        return "log" if (forza_log and not recente) or ora - mtime > LOG_TTL_S else None
+    return None
+
+
+def _file_locali():
+    for cartella in (UPLOAD_DIR, PARSING_CACHE_DIR, MEM_DIR, LOG_DIR):
+        for root, _, files in os.walk(cartella):
+            for nome in files:
+                yield Path(root) / nome
+
+
+def occupazione() -> int:
+    """Byte occupati da upload, vectorstore, cache del parsing, memorie e log."""
+    totale = 0
+    for path in _file_locali():
+        try:
+            totale += path.stat().st_size
+        except FileNotFoundError:
+            pass
+    return totale
+
+
+def _rimuovi_cartelle_vuote():
+    for cartella in Path(VECTORSTORE_DIR).glob(PREFISSO_INDICE + "*"):
+        if cartella.is_dir() and not any(cartella.rglob("*")):
+            cartella.rmdir()
+    for cartella in Path(UPLOAD_DIR).iterdir():     # UPLOAD_DIR/<sha256>/ degli upload (salva_upload)
+        if cartella.is_dir() and len(cartella.name) == 64 and not any(cartella.iterdir()):
+            try:
+                cartella.rmdir()
+            except OSError:
+                pass                    # un upload ci ha appena scritto
+
+
+def _spazza(rif: Riferimenti, ora: float, report: ReportPulizia, forza_log: bool, logger):
+    """Elimina i file locali e gli oggetti S3 non più referenziati (in simulazione si limita a contarli)."""
+    with span("pulizia_file", tipo="storage"):
+        for path in _file_locali():
+            if path.name == ".lock":
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            categoria = categoria_da_eliminare(path, stat.st_mtime, rif, ora, forza_log)
+            if categoria is None:
+                continue
+            if not report.simulazione:
+                try:
+                    path.unlink()
+                except OSError as e:
+                    if logger: logger.warning(f"⚠️ Impossibile eliminare {path}: {e}")
+                    continue
+                JANITOR_BYTES_RECLAIMED.labels(categoria=categoria, destinazione="locale").inc(stat.st_size)
+            report.file_eliminati += 1
+            report.byte_locali[categoria] = report.byte_locali.get(categoria, 0) + stat.st_size
+        if not report.simulazione:
+            _rimuovi_cartelle_vuote()
+
+    if not S3_SYNC_ENABLED:
+        return
+    with span("pulizia_s3", tipo="storage"):
+        for prefisso, cartella in PREFISSI_S3.items():
+            chiavi = []
+            for obj in list_s3_objects(prefisso + "/"):
+                path = Path(cartella) / obj["Key"][len(prefisso) + 1:]
+                if _sotto(path, Path(CORPUS_DIR)):
+                    categoria = "indici"        # il corpus non passa da S3: copie caricate da versioni precedenti
+                else:
+                    categoria = categoria_da_eliminare(path, obj["LastModified"].timestamp(), rif, ora, forza_log)
+                if categoria is None:
+                    continue
+                chiavi.append(obj["Key"])
+                report.byte_s3 += obj["Size"]
+                if not report.simulazione:
+                    JANITOR_BYTES_RECLAIMED.labels(categoria=categoria, destinazione="s3").inc(obj["Size"])
+            report.oggetti_s3 += len(chiavi) if report.simulazione else delete_files_from_s3(chiavi, logger)
+
+
+def _compatta_corpus(rif: Riferimenti, report: ReportPulizia, logger):
+    if not os.path.exists(CORPUS_DIR):
+        return
+    from ..rag.corpus import get_corpus
+    corpus = get_corpus(logger)
+    if report.simulazione:
+        corpus.aggiorna_da_disco(logger)
+        adottati = corpus.adottati_di_recente(JANITOR_GRAZIA_S)
+        report.documenti_corpus += sum(1 for h in corpus.ids_per_hash if h not in rif.hash and h not in adottati)
+        return
+    prima = sum(p.stat().st_size for p in Path(CORPUS_DIR).glob("*") if p.is_file())
+    with span("pulizia_corpus", tipo="storage"):
+        rimossi = corpus.compatta(rif.hash, logger, grazia=JANITOR_GRAZIA_S)
+    if not rimossi:
+        return
+    dopo = sum(p.stat().st_size for p in Path(CORPUS_DIR).glob("*") if p.is_file()) if os.path.exists(CORPUS_DIR) else 0
+    report.documenti_corpus += len(rimossi)
+    report.byte_locali["corpus"] = report.byte_locali.get("corpus", 0) + max(0, prima - dopo)
+    JANITOR_BYTES_RECLAIMED.labels(categoria="corpus", destinazione="locale").inc(max(0, prima - dopo))
+
+
+@contextmanager
+def _un_solo_janitor():
+    """Lock non bloccante sull'host: con più worker uvicorn la pulizia gira in uno solo alla volta."""
+    with open(os.path.join(DATA_DIR, ".janitor.lock"), "w") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _elimina_sessioni(store, candidate: list[str], prima_di: float, motivo: str, report: ReportPulizia, dimentica) -> list[str]:
+    eliminate = []
+    for session_id in candidate:
+        if report.simulazione or store.elimina_inattiva(session_id, prima_di):
+            eliminate.append(session_id)
+            if not report.simulazione:
+                JANITOR_SESSIONS_EXPIRED.labels(motivo=motivo).inc()
+                if dimentica:
+                    dimentica(session_id)
+    return eliminate
+
+
+def esegui_pulizia(store=None, logger=None, simulazione: bool = False, dimentica=None,
+                   ttl_s: int = SESSIONE_TTL_S, quota_byte: int | None = JANITOR_QUOTA_BYTE) -> ReportPulizia | None:
+    """
+    Un giro di pulizia. `dimentica(session_id)` viene chiamata per ogni sessione eliminata (cache del worker).
+    Ritorna il report, oppure None se un altro processo sta già pulendo.
+    """
+    store = store or get_session_store()
+    report = ReportPulizia(simulazione=simulazione)
+    inizio = ora = time.time()
+
+    with _un_solo_janitor() as attivo:
+        if not attivo:
+            return None
+
+        # 1) Sessioni scadute per inattività (una sessione aggiornata nel frattempo non viene toccata)
+        record = {s: store.get(s) for s in store.sessioni()}
+        scadute = [s for s, r in record.items() if r and ora - r.get("aggiornata", 0) > ttl_s]
+        report.sessioni_scadute = _elimina_sessioni(store, scadute, ora - ttl_s, "ttl", report, dimentica)
+
+        # 2) Sweep degli artefatti non più referenziati
+        escluse = set(report.sessioni_scadute) if simulazione else set()
+        rif = raccogli_riferimenti(store, escluse)
+        _compatta_corpus(rif, report, logger)
+        _spazza(rif, ora, report, forza_log=False, logger=logger)
+
+        # 3) Quota: sessioni meno recenti per prime, a blocchi del 10%, finché l'occupazione rientra
+        report.occupazione = occupazione()
+        if quota_byte and report.occupazione > quota_byte and not simulazione:
+            ordinate = sorted((s for s in rif.sessioni), key=lambda s: record.get(s, {}).get("aggiornata", 0))
+            blocco = max(1, len(ordinate) // 10)
+            while report.occupazione > quota_byte and ordinate:
+                candidate, ordinate = ordinate[:blocco], ordinate[blocco:]
+                report.sessioni_quota += _elimina_sessioni(store, candidate, inizio, "quota", report, dimentica)
+                rif = raccogli_riferimenti(store)
+                _compatta_corpus(rif, report, logger)
+                _spazza(rif, ora, report, forza_log=True, logger=logger)
+                report.occupazione = occupazione()
+            if report.occupazione > quota_byte and logger:
+                logger.warning(f"⚠️ Quota disco superata anche dopo la pulizia: "
+                               f"{humanize.naturalsize(report.occupazione)} > {humanize.naturalsize(quota_byte)}")
+
+    report.durata_s = time.time() - inizio
+    if logger:
+        logger.info(f"🧹 Pulizia completata: {report.riepilogo()}")
+    return report
+
+
+def main(argv=None):
+    from ..logger_utils import setup_logger
+    parser = argparse.ArgumentParser(description="Pulizia di sessioni scadute, upload, indici, memorie e log")
+    parser.add_argument("--simulazione", action="store_true", help="Mostra cosa verrebbe eliminato senza eliminare nulla")
+    parser.add_argument("--ttl", type=int, default=SESSIONE_TTL_S, help="Secondi di inattività oltre cui una sessione scade")
+    args = parser.parse_args(argv)
+
+    report = esegui_pulizia(logger=setup_logger(session="janitor"), simulazione=args.simulazione, ttl_s=args.ttl)
+    if report is None:
+        print("Un'altra pulizia è in corso.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
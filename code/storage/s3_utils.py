@@ -1,25 +1,36 @@
 #Gestisce la connessione a S3 e upload/download di singoli file.
 
-import os
-import boto3
+import os, threading
 from botocore.exceptions import NoCredentialsError
-from ..config import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, S3_BUCKET_NAME
+from ..config import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, S3_BUCKET_NAME, S3_SYNC_ENABLED
 from pathlib import Path
 from botocore.exceptions import NoCredentialsError, ClientError
+from ..utils.metrics import span
+
+# --- Client S3, creato al primo uso (import di boto3 e creazione del client costano ~0.3 s all'avvio) ---
+_s3_client = None
+_s3_lock = threading.Lock()
+
+
+def get_s3_client():
+    global _s3_client
+    with _s3_lock:
+        if _s3_client is None:
+            import boto3
+            _s3_client = boto3.client(
+                "s3",
+                region_name=AWS_REGION,
+                aws_access_key_id=AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+            )
+        return _s3_client
 
-# --- Inizializza il client S3 ---
-s3_client = boto3.client(
-    "s3",
-    region_name=AWS_REGION,
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-)
 
 def upload_file_to_s3(local_path: Path | str, s3_key: str, logger=None):
     """Carica un singolo file locale su S3"""
     local_path = Path(local_path)
     try:
-        s3_client.upload_file(str(local_path), S3_BUCKET_NAME, s3_key)
+        get_s3_client().upload_file(str(local_path), S3_BUCKET_NAME, s3_key)
         if logger:  # log singolo solo se richiesto esplicitamente
             logger.info("✅ Upload %s → s3://%s/%s", local_path, S3_BUCKET_NAME, s3_key)
 
@@ -28,19 +39,66 @@ def upload_file_to_s3(local_path: Path | str, s3_key: str, logger=None):
             logger.warning("⚠️ Upload interrotto dall'utente: %s", local_path)
         raise  # rilancia se vuoi che l'interruzione fermi anche il loop superiore
 
-def sync_folder_to_s3(local_folder: Path | str, s3_prefix: str, logger):
-    """Sincronizza tutti i file locali di una cartella verso S3 (upload).
+def download_file_from_s3(s3_key: str, local_path: Path | str, logger=None) -> bool:
+    """Scarica un singolo file da S3 (es. immagine caricata su un'altra replica). Ritorna True se scaricato."""
+    if not S3_SYNC_ENABLED:
+        return False
+    local_path = Path(local_path)
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        get_s3_client().download_file(S3_BUCKET_NAME, s3_key, str(local_path))
+        return True
+    except (ClientError, NoCredentialsError):
+        if logger:
+            logger.warning("⚠️ File %s non disponibile su S3", s3_key)
+        return False
+
+def list_s3_objects(s3_prefix: str) -> list[dict]:
+    """Oggetti S3 sotto un prefisso: [{"Key", "Size", "LastModified"}] (lista vuota se il sync è disabilitato)."""
+    if not S3_SYNC_ENABLED:
+        return []
+    oggetti = []
+    paginator = get_s3_client().get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=S3_BUCKET_NAME, Prefix=s3_prefix):
+        oggetti.extend(page.get("Contents", []))
+    return oggetti
+
+def delete_files_from_s3(s3_keys: list[str], logger=None) -> int:
+    """Elimina oggetti S3 a blocchi di 1000 (limite di DeleteObjects). Ritorna il numero di oggetti eliminati."""
+    if not S3_SYNC_ENABLED or not s3_keys:
+        return 0
+    eliminati = 0
+    for i in range(0, len(s3_keys), 1000):
+        blocco = s3_keys[i:i + 1000]
+        try:
+            risposta = get_s3_client().delete_objects(
+                Bucket=S3_BUCKET_NAME, Delete={"Objects": [{"Key": k} for k in blocco], "Quiet": True})
+            eliminati += len(blocco) - len(risposta.get("Errors", []))
+        except (ClientError, NoCredentialsError):
+            if logger:
+                logger.warning("⚠️ Eliminazione di %d oggetti da S3 non riuscita", len(blocco))
+    return eliminati
+
+@span("sync_s3_upload", tipo="storage")
+def sync_folder_to_s3(local_folder: Path | str, s3_prefix: str, logger, escludi: tuple = ()):
+    """Sincronizza tutti i file locali di una cartella verso S3 (upload), tranne le sottocartelle in `escludi`.
        Silenzia i dettagli tecnici degli errori di credenziali.
     """
+    if not S3_SYNC_ENABLED:
+        logger.debug("Sync S3 disabilitato (credenziali AWS non impostate).")
+        return
+
     local_folder = Path(local_folder)
     if not local_folder.exists():
         logger.warning("⚠️ Cartella locale %s non trovata, skip sync", local_folder)
         return
 
     count_uploaded = 0
+    esclusi = {Path(p).resolve() for p in escludi}
 
     try:
-        for root, _, files in os.walk(local_folder):
+        for root, dirs, files in os.walk(local_folder):
+            dirs[:] = [d for d in dirs if (Path(root) / d).resolve() not in esclusi]
             for fname in files:
                 local_path = Path(root) / fname
                 rel = local_path.relative_to(local_folder).as_posix()
@@ -69,17 +127,23 @@ def sync_folder_to_s3(local_folder: Path | str, s3_prefix: str, logger):
 
 
 
-def sync_s3_to_folder(s3_prefix: str, local_folder: Path | str, logger):
-    """Scarica tutti i file da S3 verso la cartella locale (download).
+@span("sync_s3_download", tipo="storage")
+def sync_s3_to_folder(s3_prefix: str, local_folder: Path | str, logger, escludi: tuple = ()):
+    """Scarica tutti i file da S3 verso la cartella locale (download), tranne quelli delle sottocartelle in `escludi`.
        Silenzia i dettagli tecnici degli errori di credenziali.
     """
     local_folder = Path(local_folder)
+    esclusi = [Path(p).resolve() for p in escludi]
     local_folder.mkdir(parents=True, exist_ok=True)
 
+    if not S3_SYNC_ENABLED:
+        logger.debug("Sync S3 disabilitato (credenziali AWS non impostate).")
+        return
+
     count_downloaded = 0
 
     try:
-        paginator = s3_client.get_paginator("list_objects_v2")
+        paginator = get_s3_client().get_paginator("list_objects_v2")
 
         for page in paginator.paginate(Bucket=S3_BUCKET_NAME, Prefix=s3_prefix):
             for obj in page.get("Contents", []):
@@ -88,9 +152,11 @@ def sync_s3_to_folder(s3_prefix: str, local_folder: Path | str, logger):
                 if not rel:
                     continue
                 target = local_folder / rel
+                if any(target.resolve().is_relative_to(e) for e in esclusi):
+                    continue
                 target.parent.mkdir(parents=True, exist_ok=True)
                 try:
-                    s3_client.download_file(S3_BUCKET_NAME, key, str(target))
+                    get_s3_client().download_file(S3_BUCKET_NAME, key, str(target))
                     count_downloaded += 1
                 except ClientError:
                     logger.error("❌ Errore generico durante download da S3.")
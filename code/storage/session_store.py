@@ -0,0 +1,202 @@
+#Stato delle sessioni condiviso tra worker e repliche del backend.
+#Ogni sessione è un record JSON: immagini, documenti, percorso del vectorstore, versione e cronologia chat.
+#Le cache in RAM di app.py restano solo come cache locali del worker, ricostruibili dal record.
+
+import json, os, sqlite3, threading, time
+from abc import ABC, abstractmethod
+from ..config import SESSION_STORE_BACKEND, SESSION_STORE_PATH, SESSION_STORE_URL
+
+
+def nuovo_record() -> dict:
+    """Record vuoto di una sessione appena creata."""
+    ora = time.time()
+    return {
+        "image_paths": [],
+        "documenti": [],            # [{"file": path, "hash": sha256}]: con il corpus condiviso è la lista dei documenti posseduti
+        "hash": None,               # hash dell'ultimo documento indicizzato
+        "vectorstore_path": None,   # solo per le sessioni con un indice proprio (VECTORSTORE_MODALITA="sessione")
+        "versione": 0,              # incrementata a ogni modifica di immagini/vectorstore
+        "messaggi": [],             # [["human" | "ai", testo], ...]
+        "versione_memoria": 0,      # incrementata a ogni salvataggio della cronologia (e al reset)
+        "job": {},                  # job_id → stato dell'ingestion asincrona dei documenti (rag/ingestione.py)
+        "creata": ora,
+        "aggiornata": ora,
+    }
+
+
+class SessionStore(ABC):
+    """Interfaccia comune dei backend di stato sessione."""
+
+    @abstractmethod
+    def get(self, session_id: str) -> dict | None:
+        """Record della sessione, None se non esiste."""
+
+    @abstractmethod
+    def put(self, session_id: str, record: dict):
+        """Salva il record della sessione (sovrascrive)."""
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Elimina la sessione."""
+
+    @abstractmethod
+    def sessioni(self) -> list[str]:
+        """Id di tutte le sessioni nello store."""
+
+    @abstractmethod
+    def elimina_inattiva(self, session_id: str, prima_di: float) -> bool:
+        """Elimina la sessione solo se non è stata aggiornata dopo `prima_di` (atomico). Ritorna True se eliminata."""
+
+    @abstractmethod
+    def aggiorna(self, session_id: str, modifica) -> dict:
+        """
+        Read-modify-write atomico: `modifica(record)` modifica il record in place.
+        Se la sessione non esiste parte da nuovo_record(). Ritorna il record salvato.
+        """
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Backend locale su file SQLite (WAL): condiviso da tutti i worker uvicorn dello stesso host
+    o da repliche che montano lo stesso volume.
+    """
+    def __init__(self, path=SESSION_STORE_PATH):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._locale = threading.local()
+        with self._conn() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessioni ("
+                "session_id TEXT PRIMARY KEY, dati TEXT NOT NULL, aggiornata REAL NOT NULL)"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        # Una connessione per thread (FastAPI esegue gli endpoint sync nel threadpool)
+        conn = getattr(self._locale, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._locale.conn = conn
+        return conn
+
+    def get(self, session_id):
+        riga = self._conn().execute("SELECT dati FROM sessioni WHERE session_id = ?", (session_id,)).fetchone()
+        return json.loads(riga[0]) if riga else None
+
+    def put(self, session_id, record):
+        record["aggiornata"] = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO sessioni (session_id, dati, aggiornata) VALUES (?, ?, ?)",
+            (session_id, json.dumps(record, ensure_ascii=False), record["aggiornata"]),
+        )
+
+    def delete(self, session_id):
+        self._conn().execute("DELETE FROM sessioni WHERE session_id = ?", (session_id,))
+
+    def sessioni(self):
+        return [r[0] for r in self._conn().execute("SELECT session_id FROM sessioni")]
+
+    def elimina_inattiva(self, session_id, prima_di):
+        cursore = self._conn().execute(
+            "DELETE FROM sessioni WHERE session_id = ? AND aggiornata < ?", (session_id, prima_di))
+        return cursore.rowcount > 0
+
+    def aggiorna(self, session_id, modifica):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")   # lock in scrittura: nessun altro worker può interporsi
+        try:
+            riga = conn.execute("SELECT dati FROM sessioni WHERE session_id = ?", (session_id,)).fetchone()
+            record = json.loads(riga[0]) if riga else nuovo_record()
+            modifica(record)
+            record["aggiornata"] = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO sessioni (session_id, dati, aggiornata) VALUES (?, ?, ?)",
+                (session_id, json.dumps(record, ensure_ascii=False), record["aggiornata"]),
+            )
+            conn.execute("COMMIT")
+            return record
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Backend di rete (Redis): condiviso da repliche su host diversi.
+    Per test locali si può usare un redis-server locale oppure fakeredis (SESSION_STORE_URL="fakeredis://").
+    """
+    PREFISSO = "sessione:"
+
+    def __init__(self, url=SESSION_STORE_URL):
+        if url.startswith("fakeredis://"):
+            import fakeredis
+            self.redis = fakeredis.FakeRedis()
+        else:
+            import redis
+            self.redis = redis.Redis.from_url(url)
+
+    def get(self, session_id):
+        dati = self.redis.get(self.PREFISSO + session_id)
+        return json.loads(dati) if dati else None
+
+    def put(self, session_id, record):
+        record["aggiornata"] = time.time()
+        self.redis.set(self.PREFISSO + session_id, json.dumps(record, ensure_ascii=False))
+
+    def delete(self, session_id):
+        self.redis.delete(self.PREFISSO + session_id)
+
+    def sessioni(self):
+        return [k.decode()[len(self.PREFISSO):] for k in self.redis.scan_iter(match=self.PREFISSO + "*")]
+
+    def elimina_inattiva(self, session_id, prima_di):
+        from redis.exceptions import WatchError
+        chiave = self.PREFISSO + session_id
+        while True:
+            with self.redis.pipeline() as pipe:
+                try:
+                    pipe.watch(chiave)
+                    dati = pipe.get(chiave)
+                    if not dati or json.loads(dati).get("aggiornata", 0) >= prima_di:
+                        return False
+                    pipe.multi()
+                    pipe.delete(chiave)
+                    pipe.execute()
+                    return True
+                except WatchError:
+                    continue
+
+    def aggiorna(self, session_id, modifica):
+        from redis.exceptions import WatchError
+        chiave = self.PREFISSO + session_id
+        while True:
+            with self.redis.pipeline() as pipe:
+                try:
+                    pipe.watch(chiave)   # transazione ottimistica: si riprova se un altro worker scrive nel frattempo
+                    dati = pipe.get(chiave)
+                    record = json.loads(dati) if dati else nuovo_record()
+                    modifica(record)
+                    record["aggiornata"] = time.time()
+                    pipe.multi()
+                    pipe.set(chiave, json.dumps(record, ensure_ascii=False))
+                    pipe.execute()
+                    return record
+                except WatchError:
+                    continue
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    """Store configurato con SESSION_STORE_BACKEND ("sqlite" o "redis"), creato al primo uso."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if SESSION_STORE_BACKEND == "redis":
+                _store = RedisSessionStore(SESSION_STORE_URL)
+            else:
+                _store = SQLiteSessionStore(SESSION_STORE_PATH)
+        return _store
@@ -0,0 +1,137 @@
+#Metriche Prometheus e tracing per fase della pipeline (routing, RAG, generazione, memoria, ingestion, S3).
+
+import json, os, threading, time, uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import Counter, Histogram, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+from ..config import TRACE_EXPORT_FILE
+
+# Bucket pensati per il budget di 30 s della /chat
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    "multiagent_stage_seconds", "Durata di ogni fase della pipeline", ["fase", "tipo"], buckets=BUCKETS)
+STAGE_ERRORS = Counter(
+    "multiagent_stage_errors_total", "Eccezioni sollevate per fase", ["fase", "tipo"])
+CHAT_SECONDS = Histogram(
+    "multiagent_chat_seconds", "Durata totale delle richieste /chat", ["tipo"], buckets=BUCKETS)
+CHAT_REQUESTS = Counter(
+    "multiagent_chat_requests_total", "Richieste /chat per agente ed esito", ["tipo", "esito"])
+ROUTER_DECISIONS = Counter(
+    "multiagent_router_decisions_total", "Decisioni del router (pattern o LLM)", ["metodo", "tipo"])
+
+RAG_CONTEXT_TOKENS = Histogram(
+    "multiagent_rag_context_tokens", "Token stimati dei documenti recuperati e del contesto finale", ["fase"],
+    buckets=(100, 250, 500, 750, 1000, 1500, 2000, 4000, 8000))
+RAG_CONTEXT_TOKENS_SAVED = Counter(
+    "multiagent_rag_context_tokens_saved_total", "Token di contesto risparmiati (overlap tra chunk e compressione estrattiva)")
+
+RAG_CACHE = Counter(
+    "multiagent_rag_cache_total", "Accessi alle cache RAG (embedding_query, risultati, parsing)", ["cache", "esito"])
+
+RAG_STRATEGY_SECONDS = Histogram(
+    "multiagent_rag_strategy_seconds", "Durata delle risposte sui documenti per strategia (retrieval, contesto_completo)",
+    ["strategia"], buckets=BUCKETS)
+RAG_STRATEGY_TOKENS = Counter(
+    "multiagent_rag_strategy_tokens_total",
+    "Token per strategia RAG: prompt (fatturati per intero), cache (contesto servito dalla cache del provider), risposta",
+    ["strategia", "tipo"])
+
+GEMINI_QUEUE_WAIT = Histogram(
+    "multiagent_gemini_queue_wait_seconds", "Attesa nello scheduler Gemini prima dell'invio", ["modello", "priorita"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+GEMINI_RETRIES = Counter(
+    "multiagent_gemini_retries_total", "Retry dello scheduler Gemini su errori transitori", ["modello", "errore"])
+GEMINI_HEDGES = Counter(
+    "multiagent_gemini_hedges_total", "Richieste hedged lanciate e vinte dalla copia", ["modello", "esito"])
+
+TECNICO_SPECULATION = Counter(
+    "multiagent_tecnico_speculation_total",
+    "Esito delle risposte LLM speculative dell'agente tecnico (utile, sprecata, annullata, saltata, fallita)", ["esito"])
+TECNICO_SPECULATION_SECONDS_SAVED = Counter(
+    "multiagent_tecnico_speculation_seconds_saved_total", "Latenza risparmiata dalle risposte speculative usate")
+
+JANITOR_BYTES_RECLAIMED = Counter(
+    "multiagent_janitor_bytes_reclaimed_total", "Byte liberati dalla pulizia periodica", ["categoria", "destinazione"])
+JANITOR_SESSIONS_EXPIRED = Counter(
+    "multiagent_janitor_sessions_expired_total", "Sessioni eliminate dalla pulizia periodica", ["motivo"])
+
+# Agente corrente e traccia corrente: propagati nei thread da asyncio.to_thread e dalle Runnable LangChain
+_tipo_corrente = ContextVar("tipo_agente", default="n/d")
+_traccia_corrente = ContextVar("traccia", default=None)
+_lock_export = threading.Lock()
+
+
+def imposta_tipo(tipo: str):
+    """Imposta l'agente corrente: le fasi successive nello stesso contesto avranno label tipo=<tipo>."""
+    _tipo_corrente.set(tipo)
+
+
+def nuova_traccia(session_id: str | None = None) -> str:
+    """Apre una nuova traccia (una per richiesta) per raggruppare gli span esportati."""
+    trace_id = uuid.uuid4().hex
+    _traccia_corrente.set({"trace_id": trace_id, "session_id": session_id})
+    return trace_id
+
+
+def _esporta_span(record: dict):
+    if not TRACE_EXPORT_FILE:
+        return
+    with _lock_export:
+        with open(TRACE_EXPORT_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+@contextmanager
+def span(fase: str, tipo: str | None = None, **attributi):
+    """
+    Misura la durata di una fase e la registra nell'istogramma `multiagent_stage_seconds`.
+    Il dict restituito può essere modificato dentro il blocco (es. dati["tipo"] = "vision" appena noto).
+    Se TRACE_EXPORT_FILE è impostato lo span viene anche esportato come riga JSON.
+    """
+    dati = {"tipo": tipo or _tipo_corrente.get(), **attributi}
+    start_wall, start = time.time(), time.perf_counter()
+    errore = None
+    try:
+        yield dati
+    except Exception as e:
+        errore = f"{type(e).__name__}: {e}"
+        STAGE_ERRORS.labels(fase=fase, tipo=dati["tipo"]).inc()
+        raise
+    finally:
+        durata = time.perf_counter() - start
+        STAGE_SECONDS.labels(fase=fase, tipo=dati["tipo"]).observe(durata)
+        _esporta_span({
+            **(_traccia_corrente.get() or {}),
+            "fase": fase,
+            "inizio": start_wall,
+            "durata_s": durata,
+            "errore": errore,
+            **dati,
+        })
+
+
+def osserva_chat(tipo: str, durata: float, esito: str = "ok"):
+    """Registra durata ed esito di una richiesta /chat completa."""
+    CHAT_REQUESTS.labels(tipo=tipo, esito=esito).inc()
+    CHAT_SECONDS.labels(tipo=tipo).observe(durata)
+
+
+def osserva_token_rag(strategia: str, prompt: int, cache: int = 0, risposta: int = 0):
+    """Registra i token di una chiamata LLM della strategia RAG `strategia`."""
+    for tipo, n in (("prompt", prompt), ("cache", cache), ("risposta", risposta)):
+        if n:
+            RAG_STRATEGY_TOKENS.labels(strategia=strategia, tipo=tipo).inc(n)
+
+
+def metriche_prometheus() -> tuple[bytes, str]:
+    """
+    Payload e content-type per l'endpoint /metrics.
+    Con più worker uvicorn impostare PROMETHEUS_MULTIPROC_DIR: le metriche di tutti i worker vengono aggregate.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
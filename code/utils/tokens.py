@@ -0,0 +1,16 @@
+import re
+
+# Stima del numero di token senza tokenizer locale: per Gemini ~4 caratteri per token su testo in lingue latine.
+CARATTERI_PER_TOKEN = 4
+
+_PAROLA = re.compile(r"\w+", re.UNICODE)
+
+
+def conta_token(testo: str) -> int:
+    """Numero stimato di token di un testo."""
+    return (len(testo) + CARATTERI_PER_TOKEN - 1) // CARATTERI_PER_TOKEN
+
+
+def parole(testo: str) -> list[str]:
+    """Parole in minuscolo (per punteggi lessicali)."""
+    return _PAROLA.findall(testo.lower())
@@ -1,5 +1,9 @@
-import re
+import contextvars, os, re, mimetypes, time
 from difflib import get_close_matches
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ..config import VLM_MAX_IMAGES, VLM_MAX_BYTES_PER_REQUEST, VLM_MAX_CONCURRENCY
+from .metrics import span, RAG_STRATEGY_SECONDS
+from ..loader.gemini_scheduler import get_scheduler, PRIORITA_INTERATTIVA
 
 # === TOOL: Dizionario con definizioni semplici e fuzzy matching ===
 def dizionario(termine: str) -> str:
@@ -24,14 +28,17 @@ def cerca_contenuti(query: str, rag_chain=None, chat_memory=None) -> str:
     """
     Cerca contenuti nel database vettoriale RAG usando anche la memoria della chat se disponibile.
     Ritorna solo il testo della risposta (campo "answer") come stringa.
+    La durata è registrata per strategia (retrieval o contesto completo, vedi rag/contesto_completo.py).
     """
     try:
         chat_memory = [] if chat_memory is None else chat_memory.messages
 
+        inizio = time.perf_counter()
         res = rag_chain.invoke({
             "input": query,
             "chat_history": chat_memory
         })
+        RAG_STRATEGY_SECONDS.labels(strategia=getattr(rag_chain, "strategia", "retrieval")).observe(time.perf_counter() - inizio)
 
         # Estraggo solo il testo finale
         if isinstance(res, dict):
@@ -45,35 +52,91 @@ def cerca_contenuti(query: str, rag_chain=None, chat_memory=None) -> str:
 
 
 # === TOOL: Vision Q&A con VLM ===
-def vlm_qna(query: str, image_paths: list[str], vision_model, chat_memory=None) -> str:
+def _mime_immagine(path: str) -> str:
+    """Rileva il MIME type dall'estensione del file (default: image/jpeg)."""
+    mime, _ = mimetypes.guess_type(path)
+    return mime if mime and mime.startswith("image/") else "image/jpeg"
+
+
+def raggruppa_immagini(image_paths: list[str], max_bytes: int) -> list[list[str]]:
+    """
+    Impacchetta le immagini (in ordine) in gruppi la cui dimensione totale rientra nel budget di byte.
+    Un'immagine più grande del budget finisce da sola in un gruppo.
+    """
+    gruppi, corrente, dimensione = [], [], 0
+    for p in image_paths:
+        size = os.path.getsize(p)
+        if corrente and dimensione + size > max_bytes:
+            gruppi.append(corrente)
+            corrente, dimensione = [], 0
+        corrente.append(p)
+        dimensione += size
+    if corrente:
+        gruppi.append(corrente)
+    return gruppi
+
+
+def _chiedi_al_vlm(query: str, paths: list[str], vision_model) -> str:
+    """Singola chiamata multimodale: domanda + immagini (etichettate col nome file se più di una)."""
+    parts = [{"text": query}]
+    for p in paths:
+        if len(paths) > 1:
+            parts.append({"text": f"Immagine: {os.path.basename(p)}"})
+        with open(p, "rb") as f:
+            parts.append({"mime_type": _mime_immagine(p), "data": f.read()})
+
+    with span("generazione_vlm", immagini=len(paths)):
+        response = get_scheduler().esegui(
+            getattr(vision_model, "model_name", "vlm"), lambda: vision_model.generate_content(parts),
+            priorita=PRIORITA_INTERATTIVA)
+    return response.text if hasattr(response, "text") else str(response)
+
+
+def vlm_qna(query: str, image_paths: list[str], vision_model, chat_memory=None,
+            max_images: int = VLM_MAX_IMAGES,
+            max_bytes: int = VLM_MAX_BYTES_PER_REQUEST,
+            max_concurrency: int = VLM_MAX_CONCURRENCY) -> str:
     """
     Esegue Q&A multimodale su una o più immagini con Gemini VLM.
     - query: testo della domanda
-    - image_paths: lista percorsi immagini (usa solo l'ultima di default)
+    - image_paths: lista percorsi immagini (usa le ultime `max_images`)
     - vision_model: modello VLM caricato
     - chat_memory: memoria conversazionale opzionale
+    Se le immagini rientrano in `max_bytes` parte una sola richiesta; altrimenti i gruppi
+    vengono inviati in parallelo (al massimo `max_concurrency`) e le risposte unite.
     """
     try:
-        # Prendo solo l’ultima immagine caricata
-        paths = image_paths[-1:] if image_paths else []
+        paths = image_paths[-max_images:] if image_paths else []
         if not paths:
             return "⚠️ Nessuna immagine caricata."
 
         if chat_memory:
             chat_memory.add_user_message(query)
 
-        # Costruisco input multimodale
-        parts = [{"text": query}]
-        for p in paths:
-            with open(p, "rb") as f:
-                parts.append({
-                    "mime_type": "image/jpeg",  # TODO: rilevare MIME dinamicamente
-                    "data": f.read()
-                })
+        gruppi = raggruppa_immagini(paths, max_bytes)
+
+        # Caso 1: tutto in una richiesta
+        if len(gruppi) == 1:
+            result = _chiedi_al_vlm(query, gruppi[0], vision_model)
+
+        # Caso 2: fan-out concorrente per gruppo + merge delle risposte (in ordine di caricamento)
+        else:
+            risposte = [None] * len(gruppi)
+            with ThreadPoolExecutor(max_workers=min(max_concurrency, len(gruppi))) as executor:
+                # copy_context: gli span VLM nei thread mantengono agente e traccia della richiesta
+                futures = {executor.submit(contextvars.copy_context().run, _chiedi_al_vlm, query, g, vision_model): i
+                           for i, g in enumerate(gruppi)}
+                for future in as_completed(futures):
+                    i = futures[future]
+                    try:
+                        risposte[i] = future.result()
+                    except Exception as e:
+                        risposte[i] = f"❌ Errore VLM Q&A: {str(e)}"
 
-        # Chiamata al modello VLM
-        response = vision_model.generate_content(parts)
-        result = response.text if hasattr(response, "text") else str(response)
+            result = "\n\n".join(
+                f"**{', '.join(os.path.basename(p) for p in g)}**\n{r}"
+                for g, r in zip(gruppi, risposte)
+            )
 
         if chat_memory:
             chat_memory.add_ai_message(result)
@@ -81,4 +144,4 @@ def vlm_qna(query: str, image_paths: list[str], vision_model, chat_memory=None)
         return result
 
     except Exception as e:
-        return f"❌ Errore VLM Q&A: {str(e)}"    
\ No newline at end of file
+        return f"❌ Errore VLM Q&A: {str(e)}"    